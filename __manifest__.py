@@ -9,14 +9,19 @@
     """,
     'author' : 'Ghaly',
     'caregory' : 'Tools',
-    'depends' : ['base', 'mail'],
+    'depends' : ['base', 'mail', 'bus'],
     'data' : [
         'security/ir.model.access.csv',
+        'security/ir_rule.xml',
+        'data/ir_sequence_data.xml',
+        'data/ir_cron_data.xml',
+        'data/loan_daily_stats_data.xml',
         'views/author_views.xml',
         'views/book_views.xml',
         'views/book_loan_views.xml',
         'views/library_dashboard.xml',
         'views/member_view.xml',
+        'views/loan_history_views.xml',
         'views/menu_views.xml',
     ],
     'demo' : [
@@ -41,6 +46,7 @@
             'individual_mod/static/src/css/chart_colors.css',
             'individual_mod/static/src/js/chart_loader.js',
             'individual_mod/static/src/js/chart_setup.js',
+            'individual_mod/static/src/js/dashboard_live.js',
             'individual_mod/static/src/js/dashboard_chart.js',
         ],
     },
@@ -1,48 +1,267 @@
 # -*- coding: utf-8 -*-
-from odoo import http
+from odoo import http, fields
 from odoo.http import request
+from odoo.addons.individual_mod.models.loan_export import EXPORT_FORMATS
+import gzip
 import json
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Payloads larger than this (bytes) are gzip-compressed when the client accepts it
+COMPRESSION_THRESHOLD = 1024
+
 class LibraryDashboardController(http.Controller):
-    
+
+    def _get_snapshot_model(self, company_id=None):
+        """Snapshot model bound to the requested company, among the companies allowed to the user"""
+        company = request.env.company
+        if company_id and int(company_id) in request.env.user.company_ids.ids:
+            company = request.env['res.company'].browse(int(company_id))
+        return request.env['custom.library.dashboard.snapshot'].with_company(company)
+
     @http.route('/library/dashboard/data', type='json', auth='user')
-    def get_dashboard_data(self):
-        """Return dashboard data for charts"""
+    def get_dashboard_data(self, refresh=False, version=None, company_id=None):
+        """Return dashboard data for charts from the latest stored snapshot.
+
+        Passing the `version` received from a previous call returns a short
+        "not modified" answer when the data did not change.
+        """
         try:
-            dashboard = request.env['custom.library.dashboard'].sudo()._get_default_dashboard()
+            Snapshot = self._get_snapshot_model(company_id)
+            snapshot = Snapshot._refresh() if refresh else Snapshot._get_latest()
+            return snapshot._get_payload(version)
+        except Exception as e:
+            _logger.error("Error loading dashboard data: %s", str(e))
+            return {
+                'success': False,
+                'message': f'Error loading data: {str(e)}',
+                'data': {}
+            }
+
+    def _make_json_response(self, get_payload, etag=None):
+        """JSON response of `get_payload()`, answering 304 when the client has `etag` and gzipped when large"""
+        headers = [
+            ('Cache-Control', 'private, no-cache'),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if etag:
+            headers.append(('ETag', etag))
+            if_none_match = request.httprequest.headers.get('If-None-Match', '')
+            if etag in [tag.strip() for tag in if_none_match.split(',')]:
+                return request.make_response('', headers=headers, status=304)
+
+        body = json.dumps(get_payload()).encode()
+        headers.append(('Content-Type', 'application/json'))
+        if len(body) > COMPRESSION_THRESHOLD and 'gzip' in request.httprequest.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        return request.make_response(body, headers=headers)
+
+    @http.route('/library/dashboard/data.json', type='http', auth='user', methods=['GET'])
+    def get_dashboard_data_http(self, company_id=None, section=None, **kwargs):
+        """Plain HTTP variant of the dashboard data, or of one `section`, with ETag and gzip support.
+
+        Used by the dashboard client, so browsers revalidate the data and
+        receive it compressed.
+        """
+        Snapshot = self._get_snapshot_model(company_id)
+        if not section:
+            snapshot = Snapshot._get_latest()
+            return self._make_json_response(
+                snapshot._get_payload, '"%s-%s"' % (snapshot.company_id.id, snapshot.data_version))
+
+        snapshot = Snapshot.search([('company_id', '=', Snapshot.env.company.id)], limit=1)
+
+        def get_section_payload():
+            try:
+                return {
+                    'success': True,
+                    'name': section,
+                    'data': Snapshot._get_section(section),
+                    'version': snapshot.data_version or None,
+                    'message': 'Data loaded successfully'
+                }
+            except Exception as e:
+                _logger.error("Error loading dashboard widget %s: %s", section, str(e))
+                return {
+                    'success': False,
+                    'name': section,
+                    'message': f'Error loading data: {str(e)}',
+                    'data': {}
+                }
+        if not snapshot:
+            return self._make_json_response(get_section_payload)
+        if snapshot._is_stale():
+            # Answered from the stale snapshot, even when not modified for the client
+            Snapshot._trigger_refresh()
+        return self._make_json_response(
+            get_section_payload, '"%s-%s-%s"' % (snapshot.company_id.id, snapshot.data_version, section))
+
+    @http.route('/library/dashboard/widget/<string:name>', type='json', auth='user')
+    def get_dashboard_widget(self, name, company_id=None):
+        """Return the data of a single dashboard section"""
+        try:
+            Snapshot = self._get_snapshot_model(company_id)
+            data = Snapshot._get_section(name)
+            snapshot = Snapshot.search([('company_id', '=', Snapshot.env.company.id)], limit=1)
             return {
                 'success': True,
-                'data': json.loads(dashboard.graph_data) if dashboard.graph_data else {},
+                'name': name,
+                'data': data,
+                'version': snapshot.data_version or None,
                 'message': 'Data loaded successfully'
             }
         except Exception as e:
-            _logger.error("Error loading dashboard data: %s", str(e))
+            _logger.error("Error loading dashboard widget %s: %s", name, str(e))
             return {
                 'success': False,
+                'name': name,
                 'message': f'Error loading data: {str(e)}',
                 'data': {}
             }
-            
+
     @http.route('/library/dashboard/refresh', type='json', auth='user')
-    def refresh_dashboard_data(self):
-        """Refresh dashboard data by recomputing graph data"""
+    def refresh_dashboard_data(self, version=None, company_id=None):
+        """Refresh dashboard data by rebuilding the company snapshot"""
         try:
-            dashboard = request.env['custom.library.dashboard'].sudo()._get_default_dashboard()
-            # Force recomputation of graph data
-            dashboard.invalidate_recordset(['graph_data'])
-            dashboard._compute_graph_data()
+            snapshot = self._get_snapshot_model(company_id)._refresh()
+            return snapshot._get_payload(version, 'Data refreshed successfully')
+        except Exception as e:
+            _logger.error("Error refreshing dashboard data: %s", str(e))
+            return {
+                'success': False,
+                'message': f'Error refreshing data: {str(e)}',
+                'data': {}
+            }
+
+    @http.route('/library/dashboard/profile', type='json', auth='user')
+    def get_dashboard_profile(self, refresh=False, company_id=None):
+        """Return the dashboard profiling history and per-section averages (administrators only)"""
+        if not request.env.user.has_group('base.group_system'):
+            return {
+                'success': False,
+                'message': 'Access denied',
+                'data': {}
+            }
+        try:
+            Snapshot = self._get_snapshot_model(company_id)
+            if refresh:
+                Snapshot._refresh()
             return {
                 'success': True,
-                'data': json.loads(dashboard.graph_data) if dashboard.graph_data else {},
-                'message': 'Data refreshed successfully'
+                'data': request.env['custom.library.dashboard.profile']._get_report(Snapshot.env.company),
+                'message': 'Data loaded successfully'
             }
         except Exception as e:
-            _logger.error("Error refreshing dashboard data: %s", str(e))
+            _logger.error("Error loading dashboard profile: %s", str(e))
             return {
                 'success': False,
-                'message': f'Error refreshing data: {str(e)}',
+                'message': f'Error loading data: {str(e)}',
+                'data': {}
+            }
+
+    @http.route('/library/import/<string:kind>', type='http', auth='user', methods=['POST'])
+    def import_csv(self, kind, file=None, batch_size=None, delimiter=',', **kwargs):
+        """Stream an uploaded CSV file of books, members or loans into the bulk importer"""
+        if kind not in ('books', 'members', 'loans') or file is None:
+            return request.not_found()
+        try:
+            report = request.env['custom.library.bulk.import']._import_csv(
+                kind, file.stream, batch_size=int(batch_size or 5000), delimiter=delimiter)
+            return request.make_json_response({
+                'success': True,
+                'data': report,
+                'message': 'Import finished'
+            })
+        except Exception as e:
+            _logger.error("Error importing %s: %s", kind, str(e))
+            return request.make_json_response({
+                'success': False,
+                'message': f'Error importing data: {str(e)}',
+                'data': {}
+            })
+
+    @http.route('/library/analytics', type='json', auth='user')
+    def get_analytics(self, date_from=None, date_to=None, company_id=None, genre_id=None,
+                      membership_type=None, granularity='month', sections=None):
+        """Return dashboard sections for a date range, genre, membership type and granularity"""
+        try:
+            data = self._get_snapshot_model(company_id).env['custom.library.analytics']._get_analytics(
+                sections=sections,
+                date_from=date_from,
+                date_to=date_to,
+                genre_id=genre_id,
+                membership_type=membership_type,
+                granularity=granularity,
+            )
+            return {
+                'success': True,
+                'data': data,
+                'message': 'Data loaded successfully'
+            }
+        except Exception as e:
+            _logger.error("Error loading library analytics: %s", str(e))
+            return {
+                'success': False,
+                'message': f'Error loading data: {str(e)}',
+                'data': {}
+            }
+
+    @http.route('/library/books/search', type='json', auth='user')
+    def search_books(self, query=None, limit=20, company_id=None):
+        """Ranked catalogue search by title, author name or ISBN"""
+        try:
+            Book = self._get_snapshot_model(company_id).env['custom.book']
+            return {
+                'success': True,
+                'data': Book._search_catalogue(query, limit=min(max(int(limit), 1), 100)),
+                'message': 'Data loaded successfully'
+            }
+        except Exception as e:
+            _logger.error("Error searching books: %s", str(e))
+            return {
+                'success': False,
+                'message': f'Error searching books: {str(e)}',
+                'data': []
+            }
+
+    @http.route('/library/api/<string:resource>', type='json', auth='user')
+    def get_resource_page(self, resource, fields=None, limit=80, token=None, sort=None, company_id=None):
+        """Page through loans, books or members; pass the returned `next_token` to get the next page"""
+        try:
+            Api = self._get_snapshot_model(company_id).env['custom.library.keyset.api']
+            return {
+                'success': True,
+                'data': Api._get_page(resource, field_names=fields, limit=limit, token=token, sort=sort),
+                'message': 'Data loaded successfully'
+            }
+        except Exception as e:
+            _logger.error("Error loading %s page: %s", resource, str(e))
+            return {
+                'success': False,
+                'message': f'Error loading data: {str(e)}',
+                'data': {}
+            }
+
+    @http.route('/library/export/loans', type='http', auth='user', methods=['GET'])
+    def export_loans(self, date_from=None, date_to=None, state=None, format='csv', company_id=None, **kwargs):
+        """Stream the loan and fine history as CSV or XLSX, filtered by loan date and status"""
+        try:
+            Export = self._get_snapshot_model(company_id).env['custom.library.loan.export']
+            filters = Export._normalize_filters(date_from, date_to, state)
+            stream = Export._stream(format, filters)
+        except Exception as e:
+            _logger.error("Error exporting loans: %s", str(e))
+            return request.make_json_response({
+                'success': False,
+                'message': f'Error exporting data: {str(e)}',
                 'data': {}
-            } 
\ No newline at end of file
+            }, status=400)
+        content_type, extension = EXPORT_FORMATS[format]
+        filename = 'loans_%s.%s' % (fields.Date.to_string(fields.Date.context_today(Export)), extension)
+        return request.make_response(stream, headers=[
+            ('Content-Type', content_type),
+            ('Content-Disposition', 'attachment; filename="%s"' % filename),
+            ('Cache-Control', 'no-store'),
+        ])
@@ -2,12 +2,54 @@
 from odoo import models, fields, api, _
 import json
 import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as futures_wait
 from dateutil.relativedelta import relativedelta
 from datetime import datetime
+from .dashboard_profile import QueryProfiler
 from calendar import monthrange
 
 _logger = logging.getLogger(__name__)
 
+# Dashboard sections (graph_data keys) and the method building each of them
+DASHBOARD_SECTIONS = {
+    'loan_trend': '_get_loan_trend_data',
+    'book_categories': '_get_book_categories_data',
+    'book_acquisitions': '_get_book_acquisitions_data',
+    'loan_status': '_get_loan_status_data',
+    'member_activities': '_get_member_activities_data',
+    'book_condition': '_get_book_condition_data',
+    'revenue': '_get_revenue_data',
+    'reading_times': '_get_reading_times_data',
+    'reading_heatmap': '_get_reading_heatmap_data',
+    'loan_durations': '_get_loan_durations_data',
+}
+
+# Membership types shown by the member charts: (value, label, RGB color)
+MEMBERSHIP_TYPES = [
+    ('standard', 'Standard Members', '54, 162, 235'),
+    ('premium', 'Premium Members', '255, 99, 132'),
+    ('student', 'Student Members', '75, 192, 192'),
+    ('senior', 'Senior Members', '255, 159, 64'),
+]
+
+# Loan duration histogram buckets: (label, first day, last day or None)
+DURATION_BUCKETS = [
+    ('0-7 days', 0, 7),
+    ('8-14 days', 8, 14),
+    ('15-21 days', 15, 21),
+    ('22-28 days', 22, 28),
+    ('29+ days', 29, None),
+]
+
+# Number of threads building sections in parallel (0 or 1 = sequential)
+PARALLEL_WORKERS_PARAM = 'individual_mod.dashboard_parallel_workers'
+# Seconds after which a section still being built is replaced by a placeholder,
+# also the statement timeout of the worker cursors
+SECTION_TIMEOUT_PARAM = 'individual_mod.dashboard_section_timeout'
+DEFAULT_SECTION_TIMEOUT = 30
+
 class LibraryDashboard(models.Model):
     _name = 'custom.library.dashboard'
     _description = 'Library Dashboard'
@@ -21,6 +63,8 @@ class LibraryDashboard(models.Model):
     total_revenue_mtd = fields.Monetary('Revenue MTD', compute='_compute_revenue')
     total_revenue_ytd = fields.Monetary('Revenue YTD', compute='_compute_revenue')
     average_loan_duration = fields.Float('Avg Loan Duration (days)', compute='_compute_statistics')
+    median_loan_duration = fields.Float('Median Loan Duration (days)', compute='_compute_statistics')
+    p90_loan_duration = fields.Float('P90 Loan Duration (days)', compute='_compute_statistics')
     
     most_borrowed_genre_id = fields.Many2one('custom.book.genre', string='Most Borrowed Genre', compute='_compute_statistics')
     most_active_member_id = fields.Many2one('res.partner', string='Most Active Member', compute='_compute_statistics')
@@ -102,51 +146,134 @@ class LibraryDashboard(models.Model):
         except Exception as e:
             _logger.error("Failed to initialize dashboard: %s", e)
     
+    def _get_dashboard_company(self):
+        """Company the dashboard figures are restricted to"""
+        return self[:1].company_id or self.env.company
+    
+    def _company_domain(self):
+        # Records without company are shared by every branch
+        return [('company_id', 'in', [self._get_dashboard_company().id, False])]
+    
+    def _get_filters(self):
+        """Analytics filters (date range, genre, membership type, granularity) given in context"""
+        return self.env.context.get('dashboard_filters') or {}
+    
+    def _get_window(self, months=None):
+        """Return (granularity, periods, date_to) of the time series charts"""
+        filters = self._get_filters()
+        TimeSeries = self.env['custom.library.timeseries']
+        granularity = filters.get('granularity') or 'month'
+        date_to = filters.get('date_to') or fields.Date.today()
+        date_from = filters.get('date_from')
+        if not date_from:
+            # Default window in months, whatever the bucket size
+            months = months or TimeSeries._get_window_months()
+            date_from = TimeSeries._truncate(date_to, 'month') - relativedelta(months=months - 1)
+        return granularity, TimeSeries._count_periods(date_from, date_to, granularity), date_to
+    
+    def _get_date_range(self, days):
+        """Return the filtered date range, the last `days` days by default"""
+        filters = self._get_filters()
+        date_to = filters.get('date_to') or fields.Date.today()
+        date_from = filters.get('date_from') or date_to - relativedelta(days=days)
+        return date_from, date_to
+    
+    def _get_filter_where(self, date_column=None, genre_column=None, membership_column=None):
+        """SQL conditions and bound parameters for the company and the analytics filters.
+
+        Only the given columns are filtered; the date range only applies when
+        the filters carry one.
+        """
+        filters = self._get_filters()
+        clauses = ['(company_id = %s OR company_id IS NULL)']
+        params = [self._get_dashboard_company().id]
+        if date_column and filters.get('date_from'):
+            clauses.append('%s >= %%s' % date_column)
+            params.append(filters['date_from'])
+        if date_column and filters.get('date_to'):
+            clauses.append('%s <= %%s' % date_column)
+            params.append(filters['date_to'])
+        if genre_column and filters.get('genre_id'):
+            clauses.append('%s = %%s' % genre_column)
+            params.append(filters['genre_id'])
+        if membership_column and filters.get('membership_type'):
+            clauses.append('%s = %%s' % membership_column)
+            params.append(filters['membership_type'])
+        return ' AND '.join(clauses), params
+    
+    def _get_loan_filter_where(self, date_column=None):
+        """Same as _get_filter_where() for the loan history, whose genre and membership type are joined"""
+        return self._get_filter_where(
+            date_column,
+            genre_column='(SELECT genre_id FROM custom_book WHERE id = book_id)',
+            membership_column="""(SELECT membership_type FROM custom_library_member
+                                  WHERE partner_id = member_id ORDER BY id LIMIT 1)""",
+        )
+    
+    def _assign_from_snapshot(self, fnames):
+        """Fill fields from the company snapshot unless a live computation is requested"""
+        if self.env.context.get('dashboard_live'):
+            return False
+        Snapshot = self.env['custom.library.dashboard.snapshot'].sudo()
+        for record in self:
+            snapshot = Snapshot._get_latest(record.company_id or self.env.company)
+            for fname in fnames:
+                record[fname] = snapshot[fname]
+        return True
+    
     @api.depends()
     def _compute_counts(self):
+        if self._assign_from_snapshot(['book_count', 'loan_count', 'overdue_count', 'member_count']):
+            return
         for record in self:
-            record.book_count = self.env['custom.book'].search_count([])
-            record.loan_count = self.env['custom.book.loan'].search_count([])
-            record.overdue_count = self.env['custom.book.loan'].search_count([('state', '=', 'overdue')])
-            record.member_count = self.env['custom.library.member'].search_count([])
+            company_domain = record._company_domain()
+            record.book_count = self.env['custom.book'].search_count(company_domain)
+            # Loan totals come from the daily rollup instead of scanning every loan
+            self.env.cr.execute("""
+                SELECT COALESCE(SUM(loan_count), 0),
+                       COALESCE(SUM(loan_count) FILTER (WHERE state = 'overdue'), 0)
+                FROM custom_library_loan_daily_stats_current
+                WHERE company_id = %s OR company_id IS NULL
+            """, [record._get_dashboard_company().id])
+            record.loan_count, record.overdue_count = self.env.cr.fetchone()
+            record.member_count = self.env['custom.library.member'].search_count(company_domain)
     
     @api.depends()
     def _compute_revenue(self):
+        if self._assign_from_snapshot(['total_revenue_mtd', 'total_revenue_ytd', 'revenue_growth']):
+            return
         for record in self:
             today = fields.Date.today()
-            
-            # Calculate MTD revenue (Month To Date)
             first_day_of_month = today.replace(day=1)
-            mtd_loans = self.env['custom.book.loan'].search([
-                ('actual_return_date', '>=', first_day_of_month),
-                ('actual_return_date', '<=', today),
-                ('state', '=', 'returned'),
-                ('fine_amount', '>', 0)
-            ])
-            record.total_revenue_mtd = sum(mtd_loans.mapped('fine_amount'))
-            
-            # Calculate YTD revenue (Year To Date)
             first_day_of_year = today.replace(month=1, day=1)
-            ytd_loans = self.env['custom.book.loan'].search([
-                ('actual_return_date', '>=', first_day_of_year),
-                ('actual_return_date', '<=', today),
-                ('state', '=', 'returned'),
-                ('fine_amount', '>', 0)
-            ])
-            record.total_revenue_ytd = sum(ytd_loans.mapped('fine_amount'))
+            prev_month_start = first_day_of_month - relativedelta(months=1)
             
-            # Calculate revenue growth
-            # Compare this month with previous month
-            prev_month_end = first_day_of_month - relativedelta(days=1)
-            prev_month_start = prev_month_end.replace(day=1)
-            
-            prev_month_loans = self.env['custom.book.loan'].search([
-                ('actual_return_date', '>=', prev_month_start),
-                ('actual_return_date', '<=', prev_month_end),
-                ('state', '=', 'returned'),
-                ('fine_amount', '>', 0)
-            ])
-            prev_month_revenue = sum(prev_month_loans.mapped('fine_amount'))
+            # MTD, YTD and previous month revenue in a single aggregate query,
+            # over the loan history since the year start may be archived already
+            self.env['custom.book.loan'].flush_model(['state', 'fine_amount', 'actual_return_date', 'company_id'])
+            self.env.cr.execute("""
+                SELECT
+                    COALESCE(SUM(fine_amount) FILTER (WHERE actual_return_date >= %(month_start)s), 0),
+                    COALESCE(SUM(fine_amount) FILTER (WHERE actual_return_date >= %(year_start)s), 0),
+                    COALESCE(SUM(fine_amount) FILTER (
+                        WHERE actual_return_date >= %(prev_month_start)s AND actual_return_date < %(month_start)s
+                    ), 0)
+                FROM custom_book_loan_history
+                WHERE state = 'returned'
+                  AND fine_amount > 0
+                  AND actual_return_date >= LEAST(%(year_start)s, %(prev_month_start)s)::date
+                  AND actual_return_date <= %(today)s
+                  AND (company_id = %(company_id)s OR company_id IS NULL)
+            """, {
+                'company_id': record._get_dashboard_company().id,
+                'month_start': first_day_of_month,
+                'year_start': first_day_of_year,
+                'prev_month_start': prev_month_start,
+                'today': today,
+            })
+            mtd_revenue, ytd_revenue, prev_month_revenue = self.env.cr.fetchone()
+            record.total_revenue_mtd = mtd_revenue
+            record.total_revenue_ytd = ytd_revenue
             
             # Calculate growth percentage
             if prev_month_revenue > 0:
@@ -156,40 +283,49 @@ class LibraryDashboard(models.Model):
     
     @api.depends()
     def _compute_statistics(self):
+        if self._assign_from_snapshot(['average_loan_duration', 'median_loan_duration', 'p90_loan_duration',
+                                       'most_borrowed_genre_id', 'most_active_member_id']):
+            return
         for record in self:
-            # Calculate average loan duration
-            returned_loans = self.env['custom.book.loan'].search([
-                ('state', '=', 'returned'),
-                ('actual_return_date', '!=', False)
-            ])
-            
-            if returned_loans:
-                # Calculate duration for each loan
-                durations = []
-                for loan in returned_loans:
-                    if loan.loan_date and loan.actual_return_date:
-                        duration = (loan.actual_return_date - loan.loan_date).days
-                        durations.append(duration)
-                
-                # Calculate average
-                if durations:
-                    record.average_loan_duration = sum(durations) / len(durations)
-                else:
-                    record.average_loan_duration = 0
+            company_id = record._get_dashboard_company().id
+            # Calculate average loan duration from the daily rollup
+            self.env.cr.execute("""
+                SELECT SUM(duration_days), SUM(returned_count)
+                FROM custom_library_loan_daily_stats_current
+                WHERE state = 'returned'
+                  AND (company_id = %s OR company_id IS NULL)
+            """, [company_id])
+            total_days, returned_count = self.env.cr.fetchone()
+            if returned_count:
+                record.average_loan_duration = total_days / returned_count
             else:
                 record.average_loan_duration = 0
             
+            # Median and 90th percentile need the individual durations, archived loans included
+            where, params = record._get_loan_filter_where()
+            self.env.cr.execute("""
+                SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY actual_return_date - loan_date),
+                       percentile_cont(0.9) WITHIN GROUP (ORDER BY actual_return_date - loan_date)
+                FROM custom_book_loan_history
+                WHERE state = 'returned' AND actual_return_date IS NOT NULL
+                  AND {where}
+            """.format(where=where), params)
+            median, p90 = self.env.cr.fetchone()
+            record.median_loan_duration = median or 0
+            record.p90_loan_duration = p90 or 0
+            
             # Find most borrowed genre
             query = """
-                SELECT bg.id, COUNT(bl.id) as loan_count
-                FROM custom_book_genre bg
-                JOIN custom_book b ON b.genre_id = bg.id
-                JOIN custom_book_loan bl ON bl.book_id = b.id
-                GROUP BY bg.id
+                SELECT genre_id, SUM(loan_count) as loan_count
+                FROM custom_library_loan_daily_stats_current
+                WHERE genre_id IS NOT NULL
+                  AND (company_id = %s OR company_id IS NULL)
+                GROUP BY genre_id
+                HAVING SUM(loan_count) > 0
                 ORDER BY loan_count DESC
                 LIMIT 1
             """
-            self.env.cr.execute(query)
+            self.env.cr.execute(query, [company_id])
             result = self.env.cr.fetchone()
             
             if result and result[0]:
@@ -201,12 +337,14 @@ class LibraryDashboard(models.Model):
             query = """
                 SELECT m.partner_id, COUNT(bl.id) as loan_count
                 FROM custom_library_member m
-                JOIN custom_book_loan bl ON bl.member_id = m.partner_id
+                JOIN custom_book_loan_history bl ON bl.member_id = m.partner_id
+                WHERE (m.company_id = %(company_id)s OR m.company_id IS NULL)
+                  AND (bl.company_id = %(company_id)s OR bl.company_id IS NULL)
                 GROUP BY m.partner_id
                 ORDER BY loan_count DESC
                 LIMIT 1
             """
-            self.env.cr.execute(query)
+            self.env.cr.execute(query, {'company_id': company_id})
             result = self.env.cr.fetchone()
             
             if result and result[0]:
@@ -216,45 +354,12 @@ class LibraryDashboard(models.Model):
     
     @api.depends()
     def _compute_graph_data(self):
+        if self._assign_from_snapshot(['graph_data']):
+            return
         for record in self:
             try:
                 # Generate chart data using real data from models
-                
-                # 1. Loan Trends - Monthly loans for the last 6 months
-                loan_data = self._get_loan_trend_data()
-                
-                # 2. Book Categories - Distribution of books by genre
-                category_data = self._get_book_categories_data()
-                
-                # 3. Book Acquisitions - Monthly book acquisitions for the last 6 months
-                acquisitions_data = self._get_book_acquisitions_data()
-                
-                # 4. Loan Status - Distribution of loan statuses
-                loan_status_data = self._get_loan_status_data()
-                
-                # 5. Member Activities - Statistics on member activities
-                member_activities_data = self._get_member_activities_data()
-                
-                # 6. Book Condition - Distribution of books by condition
-                book_condition_data = self._get_book_condition_data()
-                
-                # 7. Revenue Data - Monthly revenue from fines/fees
-                revenue_data = self._get_revenue_data()
-                
-                # 8. Reading Times - Distribution of when books are borrowed
-                reading_times_data = self._get_reading_times_data()
-                
-                # Combine all data into the dashboard data structure
-                data = {
-                    'loan_trend': loan_data,
-                    'book_categories': category_data,
-                    'book_acquisitions': acquisitions_data,
-                    'loan_status': loan_status_data,
-                    'member_activities': member_activities_data,
-                    'book_condition': book_condition_data,
-                    'revenue': revenue_data,
-                    'reading_times': reading_times_data
-                }
+                data = self._build_sections()
                 
                 # Store as JSON
                 record.graph_data = json.dumps(data)
@@ -275,27 +380,148 @@ class LibraryDashboard(models.Model):
                     }
                 })
     
-    def _get_loan_trend_data(self):
-        """Get monthly loan data for the last 6 months"""
-        # Get the last 6 months
-        today = fields.Date.today()
-        months = []
-        labels = []
-        
-        for i in range(5, -1, -1):  # Last 6 months (including current)
-            month_start = today.replace(day=1) - relativedelta(months=i)
-            month_end = month_start + relativedelta(months=1) - relativedelta(days=1)
-            months.append((month_start, month_end))
-            labels.append(month_start.strftime('%b'))
-        
-        # Get loan counts for each month
-        loan_counts = []
-        for month_start, month_end in months:
-            count = self.env['custom.book.loan'].search_count([
-                ('loan_date', '>=', month_start),
-                ('loan_date', '<=', month_end)
-            ])
-            loan_counts.append(count)
+    def _build_sections(self, names=None):
+        """Build the given sections (all by default), in parallel when configured"""
+        names = list(names or DASHBOARD_SECTIONS)
+        ICP = self.env['ir.config_parameter'].sudo()
+        workers = int(ICP.get_param(PARALLEL_WORKERS_PARAM, 0) or 0)
+        # Worker threads need their own cursors, which test cursors do not allow
+        testing = getattr(threading.current_thread(), 'testing', False)
+        if workers > 1 and len(names) > 1 and not testing:
+            timeout = float(ICP.get_param(SECTION_TIMEOUT_PARAM, DEFAULT_SECTION_TIMEOUT) or DEFAULT_SECTION_TIMEOUT)
+            data, measurements = self._build_sections_parallel(names, workers, timeout)
+        else:
+            data, measurements = {}, []
+            for name in names:
+                data[name], measure = self._profile_section(name)
+                measurements.append(measure)
+        self.env['custom.library.dashboard.profile']._record(measurements)
+        return data
+    
+    def _profile_section(self, name):
+        """Build one section under the query profiler.
+
+        Returns the section data, or a placeholder when it fails, and the
+        measurement of the build.
+        """
+        profiler = QueryProfiler(name, 'section')
+        try:
+            with profiler, self.env.cr.savepoint(flush=False):
+                data = self._get_section_data(name)
+        except Exception as e:
+            _logger.error("Error generating dashboard section %s: %s", name, str(e))
+            data = self._get_placeholder_section(_('Error'))
+        return data, profiler.to_dict()
+    
+    def _build_sections_parallel(self, names, workers, timeout):
+        """Build sections on worker threads reading the same database snapshot.
+
+        The snapshot is exported by a transaction of its own, kept open until
+        the workers are done: PostgreSQL cannot export the snapshot of a
+        subtransaction, and callers may run in a savepoint. Each worker opens
+        its own read-only cursor and imports it, so every section sees the
+        same committed data. A section still running `timeout` seconds after
+        it started is replaced by a placeholder and its query is cancelled;
+        the statement timeout of the worker cursors bounds the queries of
+        abandoned sections as well.
+        """
+        with self.pool.cursor() as snapshot_cr:
+            snapshot_cr.execute("SELECT pg_export_snapshot()")
+            snapshot_id = snapshot_cr.fetchone()[0]
+            return self._run_section_workers(names, workers, timeout, snapshot_id)
+    
+    def _run_section_workers(self, names, workers, timeout, snapshot_id):
+        """Build the sections on `workers` threads importing the exported snapshot `snapshot_id`"""
+        registry, uid, su, context = self.pool, self.env.uid, self.env.su, dict(self.env.context)
+        dbname = self.env.cr.dbname
+        # Start time and database backend of the sections being built
+        started, backends = {}, {}
+        
+        def build(name):
+            threading.current_thread().dbname = dbname
+            with registry.cursor() as cr:
+                cr.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cr.execute("SET TRANSACTION SNAPSHOT %s", [snapshot_id])
+                cr.execute("SET TRANSACTION READ ONLY")
+                cr.execute("SET LOCAL statement_timeout = %s", [max(int(timeout * 1000), 1)])
+                backends[name] = cr._cnx.get_backend_pid()
+                started[name] = time.monotonic()
+                env = api.Environment(cr, uid, context, su=su)
+                return env[self._name]._profile_section(name)
+        
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library_dashboard')
+        try:
+            pending = {name: executor.submit(build, name) for name in names}
+            data, measurements = {}, []
+            while pending:
+                now = time.monotonic()
+                for name, future in list(pending.items()):
+                    if future.done():
+                        try:
+                            data[name], measure = future.result()
+                        except Exception as e:
+                            _logger.error("Error generating dashboard section %s: %s", name, str(e))
+                            data[name] = self._get_placeholder_section(_('Error'))
+                            measure = dict(QueryProfiler(name, 'section').to_dict(), error=str(e))
+                    elif name in started and now - started[name] >= timeout:
+                        _logger.warning("Dashboard section %s timed out after %ss", name, timeout)
+                        self._cancel_section_query(backends.get(name))
+                        data[name] = self._get_placeholder_section(_('Timed out'))
+                        measure = dict(QueryProfiler(name, 'section').to_dict(),
+                                       duration_ms=timeout * 1000, error='timeout')
+                    else:
+                        continue
+                    measurements.append(measure)
+                    del pending[name]
+                if pending:
+                    # Sections still queued have no deadline yet, check again within a second
+                    deadlines = [started[name] + timeout for name in pending if name in started]
+                    wait = min(deadlines + [now + 1]) - time.monotonic()
+                    futures_wait(list(pending.values()), timeout=max(wait, 0), return_when=FIRST_COMPLETED)
+            return {name: data[name] for name in names}, measurements
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _cancel_section_query(self, backend_pid):
+        """Cancel the query running for an abandoned section on its worker connection"""
+        if not backend_pid:
+            return
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("SELECT pg_cancel_backend(%s)", [backend_pid])
+        except Exception as e:
+            _logger.warning("Could not cancel the query of backend %s: %s", backend_pid, str(e))
+    
+    def _get_placeholder_section(self, label):
+        """Chart data shown in place of a section that could not be built"""
+        return {
+            'placeholder': True,
+            'labels': [label],
+            'datasets': [{
+                'label': 'Data unavailable',
+                'data': [0],
+                'backgroundColor': 'rgba(200, 200, 200, 0.7)',
+                'borderColor': 'rgba(200, 200, 200, 1)',
+            }]
+        }
+    
+    def _get_section_data(self, name):
+        """Build a single dashboard section"""
+        if name not in DASHBOARD_SECTIONS:
+            raise ValueError(_("Unknown dashboard section: %s", name))
+        return getattr(self, DASHBOARD_SECTIONS[name])()
+    
+    def _get_loan_trend_data(self, months=None):
+        """Get monthly loan data for the configured window"""
+        granularity, periods, date_to = self._get_window(months)
+        where, params = self._get_filter_where('day', 'genre_id', 'membership_type')
+        result = self.env['custom.library.timeseries']._get_series(
+            'custom_library_loan_daily_stats_current', 'day', {'count': 'SUM(loan_count)'},
+            granularity=granularity, periods=periods, date_to=date_to,
+            where=where, params=params,
+        )
+        labels = result['labels']
+        loan_counts = result['series']['count']
         
         return {
             'labels': labels,
@@ -321,12 +547,15 @@ class LibraryDashboard(models.Model):
             SELECT g.name, COUNT(b.id) as book_count
             FROM custom_book_genre g
             LEFT JOIN custom_book b ON b.genre_id = g.id
+                AND (b.company_id = %s OR b.company_id IS NULL)
             WHERE g.active = TRUE
+              AND (%s IS NULL OR g.id = %s)
             GROUP BY g.id, g.name
             ORDER BY book_count DESC
             LIMIT 5
         """
-        self.env.cr.execute(query)
+        genre_id = self._get_filters().get('genre_id')
+        self.env.cr.execute(query, [self._get_dashboard_company().id, genre_id, genre_id])
         results = self.env.cr.fetchall()
         
         if not results:
@@ -372,27 +601,17 @@ class LibraryDashboard(models.Model):
             }]
         }
     
-    def _get_book_acquisitions_data(self):
-        """Get monthly book acquisitions for the last 6 months"""
-        # Get the last 6 months
-        today = fields.Date.today()
-        months = []
-        labels = []
-        
-        for i in range(5, -1, -1):  # Last 6 months
-            month_start = today.replace(day=1) - relativedelta(months=i)
-            month_end = month_start + relativedelta(months=1) - relativedelta(days=1)
-            months.append((month_start, month_end))
-            labels.append(month_start.strftime('%b'))
-        
-        # Get new book counts for each month
-        acquisition_counts = []
-        for month_start, month_end in months:
-            count = self.env['custom.book'].search_count([
-                ('acquisition_date', '>=', month_start),
-                ('acquisition_date', '<=', month_end)
-            ])
-            acquisition_counts.append(count)
+    def _get_book_acquisitions_data(self, months=None):
+        """Get monthly book acquisitions for the configured window"""
+        granularity, periods, date_to = self._get_window(months)
+        where, params = self._get_filter_where('acquisition_date', 'genre_id')
+        result = self.env['custom.library.timeseries']._get_series(
+            'custom_book', 'acquisition_date', {'count': 'COUNT(*)'},
+            granularity=granularity, periods=periods, date_to=date_to,
+            where='active = TRUE AND ' + where, params=params,
+        )
+        labels = result['labels']
+        acquisition_counts = result['series']['count']
         
         return {
             'labels': labels,
@@ -414,10 +633,16 @@ class LibraryDashboard(models.Model):
         statuses = ['confirmed', 'returned', 'overdue', 'lost']
         status_labels = ['Active', 'Returned', 'Overdue', 'Lost']
         
-        status_counts = []
-        for status in statuses:
-            count = self.env['custom.book.loan'].search_count([('state', '=', status)])
-            status_counts.append(count)
+        where, params = self._get_filter_where('day', 'genre_id', 'membership_type')
+        self.env.cr.execute("""
+            SELECT state, SUM(loan_count)
+            FROM custom_library_loan_daily_stats_current
+            WHERE state IN %s
+              AND {where}
+            GROUP BY state
+        """.format(where=where), [tuple(statuses)] + params)
+        counts_by_state = dict(self.env.cr.fetchall())
+        status_counts = [counts_by_state.get(status, 0) for status in statuses]
         
         # Ensure we have at least some data
         if all(count == 0 for count in status_counts):
@@ -452,96 +677,80 @@ class LibraryDashboard(models.Model):
     
     def _get_member_activities_data(self):
         """Get statistics on member activities by membership type"""
-        # Get member types and their activities
-        member_types = ['standard', 'premium', 'student', 'senior']
         labels = ['Loans', 'Returns', 'Overdue', 'Active Members', 'New Members']
-        
-        # Get loan counts for standard members
-        standard_data = self._get_member_type_activities('standard')
-        
-        # Get loan counts for premium members
-        premium_data = self._get_member_type_activities('premium')
+        filters = self._get_filters()
+        company_id = self._get_dashboard_company().id
+        date_from, date_to = self._get_date_range(30)
+        
+        # Every type in one pass: members (first record per contact, as in the
+        # daily statistics) joined to their loans
+        loan_clauses = ['(l.company_id = %(company_id)s OR l.company_id IS NULL)']
+        if filters.get('date_from'):
+            loan_clauses.append('l.loan_date >= %(date_from)s')
+        if filters.get('date_to'):
+            loan_clauses.append('l.loan_date <= %(date_to)s')
+        if filters.get('genre_id'):
+            loan_clauses.append('l.book_id IN (SELECT id FROM custom_book WHERE genre_id = %(genre_id)s)')
+        self.env.cr.execute("""
+            WITH members AS (
+                SELECT DISTINCT ON (partner_id) partner_id, membership_type, membership_date
+                FROM custom_library_member
+                WHERE (company_id = %(company_id)s OR company_id IS NULL)
+                  AND active = TRUE
+                ORDER BY partner_id, id
+            )
+            SELECT m.membership_type,
+                   COUNT(l.id),
+                   COUNT(l.id) FILTER (WHERE l.state = 'returned'),
+                   COUNT(l.id) FILTER (WHERE l.state = 'overdue'),
+                   COUNT(DISTINCT l.member_id),
+                   COUNT(DISTINCT m.partner_id) FILTER (
+                       WHERE m.membership_date >= %(date_from)s AND m.membership_date <= %(date_to)s
+                   )
+            FROM members m
+            LEFT JOIN custom_book_loan_history l ON l.member_id = m.partner_id AND {loan_where}
+            GROUP BY m.membership_type
+        """.format(loan_where=' AND '.join(loan_clauses)), {
+            'company_id': company_id,
+            'date_from': date_from,
+            'date_to': date_to,
+            'genre_id': filters.get('genre_id'),
+        })
+        activities = {row[0]: list(row[1:]) for row in self.env.cr.fetchall()}
+        
+        datasets = []
+        for membership_type, label, rgb in MEMBERSHIP_TYPES:
+            if filters.get('membership_type') and filters['membership_type'] != membership_type:
+                continue
+            datasets.append({
+                'label': label,
+                'data': activities.get(membership_type, [0, 0, 0, 0, 0]),
+                'fill': True,
+                'backgroundColor': 'rgba(%s, 0.2)' % rgb,
+                'borderColor': 'rgba(%s, 1)' % rgb,
+                'pointBackgroundColor': 'rgba(%s, 1)' % rgb,
+                'pointBorderColor': '#fff',
+                'pointHoverBackgroundColor': '#fff',
+                'pointHoverBorderColor': 'rgba(%s, 1)' % rgb
+            })
         
         return {
             'labels': labels,
-            'datasets': [
-                {
-                    'label': 'Standard Members',
-                    'data': standard_data,
-                    'fill': True,
-                    'backgroundColor': 'rgba(54, 162, 235, 0.2)',
-                    'borderColor': 'rgba(54, 162, 235, 1)',
-                    'pointBackgroundColor': 'rgba(54, 162, 235, 1)',
-                    'pointBorderColor': '#fff',
-                    'pointHoverBackgroundColor': '#fff',
-                    'pointHoverBorderColor': 'rgba(54, 162, 235, 1)'
-                },
-                {
-                    'label': 'Premium Members',
-                    'data': premium_data,
-                    'fill': True,
-                    'backgroundColor': 'rgba(255, 99, 132, 0.2)',
-                    'borderColor': 'rgba(255, 99, 132, 1)',
-                    'pointBackgroundColor': 'rgba(255, 99, 132, 1)',
-                    'pointBorderColor': '#fff',
-                    'pointHoverBackgroundColor': '#fff',
-                    'pointHoverBorderColor': 'rgba(255, 99, 132, 1)'
-                }
-            ]
+            'datasets': datasets
         }
     
-    def _get_member_type_activities(self, membership_type):
-        """Get activity data for a specific membership type"""
-        # Get all members of this type
-        members = self.env['custom.library.member'].search([
-            ('membership_type', '=', membership_type)
-        ])
-        
-        if not members:
-            return [0, 0, 0, 0, 0]
-        
-        member_ids = [m.partner_id.id for m in members]
-        
-        # Count total loans
-        loans_count = self.env['custom.book.loan'].search_count([
-            ('member_id', 'in', member_ids)
-        ])
-        
-        # Count returns
-        returns_count = self.env['custom.book.loan'].search_count([
-            ('member_id', 'in', member_ids),
-            ('state', '=', 'returned')
-        ])
-        
-        # Count overdue
-        overdue_count = self.env['custom.book.loan'].search_count([
-            ('member_id', 'in', member_ids),
-            ('state', '=', 'overdue')
-        ])
-        
-        # Count active members (made at least one loan)
-        active_members_count = len(self.env['custom.book.loan'].search([
-            ('member_id', 'in', member_ids)
-        ]).mapped('member_id'))
-        
-        # New members (last 30 days)
-        today = fields.Date.today()
-        last_month = today - relativedelta(days=30)
-        new_members_count = self.env['custom.library.member'].search_count([
-            ('membership_date', '>=', last_month),
-            ('membership_type', '=', membership_type)
-        ])
-        
-        return [loans_count, returns_count, overdue_count, active_members_count, new_members_count]
-    
     def _get_book_condition_data(self):
         """Get distribution of books by condition"""
         conditions = ['new', 'good', 'fair', 'poor', 'damaged']
         condition_labels = ['New', 'Good', 'Fair', 'Poor', 'Damaged']
         
+        book_domain = self._company_domain()
+        if self._get_filters().get('genre_id'):
+            book_domain += [('genre_id', '=', self._get_filters()['genre_id'])]
+        
         condition_counts = []
         for condition in conditions:
-            count = self.env['custom.book'].search_count([('condition', '=', condition)])
+            count = self.env['custom.book'].search_count([('condition', '=', condition)] + book_domain)
             condition_counts.append(count)
         
         # Ensure we have at least some data
@@ -566,33 +775,17 @@ class LibraryDashboard(models.Model):
             }]
         }
     
-    def _get_revenue_data(self):
-        """Get monthly revenue from fines for the last 6 months"""
-        # Get the last 6 months
-        today = fields.Date.today()
-        months = []
-        labels = []
-        
-        for i in range(5, -1, -1):  # Last 6 months
-            month_start = today.replace(day=1) - relativedelta(months=i)
-            month_end = month_start + relativedelta(months=1) - relativedelta(days=1)
-            months.append((month_start, month_end))
-            labels.append(month_start.strftime('%b'))
-        
-        # Calculate revenue from fines for each month
-        monthly_revenue = []
-        for month_start, month_end in months:
-            # Get all loans with fines in this month
-            loans = self.env['custom.book.loan'].search([
-                ('actual_return_date', '>=', month_start),
-                ('actual_return_date', '<=', month_end),
-                ('state', '=', 'returned'),
-                ('fine_amount', '>', 0)
-            ])
-            
-            # Sum all fines
-            revenue = sum(loans.mapped('fine_amount'))
-            monthly_revenue.append(revenue)
+    def _get_revenue_data(self, months=None):
+        """Get monthly revenue from fines for the configured window"""
+        granularity, periods, date_to = self._get_window(months)
+        where, params = self._get_loan_filter_where('actual_return_date')
+        result = self.env['custom.library.timeseries']._get_series(
+            'custom_book_loan_history', 'actual_return_date', {'revenue': 'SUM(fine_amount)'},
+            granularity=granularity, periods=periods, date_to=date_to,
+            where="state = 'returned' AND fine_amount > 0 AND " + where, params=params,
+        )
+        labels = result['labels']
+        monthly_revenue = result['series']['revenue']
         
         return {
             'labels': labels,
@@ -614,18 +807,20 @@ class LibraryDashboard(models.Model):
         days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
         weekday_counts = [0, 0, 0, 0, 0, 0, 0]
         
-        # Get all loans from the past year
-        today = fields.Date.today()
-        last_year = today - relativedelta(years=1)
-        
-        loans = self.env['custom.book.loan'].search([
-            ('loan_date', '>=', last_year)
-        ])
-        
-        # Count loans by day of week
-        for loan in loans:
-            weekday = loan.loan_date.weekday()  # 0 = Monday, 6 = Sunday
-            weekday_counts[weekday] += 1
+        # Loans of the past year unless a date range is given
+        date_from, date_to = self._get_date_range(365)
+        where, params = self._get_filter_where(genre_column='genre_id', membership_column='membership_type')
+        
+        # Count loans by day of week (ISODOW: 1 = Monday, 7 = Sunday)
+        self.env.cr.execute("""
+            SELECT EXTRACT(ISODOW FROM day)::int, SUM(loan_count)
+            FROM custom_library_loan_daily_stats_current
+            WHERE day >= %s AND day <= %s
+              AND {where}
+            GROUP BY 1
+        """.format(where=where), [date_from, date_to] + params)
+        for isodow, count in self.env.cr.fetchall():
+            weekday_counts[isodow - 1] = count
         
         # Split into weekday and weekend data
         weekday_data = weekday_counts[:5] + [0, 0]
@@ -657,6 +852,105 @@ class LibraryDashboard(models.Model):
             ]
         }
     
+    def _get_reading_heatmap_data(self):
+        """Borrowing activity by day of week and month (or week of year) in one grouped query"""
+        days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        TimeSeries = self.env['custom.library.timeseries']
+        granularity = 'week' if self._get_filters().get('granularity') == 'week' else 'month'
+        date_from, date_to = self._get_date_range(365)
+        buckets = TimeSeries._get_buckets(granularity, TimeSeries._count_periods(date_from, date_to, granularity), date_to)
+        where, params = self._get_filter_where(genre_column='genre_id', membership_column='membership_type')
+        
+        self.env.cr.execute("""
+            SELECT EXTRACT(ISODOW FROM day)::int, date_trunc(%s, day)::date, SUM(loan_count)
+            FROM custom_library_loan_daily_stats_current
+            WHERE day >= %s AND day <= %s
+              AND {where}
+            GROUP BY 1, 2
+        """.format(where=where), [granularity, date_from, date_to] + params)
+        counts = {(isodow, bucket): count for isodow, bucket, count in self.env.cr.fetchall()}
+        
+        data = [[counts.get((isodow, bucket), 0) for bucket in buckets] for isodow in range(1, 8)]
+        return {
+            'labels': [TimeSeries._format_bucket(bucket, granularity, len(buckets)) for bucket in buckets],
+            'rows': days,
+            'data': data,
+            'max': max([count for row in data for count in row] or [0]),
+        }
+    
+    def _get_loan_durations_data(self):
+        """Histogram of returned loan durations by membership type and by genre"""
+        labels = [label for label, first, last in DURATION_BUCKETS]
+        bucket_case = 'CASE %s ELSE %s END' % (
+            ' '.join('WHEN l.actual_return_date - l.loan_date <= %s THEN %s' % (last, index)
+                     for index, (label, first, last) in enumerate(DURATION_BUCKETS) if last is not None),
+            len(DURATION_BUCKETS) - 1,
+        )
+        where, params = self._get_loan_filter_where('actual_return_date')
+        
+        # Both breakdowns in one pass with grouping sets
+        self.env.cr.execute("""
+            WITH durations AS (
+                SELECT {bucket_case} AS bucket, b.genre_id, m.membership_type
+                FROM (
+                    SELECT id, book_id, member_id, loan_date, actual_return_date
+                    FROM custom_book_loan_history
+                    WHERE state = 'returned' AND actual_return_date IS NOT NULL
+                      AND {where}
+                ) l
+                LEFT JOIN custom_book b ON b.id = l.book_id
+                LEFT JOIN LATERAL (
+                    SELECT membership_type FROM custom_library_member
+                    WHERE partner_id = l.member_id
+                    ORDER BY id
+                    LIMIT 1
+                ) m ON TRUE
+            )
+            SELECT bucket, membership_type, genre_id, GROUPING(genre_id), COUNT(*)
+            FROM durations
+            GROUP BY GROUPING SETS ((bucket, membership_type), (bucket, genre_id))
+        """.format(where=where, bucket_case=bucket_case), params)
+        
+        by_type, by_genre = {}, {}
+        for bucket, membership_type, genre_id, by_type_row, count in self.env.cr.fetchall():
+            if by_type_row:
+                by_type.setdefault(membership_type, [0] * len(labels))[bucket] += count
+            else:
+                by_genre.setdefault(genre_id, [0] * len(labels))[bucket] += count
+        
+        datasets = [{
+            'label': label,
+            'data': by_type.get(membership_type, [0] * len(labels)),
+            'backgroundColor': 'rgba(%s, 0.7)' % rgb,
+            'borderColor': 'rgba(%s, 1)' % rgb,
+            'borderWidth': 1,
+            'stack': 'durations'
+        } for membership_type, label, rgb in MEMBERSHIP_TYPES if membership_type in by_type]
+        
+        # Five most borrowed genres, the others grouped together
+        colors = ['255, 99, 132', '54, 162, 235', '255, 206, 86', '75, 192, 192', '153, 102, 255', '199, 199, 199']
+        genres = sorted((genre_id for genre_id in by_genre if genre_id), key=lambda genre_id: -sum(by_genre[genre_id]))
+        other = [0] * len(labels)
+        for genre_id in genres[5:] + ([None] if None in by_genre else []):
+            other = [a + b for a, b in zip(other, by_genre[genre_id])]
+        genre_rows = [(self.env['custom.book.genre'].browse(genre_id).display_name, by_genre[genre_id]) for genre_id in genres[:5]]
+        if any(other):
+            genre_rows.append((_('Other'), other))
+        genre_datasets = [{
+            'label': name,
+            'data': data,
+            'backgroundColor': 'rgba(%s, 0.7)' % color,
+            'borderColor': 'rgba(%s, 1)' % color,
+            'borderWidth': 1,
+            'stack': 'durations'
+        } for (name, data), color in zip(genre_rows, colors)]
+        
+        return {
+            'labels': labels,
+            'datasets': datasets,
+            'genre_datasets': genre_datasets,
+        }
+    
     def action_view_books(self):
         return {
             'name': _('Books'),
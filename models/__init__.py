@@ -1,6 +1,24 @@
+from . import bulk_workflow
+from . import dashboard_notify
 from . import book  
 from . import author
+from . import timeseries
 from . import LibraryDashboard
+from . import dashboard_snapshot
+from . import dashboard_profile
+from . import cron_progress
 from . import bookloan
+from . import loan_archive
 from . import library_member
-from . import book_genre
\ No newline at end of file
+from . import book_genre
+from . import loan_daily_stats
+from . import query_plan
+from . import data_factory
+from . import benchmark
+from . import ir_sequence
+from . import res_company
+from . import bulk_import
+from . import analytics
+from . import loan_export
+from . import keyset_api
+from . import ir_websocket
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+import copy
+import logging
+from datetime import timedelta
+from .LibraryDashboard import DASHBOARD_SECTIONS
+from .timeseries import GRANULARITIES
+
+_logger = logging.getLogger(__name__)
+
+# Largest number of buckets a time series request may ask for
+MAX_PERIODS = 400
+
+
+class LibraryAnalytics(models.AbstractModel):
+    """Dashboard sections for a date range and dimension filters.
+
+    Sections are built by the dashboard builders, which read the filters from
+    the ``dashboard_filters`` context key and pass every value as a bound
+    query parameter. Results are cached per user, allowed companies (some
+    sections count records under the record rules), company, filters, day,
+    snapshot data version and last logged data change, so they follow every
+    change and roll over at midnight; only date ranges of whole months are
+    cached, which bounds the number of cached entries. Callers get a copy of
+    the cached result.
+    """
+    _name = 'custom.library.analytics'
+    _description = 'Library Analytics'
+
+    @api.model
+    def _normalize_filters(self, date_from=None, date_to=None, genre_id=None, membership_type=None,
+                           granularity='month'):
+        """Validate the request parameters and return them as a hashable tuple of filters"""
+        try:
+            date_from = fields.Date.to_date(date_from) if date_from else None
+            date_to = fields.Date.to_date(date_to) if date_to else None
+            genre_id = int(genre_id) if genre_id else None
+        except (TypeError, ValueError) as e:
+            raise UserError(_("Invalid analytics parameter: %s", e))
+        granularity = granularity or 'month'
+        if granularity not in GRANULARITIES:
+            raise UserError(_("Unsupported granularity: %s", granularity))
+        membership_types = dict(self.env['custom.library.member']._fields['membership_type'].selection)
+        if membership_type and membership_type not in membership_types:
+            raise UserError(_("Unknown membership type: %s", membership_type))
+        if date_from and date_to and date_from > date_to:
+            raise UserError(_("The start date must be before the end date"))
+        if date_from and self.env['custom.library.timeseries']._count_periods(
+                date_from, date_to or fields.Date.today(), granularity) > MAX_PERIODS:
+            raise UserError(_("The date range is too long for a %s granularity", granularity))
+        filters = {
+            'date_from': date_from,
+            'date_to': date_to,
+            'genre_id': genre_id,
+            'membership_type': membership_type or None,
+            'granularity': granularity,
+        }
+        return tuple(sorted((key, value) for key, value in filters.items() if value))
+
+    @api.model
+    def _get_analytics(self, sections=None, **params):
+        """Return the requested dashboard sections (all by default) for the given filters"""
+        sections = tuple(sections or DASHBOARD_SECTIONS)
+        unknown = [name for name in sections if name not in DASHBOARD_SECTIONS]
+        if unknown:
+            raise UserError(_("Unknown dashboard sections: %s", ', '.join(unknown)))
+        filters = self._normalize_filters(**params)
+        if not self._is_cacheable(filters):
+            return self._compute_analytics(self.env.company.id, filters, sections)
+        # The snapshot version lags the data until the next rebuild, the change log does not
+        version = (self.env['custom.library.dashboard.snapshot']._get_latest().data_version,
+                   self.env['custom.library.dashboard.change']._get_last_change())
+        # Ranges and windows without an end date run up to today
+        return copy.deepcopy(
+            self._get_cached_analytics(self.env.company.id, version, fields.Date.today(), filters, sections))
+
+    @api.model
+    def _is_cacheable(self, filters):
+        """Whether the date range starts on the first of a month and ends today or on the last day of a month"""
+        filters = dict(filters)
+        date_from, date_to = filters.get('date_from'), filters.get('date_to')
+        if date_from and date_from.day != 1:
+            return False
+        if date_to and date_to != fields.Date.today() and (date_to + timedelta(days=1)).day != 1:
+            return False
+        return True
+
+    @api.model
+    @tools.ormcache('self.env.uid', 'self.env.lang', 'tuple(self.env.companies.ids)', 'company_id', 'version',
+                    'today', 'filters', 'sections')
+    def _get_cached_analytics(self, company_id, version, today, filters, sections):
+        return self._compute_analytics(company_id, filters, sections)
+
+    @api.model
+    def _compute_analytics(self, company_id, filters, sections):
+        Dashboard = self.env['custom.library.dashboard'].with_company(company_id).with_context(
+            dashboard_live=True,
+            dashboard_filters=dict(filters),
+        )
+        return {name: Dashboard._get_section_data(name) for name in sections}
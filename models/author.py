@@ -6,19 +6,24 @@ class Author(models.Model):
     _inherit = ['mail.thread', 'mail.activity.mixin']
     _order = 'name asc'
 
-    name = fields.Char('Name', required=True, tracking=True)
+    name = fields.Char('Name', required=True, tracking=True, index='trigram')
     birth_date = fields.Date('Birth Date')
     biography = fields.Text('Biography')
     image = fields.Binary('Photo')
     active = fields.Boolean(default=True)
 
     book_ids = fields.One2many('custom.book', 'author_id', string='Books')
-    book_count = fields.Integer(compute='_compute_book_count', string='Books Count')
+    book_count = fields.Integer(compute='_compute_book_count', string='Books Count', store=True)
 
-    @api.depends('book_ids')
+    @api.depends('book_ids', 'book_ids.active')
     def _compute_book_count(self):
+        # One grouped query for the whole recordset instead of loading every book,
+        # counting the books of every company in the stored value
+        groups = self.env['custom.book'].sudo()._read_group(
+            [('author_id', 'in', self._origin.ids)], groupby=['author_id'], aggregates=['__count'])
+        counts = {author.id: count for author, count in groups}
         for author in self:
-            author.book_count = len(author.book_ids)
+            author.book_count = counts.get(author._origin.id, 0)
 
     def action_view_books(self):
         self.ensure_one()
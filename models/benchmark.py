@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+import gzip
+import json
+import logging
+import platform
+from .dashboard_profile import QueryProfiler
+from .LibraryDashboard import DASHBOARD_SECTIONS
+from .bookloan import OVERDUE_PROGRESS_JOB
+from .data_factory import FACTORY_LOAN_PREFIX
+
+_logger = logging.getLogger(__name__)
+
+# Loan volumes benchmarked by default, from a small library to a very large one
+DEFAULT_SCALES = (10000, 100000, 1000000, 10000000)
+LIST_LIMIT = 80
+
+
+class LibraryBenchmark(models.AbstractModel):
+    """Time the dashboard, its endpoints, the overdue cron and the list computes,
+    and check the query plans of the dashboard, list and cron queries.
+
+    Meant for a scratch database, e.g. from ``odoo shell``::
+
+        env['custom.library.benchmark']._run([10000, 100000], output='/tmp/library_bench.json')
+
+    The data factory and the overdue cron commit their batches.
+    """
+    _name = 'custom.library.benchmark'
+    _description = 'Library Benchmark'
+
+    @api.model
+    def _measure(self, name, kind, func, savepoint=True):
+        """Run `func` on a cold ORM cache and return its measurement.
+
+        Operations that commit their own batches must run without savepoint.
+        """
+        self.env.flush_all()
+        self.env.invalidate_all()
+        profiler = QueryProfiler(name, kind)
+        try:
+            with profiler:
+                if savepoint:
+                    with self.env.cr.savepoint():
+                        func()
+                else:
+                    func()
+        except Exception as e:
+            _logger.error("Benchmark %s %s failed: %s", kind, name, str(e))
+        return profiler.to_dict()
+
+    @api.model
+    def _run_scale(self):
+        """Measure every benchmarked operation on the data currently in the database"""
+        Dashboard = self.env['custom.library.dashboard'].with_context(dashboard_live=True)
+        Snapshot = self.env['custom.library.dashboard.snapshot']
+        Loan = self.env['custom.book.loan']
+        Member = self.env['custom.library.member']
+        Book = self.env['custom.book']
+        measurements = []
+
+        for name in DASHBOARD_SECTIONS:
+            measurements.append(self._measure(name, 'section', lambda name=name: Dashboard._get_section_data(name)))
+        dashboard = Dashboard.new({'name': 'Library Dashboard', 'company_id': self.env.company.id})
+        self.env.invalidate_all()
+        measurements.extend(Snapshot._read_kpis(dashboard)[1])
+
+        # Server side work of the controller routes, without the HTTP layer
+        measurements.append(self._measure('/library/dashboard/refresh', 'endpoint', lambda: json.dumps(
+            Snapshot._refresh()._get_payload())))
+        measurements.append(self._measure('/library/dashboard/data', 'endpoint', lambda: json.dumps(
+            Snapshot._get_latest()._get_payload())))
+        measurements.append(self._measure('/library/dashboard/data.json', 'endpoint', lambda: gzip.compress(
+            json.dumps(Snapshot._get_latest()._get_payload()).encode())))
+        for name in DASHBOARD_SECTIONS:
+            measurements.append(self._measure('/library/dashboard/data.json?section=%s' % name, 'endpoint',
+                                              lambda name=name: json.dumps(Snapshot._get_section(name))))
+
+        def overdue_cron():
+            self.env['custom.library.cron.progress']._set_progress(OVERDUE_PROGRESS_JOB, None, 'mark')
+            Loan._cron_check_overdue()
+        measurements.append(self._measure('_cron_check_overdue', 'cron', overdue_cron, savepoint=False))
+
+        measurements.append(self._measure('member_list', 'list', lambda: Member.search_read(
+            [], ['name', 'member_number', 'membership_type', 'loan_count', 'overdue_count', 'expiry_date'],
+            limit=LIST_LIMIT, order='stored_loan_count desc')))
+        measurements.append(self._measure('book_list', 'list', lambda: Book.search_read(
+            [], ['name', 'isbn', 'author_id', 'genre_id', 'state', 'loan_count'], limit=LIST_LIMIT)))
+        measurements.append(self._measure('loan_list', 'list', lambda: Loan.search_read(
+            [], ['name', 'book_id', 'member_id', 'loan_date', 'return_date', 'state', 'fine_amount'],
+            limit=LIST_LIMIT)))
+
+        def recompute_book_loan_count():
+            books = Book.with_context(active_test=False).search([])
+            self.env.add_to_compute(Book._fields['loan_count'], books)
+            books.flush_recordset(['loan_count'])
+        measurements.append(self._measure('book.loan_count', 'list', recompute_book_loan_count))
+        return measurements
+
+    @api.model
+    def _run(self, scales=DEFAULT_SCALES, output=None):
+        """Grow the generated data to each loan volume and benchmark it.
+
+        Returns the results and writes them as JSON to `output` when given, so
+        that runs can be compared.
+        """
+        Factory = self.env['custom.library.data.factory']
+        results = {
+            'started_at': fields.Datetime.to_string(fields.Datetime.now()),
+            'database': self.env.cr.dbname,
+            'python': platform.python_version(),
+            'runs': [],
+        }
+        for scale in sorted(scales):
+            self.env.cr.execute("SELECT COUNT(*) FROM custom_book_loan WHERE name LIKE %s", [FACTORY_LOAN_PREFIX + '%'])
+            existing = self.env.cr.fetchone()[0]
+            generate = self._measure('generate', 'factory', lambda: Factory._generate(max(scale - existing, 0)),
+                                     savepoint=False)
+            run = {
+                'scale': scale,
+                'generate': generate,
+                'counts': {},
+                'measurements': self._run_scale(),
+                # Indexes the planner actually picks at this volume
+                'query_plans': self.env['custom.library.query.plan']._check_query_plans(force_index=False),
+            }
+            for model in ('custom.author', 'custom.book.genre', 'custom.book', 'custom.library.member', 'custom.book.loan'):
+                run['counts'][model] = self.env[model].with_context(active_test=False).search_count([])
+            results['runs'].append(run)
+            _logger.info("Benchmark at %s loans: %s", scale, ', '.join(
+                '%s=%.0fms' % (m['name'], m['duration_ms']) for m in run['measurements']))
+            if output:
+                with open(output, 'w') as f:
+                    json.dump(results, f, indent=2)
+        return results
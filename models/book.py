@@ -1,4 +1,13 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+from odoo.osv import expression
+import re
+
+# Characters ignored when comparing ISBNs (hyphens, spaces), and the same in SQL
+ISBN_SEPARATORS = re.compile(r'[\s\-]+')
+ISBN_SEPARATORS_SQL = '[[:space:]-]+'
+# Results returned by the catalogue search
+CATALOGUE_SEARCH_LIMIT = 20
 
 class BookGenre(models.Model):
     _name = 'custom.book.genre'
@@ -16,16 +25,19 @@ class BookGenre(models.Model):
 class Book(models.Model):
     _name = 'custom.book'
     _description = 'Library Book'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'custom.library.bulk.workflow',
+                'custom.library.dashboard.notify']
 
-    name = fields.Char('Title', required=True, tracking=True)
+    name = fields.Char('Title', required=True, tracking=True, index='trigram')
     isbn = fields.Char('ISBN', required=True, tracking=True)
+    # ISBN without separators, used for exact (barcode) lookups
+    isbn_normalized = fields.Char('Normalized ISBN', compute='_compute_isbn_normalized', store=True, readonly=True)
     active = fields.Boolean(default=True)
     date_published = fields.Date('Date Published')  
     cover_image = fields.Binary('Cover Image')
 
-    author_id = fields.Many2one('custom.author', string='Author', tracking=True)
-    genre_id = fields.Many2one('custom.book.genre', string='Primary Genre', tracking=True)
+    author_id = fields.Many2one('custom.author', string='Author', tracking=True, index=True)
+    genre_id = fields.Many2one('custom.book.genre', string='Primary Genre', tracking=True, index=True)
     genre_ids = fields.Many2many('custom.book.genre', string='Genres')
 
     pages = fields.Integer('Number of Pages')
@@ -37,6 +49,8 @@ class Book(models.Model):
         string='Currency',
         default=lambda self: self.env.company.currency_id.id
     )
+    # Branch owning the book, empty for books shared by every branch
+    company_id = fields.Many2one('res.company', string='Company', default=lambda self: self.env.company, index=True)
 
     price = fields.Monetary('Price', currency_field='currency_id')
     
@@ -54,33 +68,211 @@ class Book(models.Model):
         ('fair', 'Fair'),
         ('poor', 'Poor'),
         ('damaged', 'Damaged')
-    ], string='Condition', default='new', tracking=True)
+    ], string='Condition', default='new', tracking=True, index=True)
     
     loan_ids = fields.One2many('custom.book.loan', 'book_id', string='Loans')
-    loan_count = fields.Integer(compute='_compute_loan_count', string='Loan Count')
+    loan_count = fields.Integer(compute='_compute_loan_count', string='Loan Count', store=True)
 
+    _sql_constraints = [
+        ('isbn_normalized_uniq', 'unique (isbn_normalized)', 'A book with this ISBN already exists')
+    ]
+
+    def _auto_init(self):
+        cr = self.env.cr
+        # Books whose ISBNs only differ by separators would break the unique
+        # normalized ISBN: refuse the upgrade until they are merged by hand
+        if tools.table_exists(cr, self._table) and not tools.constraint_definition(
+                cr, self._table, '%s_isbn_normalized_uniq' % self._table):
+            self._check_isbn_collisions()
+        return super(Book, self)._auto_init()
+    
+    @api.model
+    def _check_isbn_collisions(self):
+        """Raise a UserError listing the books sharing the same normalized ISBN"""
+        self.env.cr.execute("""
+            SELECT normalized, STRING_AGG(FORMAT('%%s (id %%s, ISBN %%s)', name, id, isbn), ', ' ORDER BY id)
+            FROM (
+                SELECT id, name, isbn, UPPER(REGEXP_REPLACE(isbn, %s, '', 'g')) AS normalized
+                FROM custom_book
+            ) b
+            WHERE normalized <> ''
+            GROUP BY normalized
+            HAVING COUNT(*) > 1
+            ORDER BY normalized
+        """, [ISBN_SEPARATORS_SQL])
+        collisions = self.env.cr.fetchall()
+        if collisions:
+            raise UserError(_(
+                "These books have the same ISBN once hyphens and spaces are removed. "
+                "Merge or correct them, then update the module again:\n%s",
+                '\n'.join('%s: %s' % (normalized, books) for normalized, books in collisions),
+            ))
+    
+    def init(self):
+        # Monthly acquisitions only count active books
+        tools.create_index(self.env.cr, 'custom_book_acquisition_date_active_idx', self._table,
+                           ['acquisition_date'], where='active = TRUE')
+        # Keyset pagination of the read API by title
+        tools.create_index(self.env.cr, 'custom_book_name_id_idx', self._table, ['name', 'id'])
+    
+    @api.model
+    def _normalize_isbn(self, isbn):
+        """Return the ISBN without hyphens and spaces, upper-cased"""
+        return ISBN_SEPARATORS.sub('', isbn).upper() if isbn else isbn
+    
+    @api.depends('isbn')
+    def _compute_isbn_normalized(self):
+        for book in self:
+            book.isbn_normalized = self._normalize_isbn(book.isbn) or False
+    
     @api.constrains('isbn')
     def _check_isbn(self):
         for book in self:
-            if book.isbn and len(book.isbn.replace('-', '')) != 13:
+            if book.isbn and len(book.isbn_normalized) != 13:
                 raise models.ValidationError('ISBN must be 13 digits')
     
+    @api.model
+    def _get_isbn_errors(self, isbns):
+        """Validate many ISBNs at once, returning {isbn: error message} for the invalid ones.
+
+        Applies the rule of _check_isbn and reports ISBNs already used by a
+        book of any company (the normalized ISBN is unique database-wide),
+        looked up with a single query.
+        """
+        errors = {}
+        for isbn in isbns:
+            if not isbn:
+                errors[isbn] = _('ISBN is required')
+            elif len(self._normalize_isbn(isbn)) != 13:
+                errors[isbn] = _('ISBN must be 13 digits')
+        # Every spelling of a normalized ISBN (hyphens, spaces) gets its own error
+        valid = {isbn: self._normalize_isbn(isbn) for isbn in isbns if isbn not in errors}
+        if valid:
+            existing = {book['isbn_normalized'] for book in self.sudo().with_context(active_test=False).search_read(
+                [('isbn_normalized', 'in', list(set(valid.values())))], ['isbn_normalized'])}
+            for isbn, normalized in valid.items():
+                if normalized in existing:
+                    errors[isbn] = _('A book with ISBN %s already exists', isbn)
+        return errors
+    
+    @api.model
+    def _name_search(self, name, domain=None, operator='ilike', limit=None, order=None):
+        """Exact lookup on the normalized ISBN first (barcode scans), then title, author or ISBN prefix"""
+        if not name or operator not in ('ilike', 'like', '=ilike', '=like', '='):
+            return super(Book, self)._name_search(name, domain, operator, limit, order)
+        domain = domain or []
+        isbn = self._normalize_isbn(name)
+        if isbn.isdigit() and len(isbn) == 13:
+            ids = self._search(expression.AND([domain, [('isbn_normalized', '=', isbn)]]), limit=limit, order=order)
+            if ids:
+                return ids
+        name_domain = ['|', ('name', operator, name), ('author_id.name', operator, name)]
+        if isbn.isdigit():
+            name_domain = expression.OR([name_domain, [('isbn_normalized', '=like', isbn + '%')]])
+        return self._search(expression.AND([domain, name_domain]), limit=limit, order=order)
+    
+    @api.model
+    def _search_catalogue(self, query, limit=CATALOGUE_SEARCH_LIMIT):
+        """Ranked search of the active books by title, author name or ISBN.
+
+        An ISBN is looked up on the unique normalized ISBN index. Otherwise
+        titles and author names matching the query, as a substring or by
+        trigram similarity, are ranked by similarity using the pg_trgm GIN
+        indexes; without pg_trgm this falls back to the name search.
+        """
+        query = (query or '').strip()
+        if not query:
+            return []
+        self.check_access_rights('read')
+        self.flush_model(['name', 'isbn_normalized', 'author_id', 'active', 'company_id', 'state'])
+        self.env['custom.author'].flush_model(['name'])
+        params = {
+            'query': query,
+            'isbn': self._normalize_isbn(query),
+            'pattern': '%%%s%%' % re.sub(r'([\\%_])', r'\\\1', query),
+            'company_ids': tuple(self.env.companies.ids),
+            'limit': limit,
+        }
+        select = """
+            SELECT b.id, b.name, b.isbn, a.name, b.state, {score}
+            FROM custom_book b
+            LEFT JOIN custom_author a ON a.id = b.author_id
+            WHERE b.active = TRUE
+              AND (b.company_id IS NULL OR b.company_id IN %(company_ids)s)
+              AND {where}
+            ORDER BY 6 DESC, b.name, b.id
+            LIMIT %(limit)s
+        """
+        self.env.cr.execute(select.format(score='1.0', where='b.isbn_normalized = %(isbn)s'), params)
+        rows = self.env.cr.fetchall()
+        if not rows:
+            if not self.env.registry.has_trigram:
+                books = self.browse(self._name_search(query, limit=limit))
+                return [{
+                    'id': book.id,
+                    'name': book.name,
+                    'isbn': book.isbn,
+                    'author': book.author_id.name or False,
+                    'state': book.state,
+                    'score': None,
+                } for book in books]
+            self.env.cr.execute(select.format(
+                score="GREATEST(similarity(b.name, %(query)s), similarity(COALESCE(a.name, ''), %(query)s))",
+                where="""b.id IN (
+                    SELECT id FROM custom_book
+                    WHERE name ILIKE %(pattern)s OR name %% %(query)s
+                    UNION
+                    SELECT book.id FROM custom_book book
+                    JOIN custom_author author ON author.id = book.author_id
+                    WHERE author.name ILIKE %(pattern)s OR author.name %% %(query)s
+                )""",
+            ), params)
+            rows = self.env.cr.fetchall()
+        return [{
+            'id': book_id,
+            'name': name,
+            'isbn': isbn,
+            'author': author or False,
+            'state': state,
+            'score': round(float(score), 3),
+        } for book_id, name, isbn, author, state, score in rows]
+    
+    def write(self, vals):
+        # Loans are counted under the genre of their book in the daily statistics,
+        # whichever company they belong to
+        loans = self.env['custom.book.loan'].sudo()
+        archived_loans = self.env['custom.book.loan.archive'].sudo()
+        if 'genre_id' in vals:
+            loans = loans.search([('book_id', 'in', self.ids)])
+            archived_loans = archived_loans.search([('book_id', 'in', self.ids)])
+        DailyStats = self.env['custom.library.loan.daily.stats']
+        DailyStats._apply_loan_delta(loans.ids, -1)
+        DailyStats._apply_loan_delta(archived_loans.ids, -1, table='custom_book_loan_archive')
+        res = super(Book, self).write(vals)
+        DailyStats._apply_loan_delta(loans.ids, 1)
+        DailyStats._apply_loan_delta(archived_loans.ids, 1, table='custom_book_loan_archive')
+        return res
+    
     @api.depends('loan_ids')
     def _compute_loan_count(self):
+        # One grouped query for the whole recordset instead of loading every loan,
+        # counting the loans of every company in the stored value
+        counts = {}
+        for model in ('custom.book.loan', 'custom.book.loan.archive'):
+            for book, count in self.env[model].sudo()._read_group(
+                    [('book_id', 'in', self._origin.ids)], groupby=['book_id'], aggregates=['__count']):
+                counts[book.id] = counts.get(book.id, 0) + count
         for book in self:
-            book.loan_count = len(book.loan_ids)
+            book.loan_count = counts.get(book._origin.id, 0)
     
     def action_marks_as_borrowed(self):
-        for book in self:
-            book.state = 'borrowed'
+        return self._write_workflow({'state': 'borrowed'}, _('Marked as borrowed'))
 
     def action_mark_as_available(self):
-        for book in self:
-            book.state = 'available'
+        return self._write_workflow({'state': 'available'}, _('Marked as available'))
     
     def action_mark_as_lost(self):
-        for book in self:
-            book.state = 'lost'
+        return self._write_workflow({'state': 'lost'}, _('Marked as lost'))
             
 
     
\ No newline at end of file
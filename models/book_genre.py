@@ -12,7 +12,7 @@ class BookGenre(models.Model):
     active = fields.Boolean(default=True)
     
     book_ids = fields.One2many('custom.book', 'genre_id', string='Books')
-    book_count = fields.Integer(compute='_compute_book_count', string='Book Count')
+    book_count = fields.Integer(compute='_compute_book_count', string='Book Count', store=True)
     
     color = fields.Integer('Color Index')
     sequence = fields.Integer('Sequence', default=10)
@@ -22,7 +22,17 @@ class BookGenre(models.Model):
         ('code_uniq', 'unique (code)', 'Genre code must be unique !')
     ]
     
-    @api.depends('book_ids')
+    def unlink(self):
+        # Loans of the deleted genres are counted under no genre in the daily statistics
+        self.env['custom.library.loan.daily.stats']._merge_into_empty_key('genre_id', self.ids)
+        return super(BookGenre, self).unlink()
+    
+    @api.depends('book_ids', 'book_ids.active')
     def _compute_book_count(self):
+        # One grouped query for the whole recordset instead of loading every book,
+        # counting the books of every company in the stored value
+        groups = self.env['custom.book'].sudo()._read_group(
+            [('genre_id', 'in', self._origin.ids)], groupby=['genre_id'], aggregates=['__count'])
+        counts = {genre.id: count for genre, count in groups}
         for genre in self:
-            genre.book_count = len(genre.book_ids) 
\ No newline at end of file
+            genre.book_count = counts.get(genre._origin.id, 0) 
\ No newline at end of file
@@ -1,17 +1,28 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from datetime import datetime, timedelta
+import logging
+import threading
+import time
+from .loan_daily_stats import DAILY_STATS_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+# Job name of the overdue cron in custom.library.cron.progress
+OVERDUE_PROGRESS_JOB = 'overdue_check'
+OVERDUE_BATCH_SIZE = 1000
 
 class BookLoan(models.Model):
     _name = 'custom.book.loan'
     _description = 'Book Loan'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'custom.library.bulk.workflow',
+                'custom.library.dashboard.notify']
     _order = 'loan_date desc'
 
     name = fields.Char('Reference', required=True, copy=False, readonly=True, 
                         default=lambda self: _('New'))
-    book_id = fields.Many2one('custom.book', string='Book', required=True)
-    member_id = fields.Many2one('res.partner', string='Member', required=True)
+    book_id = fields.Many2one('custom.book', string='Book', required=True, index=True)
+    member_id = fields.Many2one('res.partner', string='Member', required=True, index=True)
     
     loan_date = fields.Date('Loan Date', default=fields.Date.today, required=True)
     return_date = fields.Date('Return Date', compute='_compute_return_date', store=True)
@@ -28,10 +39,26 @@ class BookLoan(models.Model):
     loan_duration = fields.Integer('Loan Duration (days)', default=14)
     fine_amount = fields.Monetary('Fine Amount', compute='_compute_fine', store=True)
     currency_id = fields.Many2one('res.currency', related='company_id.currency_id')
-    company_id = fields.Many2one('res.company', default=lambda self: self.env.company)
+    company_id = fields.Many2one('res.company', default=lambda self: self.env.company, index=True)
     
     notes = fields.Text('Notes')
     
+    def init(self):
+        # Composite and partial indexes matching the dashboard and cron access paths
+        cr = self.env.cr
+        # Fine revenue per period (_compute_revenue, _get_revenue_data)
+        tools.create_index(cr, 'custom_book_loan_state_actual_return_date_idx', self._table,
+                           ['state', 'actual_return_date'], where='fine_amount > 0')
+        # Overdue cron, mark phase: confirmed loans past their return date
+        tools.create_index(cr, 'custom_book_loan_state_return_date_idx', self._table,
+                           ['state', 'return_date'])
+        # Overdue cron, fine phase: overdue loans walked in id order
+        tools.create_index(cr, 'custom_book_loan_overdue_id_idx', self._table,
+                           ['id'], where="state = 'overdue'")
+        # Default list order and loan date ranges
+        tools.create_index(cr, 'custom_book_loan_loan_date_id_idx', self._table,
+                           ['loan_date DESC', 'id DESC'])
+    
     @api.depends('loan_date', 'loan_duration')
     def _compute_return_date(self):
         for loan in self:
@@ -60,32 +87,152 @@ class BookLoan(models.Model):
             else:
                 loan.fine_amount = 0
     
-    @api.model
-    def create(self, vals):
-        if vals.get('name', _('New')) == _('New'):
-            vals['name'] = self.env['ir.sequence'].next_by_code('custom.book.loan') or _('New')
-        return super(BookLoan, self).create(vals)
+    @api.model_create_multi
+    def create(self, vals_list):
+        # Reserve the references of the whole batch in one sequence call
+        new_vals = [vals for vals in vals_list if vals.get('name', _('New')) == _('New')]
+        names = self.env['ir.sequence']._next_by_code_block('custom.book.loan', len(new_vals))
+        for vals, name in zip(new_vals, names):
+            vals['name'] = name or _('New')
+        loans = super(BookLoan, self).create(vals_list)
+        self.env['custom.library.loan.daily.stats']._apply_loan_delta(loans.ids, 1)
+        self.env['custom.library.member']._refresh_loan_counters(loans.member_id.ids)
+        return loans
+    
+    def write(self, vals):
+        # Move the loans between rollup rows when a grouping field changes
+        track_stats = bool(DAILY_STATS_FIELDS.intersection(vals))
+        track_members = 'member_id' in vals or 'state' in vals
+        partners = self.member_id if track_members else self.env['res.partner']
+        DailyStats = self.env['custom.library.loan.daily.stats']
+        if track_stats:
+            DailyStats._apply_loan_delta(self.ids, -1)
+        res = super(BookLoan, self).write(vals)
+        if track_stats:
+            DailyStats._apply_loan_delta(self.ids, 1)
+        if track_members:
+            self.env['custom.library.member']._refresh_loan_counters((partners | self.member_id).ids)
+        return res
+    
+    def unlink(self):
+        partners = self.member_id
+        self.env['custom.library.loan.daily.stats']._apply_loan_delta(self.ids, -1)
+        res = super(BookLoan, self).unlink()
+        self.env['custom.library.member']._refresh_loan_counters(partners.ids)
+        return res
     
     def action_confirm(self):
-        for loan in self:
-            loan.state = 'confirmed'
+        return self._set_loan_state('confirmed')
     
     def action_return(self):
-        for loan in self:
-            loan.actual_return_date = fields.Date.today()
-            loan.state = 'returned'
+        return self._set_loan_state('returned', {'actual_return_date': fields.Date.today()})
     
     def action_mark_lost(self):
-        for loan in self:
-            loan.state = 'lost'
+        return self._set_loan_state('lost')
+    
+    def _set_loan_state(self, state, vals=None):
+        """Move all the loans to `state` with one write, then update their books"""
+        label = dict(self._fields['state'].selection)[state]
+        self._write_workflow(dict(vals or {}, state=state), _('Loan %s', label.lower()))
+        self._sync_book_state()
+        return True
+    
+    def _sync_book_state(self):
+        """Set the state of the loaned books from their loans, with one write per state"""
+        books = self.book_id
+        if not books:
+            return
+        open_books = self.env['custom.book'].browse()
+        # A shared book may be on an open loan of another company
+        for book, count in self.sudo()._read_group(
+                [('book_id', 'in', books.ids), ('state', 'in', ('confirmed', 'overdue'))],
+                groupby=['book_id'], aggregates=['__count']):
+            open_books |= book
+        lost_books = self.filtered(lambda loan: loan.state == 'lost').book_id
+        targets = {
+            'lost': lost_books,
+            'borrowed': (books - lost_books) & open_books,
+            # A book lost earlier stays lost when another of its loans is returned
+            'available': (books - lost_books - open_books).filtered(lambda book: book.state != 'lost'),
+        }
+        labels = dict(books._fields['state'].selection)
+        for state, state_books in targets.items():
+            state_books = state_books.filtered(lambda book: book.state != state)
+            state_books._write_workflow({'state': state}, _('Marked as %s', labels[state].lower()))
     
     @api.model
-    def _cron_check_overdue(self):
-        """Daily cron job to check for overdue loans"""
+    def _cron_check_overdue(self, batch_size=OVERDUE_BATCH_SIZE):
+        """Daily cron job to check for overdue loans.
+
+        Loans are processed in id order by batches committed one at a time, so
+        an interrupted run resumes after the last processed id. The first phase
+        marks confirmed loans past their return date as overdue, the second
+        recomputes the fines of every overdue loan for the current day.
+        """
         today = fields.Date.today()
-        overdue_loans = self.search([
-            ('state', '=', 'confirmed'),
-            ('return_date', '<', today)
-        ])
-        for loan in overdue_loans:
-            loan.state = 'overdue' 
\ No newline at end of file
+        domains = self._get_overdue_domains(today)
+        phase, last_id = 'mark', 0
+        progress = self.env['custom.library.cron.progress']._get_progress(OVERDUE_PROGRESS_JOB)
+        if progress and progress[0] == today:
+            phase, last_id = progress[1], progress[2]
+
+        if phase == 'mark':
+            self._process_overdue_batches(
+                'mark', domains['mark'],
+                lambda batch: batch.write({'state': 'overdue'}),
+                today, last_id, batch_size,
+            )
+            phase, last_id = 'fine', 0
+        if phase == 'fine':
+            self._process_overdue_batches(
+                'fine', domains['fine'],
+                lambda batch: batch._recompute_fines(),
+                today, last_id, batch_size,
+            )
+        self.env['custom.library.cron.progress']._set_progress(OVERDUE_PROGRESS_JOB, today, 'done')
+
+    @api.model
+    def _get_overdue_domains(self, today):
+        """Return the domains of the loans processed by each phase of the overdue cron"""
+        return {
+            'mark': [('state', '=', 'confirmed'), ('return_date', '<', today)],
+            'fine': [('state', '=', 'overdue')],
+        }
+
+    @api.model
+    def _search_overdue_batch(self, domain, last_id, batch_size):
+        """Return the next batch of loans matching `domain`, by id above `last_id`"""
+        return self.search(domain + [('id', '>', last_id)], order='id', limit=batch_size)
+
+    @api.model
+    def _process_overdue_batches(self, phase, domain, process, today, last_id, batch_size):
+        """Apply `process` to the loans matching `domain` by batches of ids above `last_id`"""
+        Progress = self.env['custom.library.cron.progress']
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        start = time.monotonic()
+        processed = 0
+        while True:
+            batch = self._search_overdue_batch(domain, last_id, batch_size)
+            if not batch:
+                break
+            process(batch)
+            last_id = batch[-1].id
+            processed += len(batch)
+            Progress._set_progress(OVERDUE_PROGRESS_JOB, today, phase, last_id)
+            if auto_commit:
+                self.env.cr.commit()
+            # Keep memory flat over large backlogs
+            self.env.invalidate_all()
+        elapsed = time.monotonic() - start
+        _logger.info(
+            "Overdue cron phase %s: %s loans in %.2fs (%.0f rows/s)",
+            phase, processed, elapsed, processed / elapsed if elapsed else 0,
+        )
+
+    def _recompute_fines(self):
+        """Recompute the stored fine of the loans in one pass"""
+        DailyStats = self.env['custom.library.loan.daily.stats']
+        DailyStats._apply_loan_delta(self.ids, -1)
+        self.env.add_to_compute(self._fields['fine_amount'], self)
+        self.flush_recordset(['fine_amount'])
+        DailyStats._apply_loan_delta(self.ids, 1)
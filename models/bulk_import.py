@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+import csv
+import io
+import itertools
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 5000
+
+# Target model of each import kind
+IMPORT_MODELS = {
+    'books': 'custom.book',
+    'members': 'custom.library.member',
+    'loans': 'custom.book.loan',
+}
+
+# No chatter messages, followers or tracking values for imported records
+IMPORT_CONTEXT = {
+    'tracking_disable': True,
+    'mail_create_nolog': True,
+    'mail_create_nosubscribe': True,
+    'mail_notrack': True,
+}
+
+
+class LibraryBulkImport(models.AbstractModel):
+    """Streaming CSV import of books, members and loans.
+
+    Rows are read and inserted by batches; each batch is validated as a whole,
+    resolves its references through lookup maps shared by the whole import,
+    and is created in a single create() call inside its own savepoint, so a
+    failing batch is reported without losing the others.
+    """
+    _name = 'custom.library.bulk.import'
+    _description = 'Library Bulk Import'
+
+    @api.model
+    def _import_csv(self, kind, stream, batch_size=IMPORT_BATCH_SIZE, delimiter=','):
+        """Import a CSV file (binary file object) of the given kind and return the report"""
+        if kind not in IMPORT_MODELS:
+            raise ValueError("Unknown import kind: %s" % kind)
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), delimiter=delimiter)
+        report = {'kind': kind, 'imported': 0, 'failed': 0, 'batches': []}
+        maps = {}
+        start = time.monotonic()
+        # Row numbers follow the file lines, the header being line 1
+        numbered = enumerate(reader, start=2)
+        while True:
+            rows = list(itertools.islice(numbered, batch_size))
+            if not rows:
+                break
+            batch = self._import_batch(kind, rows, maps)
+            report['imported'] += batch['imported']
+            report['failed'] += batch['rows'] - batch['imported']
+            report['batches'].append(batch)
+            # Keep memory flat over large files
+            self.env.invalidate_all()
+        elapsed = time.monotonic() - start
+        _logger.info(
+            "Bulk import of %s: %s rows imported, %s failed in %.2fs (%.0f rows/s)",
+            kind, report['imported'], report['failed'], elapsed,
+            report['imported'] / elapsed if elapsed else 0,
+        )
+        return report
+
+    @api.model
+    def _import_batch(self, kind, rows, maps):
+        """Validate and create one batch of (row number, row) pairs"""
+        errors = []
+        batch = {'first_row': rows[0][0], 'last_row': rows[-1][0], 'rows': len(rows), 'imported': 0, 'errors': errors}
+        rows = [(number, {key.strip(): (value or '').strip() for key, value in row.items() if key}) for number, row in rows]
+        try:
+            with self.env.cr.savepoint():
+                vals_list = getattr(self, '_prepare_%s' % kind)(rows, maps, errors)
+                if vals_list:
+                    records = self.env[IMPORT_MODELS[kind]].with_context(**IMPORT_CONTEXT).create(vals_list)
+                    batch['imported'] = len(records)
+        except Exception as e:
+            _logger.error("Error importing %s rows %s-%s: %s", kind, batch['first_row'], batch['last_row'], str(e))
+            errors.append({'row': False, 'message': str(e)})
+            batch['imported'] = 0
+            # Records created by the failed batch were rolled back
+            maps.clear()
+        return batch
+
+    @api.model
+    def _resolve(self, maps, model, field, values, target='id', domain=None):
+        """Return the lookup map {field value: target} of a model, loading missing values in one query.
+
+        `domain` restricts the records looked up, e.g. to the company a value is unique in.
+        """
+        domain = domain or []
+        cache = maps.setdefault((model, field, target, repr(domain)), {})
+        missing = list({value for value in values if value and value not in cache})
+        if missing:
+            records = self.env[model].with_context(active_test=False).search_read(
+                domain + [(field, 'in', missing)], [field, target])
+            for record in records:
+                value = record[target]
+                cache.setdefault(record[field], value[0] if isinstance(value, tuple) else value)
+            for value in missing:
+                cache.setdefault(value, False)
+        return cache
+
+    @api.model
+    def _parse(self, row, column, parser, errors, number, default=False):
+        """Parse an optional column value, recording an error when it is invalid"""
+        value = row.get(column)
+        if not value:
+            return default
+        try:
+            return parser(value)
+        except (TypeError, ValueError):
+            errors.append({'row': number, 'message': _('Invalid %s: %s', column, value)})
+            raise
+
+    @api.model
+    def _prepare_books(self, rows, maps, errors):
+        Book = self.env['custom.book']
+        isbn_errors = Book._get_isbn_errors([row.get('isbn') for number, row in rows])
+        seen = maps.setdefault('isbn_seen', set())
+        authors = self._resolve(maps, 'custom.author', 'name', [row.get('author') for number, row in rows])
+        genres = self._resolve(maps, 'custom.book.genre', 'name', [row.get('genre') for number, row in rows])
+        conditions = dict(Book._fields['condition'].selection)
+
+        # Authors are created on the fly, all at once
+        new_authors = list({row['author'] for number, row in rows if row.get('author') and not authors.get(row['author'])})
+        if new_authors:
+            created = self.env['custom.author'].with_context(**IMPORT_CONTEXT).create([{'name': name} for name in new_authors])
+            authors.update(zip(new_authors, created.ids))
+
+        vals_list = []
+        for number, row in rows:
+            isbn = row.get('isbn')
+            if not row.get('name'):
+                errors.append({'row': number, 'message': _('Title is required')})
+                continue
+            if isbn in isbn_errors or Book._normalize_isbn(isbn) in seen:
+                errors.append({'row': number, 'message': isbn_errors.get(isbn) or _('Duplicate ISBN %s in file', isbn)})
+                continue
+            if row.get('genre') and not genres.get(row['genre']):
+                errors.append({'row': number, 'message': _('Unknown genre: %s', row['genre'])})
+                continue
+            if row.get('condition') and row['condition'] not in conditions:
+                errors.append({'row': number, 'message': _('Invalid condition: %s', row['condition'])})
+                continue
+            try:
+                vals = {
+                    'name': row['name'],
+                    'isbn': isbn,
+                    'author_id': authors.get(row.get('author')) or False,
+                    'genre_id': genres.get(row.get('genre')) or False,
+                    'publisher': row.get('publisher') or False,
+                    'description': row.get('description') or False,
+                    'pages': self._parse(row, 'pages', int, errors, number, 0),
+                    'price': self._parse(row, 'price', float, errors, number, 0.0),
+                    'date_published': self._parse(row, 'date_published', fields.Date.to_date, errors, number),
+                    'acquisition_date': self._parse(row, 'acquisition_date', fields.Date.to_date, errors, number,
+                                                    fields.Date.context_today(self)),
+                    'condition': row.get('condition') or 'new',
+                }
+            except (TypeError, ValueError):
+                continue
+            seen.add(Book._normalize_isbn(isbn))
+            vals_list.append(vals)
+        return vals_list
+
+    @api.model
+    def _prepare_members(self, rows, maps, errors):
+        Member = self.env['custom.library.member']
+        types = dict(Member._fields['membership_type'].selection)
+        partners = self._resolve(maps, 'res.partner', 'email', [row.get('email') for number, row in rows])
+        # Member numbers are unique per company, the members being imported in the current one
+        numbers_used = self._resolve(maps, 'custom.library.member', 'member_number',
+                                     [row.get('member_number') for number, row in rows],
+                                     domain=[('company_id', '=', self.env.company.id)])
+        # Contacts of the batch that already are members
+        member_partners = set(Member.with_context(active_test=False).search([
+            ('partner_id', 'in', list({partners[row['email']] for number, row in rows if partners.get(row.get('email'))})),
+        ]).partner_id.ids)
+        # Emails and member numbers of the rows imported so far, over all batches
+        imported_emails = maps.setdefault('member_emails', set())
+        imported_numbers = maps.setdefault('member_numbers', set())
+
+        valid = []
+        for number, row in rows:
+            email, member_number = row.get('email'), row.get('member_number')
+            if not row.get('name'):
+                errors.append({'row': number, 'message': _('Name is required')})
+                continue
+            if email and email in imported_emails:
+                errors.append({'row': number, 'message': _('Duplicate email %s in file', email)})
+                continue
+            if email and partners.get(email) in member_partners:
+                errors.append({'row': number, 'message': _('A member with email %s already exists', email)})
+                continue
+            if member_number and member_number in imported_numbers:
+                errors.append({'row': number, 'message': _('Duplicate member number %s in file', member_number)})
+                continue
+            if member_number and numbers_used.get(member_number):
+                errors.append({'row': number, 'message': _('Member number %s already exists', member_number)})
+                continue
+            if row.get('membership_type') and row['membership_type'] not in types:
+                errors.append({'row': number, 'message': _('Invalid membership type: %s', row['membership_type'])})
+                continue
+            try:
+                membership_date = self._parse(row, 'membership_date', fields.Date.to_date, errors, number,
+                                              fields.Date.context_today(self))
+            except (TypeError, ValueError):
+                continue
+            if email:
+                imported_emails.add(email)
+            if member_number:
+                imported_numbers.add(member_number)
+            valid.append((row, membership_date))
+
+        # Contacts without a matching email are created in one call
+        new_partners = [row for row, membership_date in valid if not partners.get(row.get('email'))]
+        created = self.env['res.partner'].with_context(**IMPORT_CONTEXT).create([{
+            'name': row['name'],
+            'email': row.get('email') or False,
+            'phone': row.get('phone') or False,
+        } for row in new_partners])
+        for row, partner in zip(new_partners, created):
+            row['partner_id'] = partner.id
+            if row.get('email'):
+                partners[row['email']] = partner.id
+
+        numbers = iter(self.env['ir.sequence']._next_by_code_block(
+            'custom.library.member', len([row for row, membership_date in valid if not row.get('member_number')])))
+        vals_list = []
+        for row, membership_date in valid:
+            vals_list.append({
+                'partner_id': row.get('partner_id') or partners[row['email']],
+                'member_number': row.get('member_number') or next(numbers) or _('New'),
+                'membership_type': row.get('membership_type') or 'standard',
+                'membership_date': membership_date,
+                'notes': row.get('notes') or False,
+            })
+        return vals_list
+
+    @api.model
+    def _prepare_loans(self, rows, maps, errors):
+        Loan = self.env['custom.book.loan']
+        states = dict(Loan._fields['state'].selection)
+        normalize_isbn = self.env['custom.book']._normalize_isbn
+        books = self._resolve(maps, 'custom.book', 'isbn_normalized',
+                              [normalize_isbn(row.get('book_isbn')) for number, row in rows])
+        members = self._resolve(maps, 'custom.library.member', 'member_number',
+                                [row.get('member_number') for number, row in rows], target='partner_id')
+        partners = self._resolve(maps, 'res.partner', 'email', [row.get('member_email') for number, row in rows])
+
+        vals_list = []
+        for number, row in rows:
+            book_id = books.get(normalize_isbn(row.get('book_isbn')))
+            partner_id = members.get(row.get('member_number')) or partners.get(row.get('member_email'))
+            if not book_id:
+                errors.append({'row': number, 'message': _('Unknown book ISBN: %s', row.get('book_isbn'))})
+                continue
+            if not partner_id:
+                errors.append({'row': number, 'message': _('Unknown member: %s', row.get('member_number') or row.get('member_email'))})
+                continue
+            if row.get('state') and row['state'] not in states:
+                errors.append({'row': number, 'message': _('Invalid state: %s', row['state'])})
+                continue
+            try:
+                loan_date = self._parse(row, 'loan_date', fields.Date.to_date, errors, number)
+                actual_return_date = self._parse(row, 'actual_return_date', fields.Date.to_date, errors, number)
+                loan_duration = self._parse(row, 'loan_duration', int, errors, number, 14)
+            except (TypeError, ValueError):
+                continue
+            if not loan_date:
+                errors.append({'row': number, 'message': _('Loan date is required')})
+                continue
+            vals_list.append({
+                'name': row.get('name') or False,
+                'book_id': book_id,
+                'member_id': partner_id,
+                'loan_date': loan_date,
+                'loan_duration': loan_duration,
+                'actual_return_date': actual_return_date,
+                'state': row.get('state') or ('returned' if actual_return_date else 'draft'),
+                'notes': row.get('notes') or False,
+            })
+
+        numbers = iter(self.env['ir.sequence']._next_by_code_block(
+            'custom.book.loan', len([vals for vals in vals_list if not vals['name']])))
+        for vals in vals_list:
+            if not vals['name']:
+                vals['name'] = next(numbers) or _('New')
+        return vals_list
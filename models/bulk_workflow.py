@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+
+# Context key switching workflow actions to bulk mode (no per-record tracking)
+BULK_MODE_CONTEXT = 'library_bulk_mode'
+
+
+class LibraryBulkWorkflow(models.AbstractModel):
+    _name = 'custom.library.bulk.workflow'
+    _description = 'Library Bulk Workflow'
+
+    def _write_workflow(self, vals, summary):
+        """Write the same values on the whole recordset at once.
+
+        In bulk mode the field tracking is skipped and the `summary` note is
+        logged on every record with a single batch insert instead.
+        """
+        if not self:
+            return True
+        if not self.env.context.get(BULK_MODE_CONTEXT):
+            return self.write(vals)
+        res = self.with_context(tracking_disable=True).write(vals)
+        body = _('%(summary)s (bulk action on %(count)s records)', summary=summary, count=len(self))
+        self._message_log_batch(bodies={record.id: body for record in self})
+        return res
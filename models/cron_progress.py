@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class LibraryCronProgress(models.Model):
+    """Resume position of the batched crons, one row per job.
+
+    Written with plain SQL after each committed batch; unlike a system
+    parameter, updating it does not clear the registry caches.
+    """
+    _name = 'custom.library.cron.progress'
+    _description = 'Library Cron Progress'
+    _log_access = False
+
+    name = fields.Char('Job', required=True, readonly=True)
+    run_date = fields.Date('Run Date', readonly=True)
+    phase = fields.Char('Phase', readonly=True)
+    last_id = fields.Integer('Last Processed ID', readonly=True)
+
+    _sql_constraints = [
+        ('name_uniq', 'unique(name)', 'Only one progress record per job!'),
+    ]
+
+    @api.model
+    def _get_progress(self, name):
+        """Return the (run date, phase, last processed id) of a job, or None"""
+        self.env.cr.execute(
+            "SELECT run_date, phase, last_id FROM custom_library_cron_progress WHERE name = %s", [name])
+        return self.env.cr.fetchone()
+
+    @api.model
+    def _set_progress(self, name, run_date, phase, last_id=0):
+        self.env.cr.execute("""
+            INSERT INTO custom_library_cron_progress (name, run_date, phase, last_id)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (name) DO UPDATE
+            SET run_date = EXCLUDED.run_date, phase = EXCLUDED.phase, last_id = EXCLUDED.last_id
+        """, [name, run_date, phase, last_id])
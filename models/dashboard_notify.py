@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+
+
+class LibraryDashboardNotify(models.AbstractModel):
+    """Flag the dashboard snapshots of the companies of changed records.
+
+    The snapshots are then rebuilt by the refresh cron after a short delay,
+    once for a whole burst of changes, and pushed to the open dashboards.
+    Records without company are shared by every branch and flag all of them.
+    """
+    _name = 'custom.library.dashboard.notify'
+    _description = 'Library Dashboard Change Notification'
+
+    def _mark_dashboard_dirty(self):
+        if not self:
+            return
+        shared = any(not record.company_id for record in self)
+        self.env['custom.library.dashboard.snapshot']._mark_dirty(None if shared else self.company_id.ids)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(LibraryDashboardNotify, self).create(vals_list)
+        records._mark_dashboard_dirty()
+        return records
+
+    def write(self, vals):
+        # Moving records to another company changes the dashboards of both
+        if 'company_id' in vals:
+            self._mark_dashboard_dirty()
+        res = super(LibraryDashboardNotify, self).write(vals)
+        self._mark_dashboard_dirty()
+        return res
+
+    def unlink(self):
+        self._mark_dashboard_dirty()
+        return super(LibraryDashboardNotify, self).unlink()
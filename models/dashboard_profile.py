@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+import logging
+import threading
+import time
+from datetime import timedelta
+
+_logger = logging.getLogger(__name__)
+
+# Number of days of profiling history kept
+HISTORY_DAYS_PARAM = 'individual_mod.dashboard_profile_days'
+DEFAULT_HISTORY_DAYS = 30
+
+
+class QueryProfiler:
+    """Measure wall time, SQL queries and fetched rows of the current thread.
+
+    Uses the ``query_hooks`` of the current thread, called by the cursor after
+    every query, like the SQL collector of odoo.tools.profiler. With
+    `record_statements`, the executed queries and their parameters are kept
+    in ``statements``.
+    """
+
+    def __init__(self, name, kind, record_statements=False):
+        self.name = name
+        self.kind = kind
+        self.queries = 0
+        self.rows = 0
+        self.duration_ms = 0.0
+        self.error = False
+        self.statements = [] if record_statements else None
+
+    def _hook(self, cr, query, params, start, delay):
+        self.queries += 1
+        if cr.rowcount and cr.rowcount > 0:
+            self.rows += cr.rowcount
+        if self.statements is not None:
+            self.statements.append((query, params))
+
+    def __enter__(self):
+        thread = threading.current_thread()
+        if not hasattr(thread, 'query_hooks'):
+            thread.query_hooks = []
+        thread.query_hooks.append(self._hook)
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration_ms = (time.monotonic() - self._start) * 1000
+        threading.current_thread().query_hooks.remove(self._hook)
+        if exc_value is not None:
+            self.error = str(exc_value)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'duration_ms': self.duration_ms,
+            'query_count': self.queries,
+            'row_count': self.rows,
+            'error': self.error,
+        }
+
+
+class LibraryDashboardProfile(models.Model):
+    _name = 'custom.library.dashboard.profile'
+    _description = 'Library Dashboard Profile'
+    _order = 'create_date desc, id desc'
+
+    name = fields.Char('Name', required=True, readonly=True)
+    kind = fields.Selection([
+        ('section', 'Chart Section'),
+        ('kpi', 'KPI'),
+    ], string='Kind', required=True, readonly=True)
+    company_id = fields.Many2one('res.company', readonly=True)
+    duration_ms = fields.Float('Wall Time (ms)', readonly=True)
+    query_count = fields.Integer('Queries', readonly=True)
+    row_count = fields.Integer('Rows Fetched', readonly=True)
+    error = fields.Char('Error', readonly=True)
+
+    @api.model
+    def _record(self, measurements, company=None):
+        """Log and store the measurements (dicts from QueryProfiler.to_dict)"""
+        company = company or self.env.company
+        for measure in measurements:
+            _logger.info(
+                "dashboard_profile kind=%s name=%s company=%s wall_ms=%.1f queries=%d rows=%d error=%s",
+                measure['kind'], measure['name'], company.id, measure['duration_ms'],
+                measure['query_count'], measure['row_count'], measure['error'] or '',
+            )
+        return self.sudo().create([dict(measure, company_id=company.id) for measure in measurements])
+
+    @api.model
+    def _prune(self):
+        """Drop the history older than the configured number of days"""
+        days = int(self.env['ir.config_parameter'].sudo().get_param(HISTORY_DAYS_PARAM, DEFAULT_HISTORY_DAYS))
+        self.sudo().search([('create_date', '<', fields.Datetime.now() - timedelta(days=days))]).unlink()
+
+    @api.model
+    def _get_report(self, company=None, limit=200):
+        """Return the latest measurements and per-name averages over the history"""
+        company = company or self.env.company
+        domain = [('company_id', '=', company.id)]
+        history = self.sudo().search_read(
+            domain, ['create_date', 'name', 'kind', 'duration_ms', 'query_count', 'row_count', 'error'],
+            limit=limit,
+        )
+        summary = self.sudo()._read_group(
+            domain, groupby=['kind', 'name'],
+            aggregates=['duration_ms:avg', 'duration_ms:max', 'query_count:avg', 'row_count:avg', '__count'],
+        )
+        return {
+            'history': history,
+            'summary': [{
+                'kind': kind,
+                'name': name,
+                'avg_duration_ms': avg_duration,
+                'max_duration_ms': max_duration,
+                'avg_query_count': avg_queries,
+                'avg_row_count': avg_rows,
+                'samples': count,
+            } for kind, name, avg_duration, max_duration, avg_queries, avg_rows, count in summary],
+        }
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+import hashlib
+import json
+import logging
+import threading
+from datetime import timedelta
+from psycopg2.errors import LockNotAvailable, SerializationFailure
+from .dashboard_profile import QueryProfiler
+
+_logger = logging.getLogger(__name__)
+
+# Maximum age (in minutes) of a snapshot before a background rebuild is requested
+MAX_STALENESS_PARAM = 'individual_mod.dashboard_max_staleness'
+DEFAULT_MAX_STALENESS = 15
+
+# Seconds between the first change to the dashboard data and the rebuild
+PUSH_DELAY_PARAM = 'individual_mod.dashboard_push_delay'
+DEFAULT_PUSH_DELAY = 10
+
+# Bus channel of the dashboards of a company, and largest pushed payload (bytes)
+BUS_CHANNEL_PREFIX = 'library_dashboard_'
+PUSH_MAX_SIZE = 256 * 1024
+
+# Key of the companies changed by the current transaction in cr.precommit.data
+CHANGED_COMPANIES_KEY = 'individual_mod.dashboard_changed_companies'
+
+# Length of the interval types of the refresh cron, months counted as 30 days
+CRON_INTERVAL_UNITS = {
+    'minutes': timedelta(minutes=1),
+    'hours': timedelta(hours=1),
+    'days': timedelta(days=1),
+    'weeks': timedelta(weeks=1),
+    'months': timedelta(days=30),
+}
+
+# Dashboard KPI fields copied into the snapshot
+SNAPSHOT_KPI_FIELDS = [
+    'book_count',
+    'loan_count',
+    'overdue_count',
+    'member_count',
+    'total_revenue_mtd',
+    'total_revenue_ytd',
+    'revenue_growth',
+    'average_loan_duration',
+    'median_loan_duration',
+    'p90_loan_duration',
+    'most_borrowed_genre_id',
+    'most_active_member_id',
+]
+
+
+class LibraryDashboardSnapshot(models.Model):
+    _name = 'custom.library.dashboard.snapshot'
+    _description = 'Library Dashboard Snapshot'
+    _order = 'refreshed_at desc'
+
+    company_id = fields.Many2one('res.company', required=True, ondelete='cascade',
+                                 default=lambda self: self.env.company)
+    refreshed_at = fields.Datetime('Refreshed At', readonly=True)
+
+    book_count = fields.Integer('Book Count', readonly=True)
+    loan_count = fields.Integer('Loan Count', readonly=True)
+    overdue_count = fields.Integer('Overdue Count', readonly=True)
+    member_count = fields.Integer('Member Count', readonly=True)
+
+    total_revenue_mtd = fields.Monetary('Revenue MTD', readonly=True)
+    total_revenue_ytd = fields.Monetary('Revenue YTD', readonly=True)
+    revenue_growth = fields.Float('Revenue Growth (%)', readonly=True)
+    average_loan_duration = fields.Float('Avg Loan Duration (days)', readonly=True)
+    median_loan_duration = fields.Float('Median Loan Duration (days)', readonly=True)
+    p90_loan_duration = fields.Float('P90 Loan Duration (days)', readonly=True)
+
+    most_borrowed_genre_id = fields.Many2one('custom.book.genre', string='Most Borrowed Genre', readonly=True)
+    most_active_member_id = fields.Many2one('res.partner', string='Most Active Member', readonly=True)
+
+    graph_data = fields.Text('Graph Data', readonly=True)
+    # Content hash used by clients to skip unchanged payloads (ETag)
+    data_version = fields.Char('Data Version', readonly=True)
+    currency_id = fields.Many2one('res.currency', related='company_id.currency_id')
+
+    _sql_constraints = [
+        ('company_uniq', 'unique (company_id)', 'Only one dashboard snapshot per company is allowed')
+    ]
+
+    @api.model
+    def _get_max_staleness(self):
+        """Return the configured maximum snapshot age as a timedelta"""
+        value = self.env['ir.config_parameter'].sudo().get_param(MAX_STALENESS_PARAM, DEFAULT_MAX_STALENESS)
+        try:
+            minutes = int(value)
+        except (TypeError, ValueError):
+            minutes = DEFAULT_MAX_STALENESS
+        return timedelta(minutes=max(minutes, 0))
+
+    @api.model
+    def _get_push_delay(self):
+        value = self.env['ir.config_parameter'].sudo().get_param(PUSH_DELAY_PARAM, DEFAULT_PUSH_DELAY)
+        try:
+            return max(int(value), 0)
+        except (TypeError, ValueError):
+            return DEFAULT_PUSH_DELAY
+
+    @api.model
+    def _get_cron_interval(self):
+        """Return the period of the refresh cron as a timedelta"""
+        cron = self.env.ref('individual_mod.ir_cron_refresh_dashboard_snapshots', raise_if_not_found=False)
+        if not cron:
+            return timedelta()
+        cron = cron.sudo()
+        return CRON_INTERVAL_UNITS.get(cron.interval_type, timedelta()) * cron.interval_number
+
+    def _is_stale(self, margin=timedelta()):
+        """Whether the snapshot is older than the maximum staleness, or will be within `margin`"""
+        self.ensure_one()
+        if not self.refreshed_at:
+            return True
+        return fields.Datetime.now() - self.refreshed_at >= self._get_max_staleness() - margin
+
+    @api.model
+    def _prepare_snapshot_values(self, company):
+        """Compute KPIs and chart payload for a company using the live dashboard builders.
+
+        The snapshot is dated from the start of the build, the time of the
+        data it reflects, so its age does not depend on how long it took.
+        """
+        refreshed_at = fields.Datetime.now()
+        dashboard = self.env['custom.library.dashboard'].with_company(company).with_context(
+            dashboard_live=True,
+        ).new({'name': 'Library Dashboard', 'company_id': company.id})
+
+        values, measurements = self._read_kpis(dashboard)
+        self.env['custom.library.dashboard.profile']._record(measurements, company)
+        values['refreshed_at'] = refreshed_at
+        values['graph_data'] = dashboard.graph_data
+        values['data_version'] = self._compute_data_version(values)
+        return values
+
+    @api.model
+    def _read_kpis(self, dashboard):
+        """Read the KPI fields of a live dashboard, profiling each compute method on its own"""
+        values, measurements = {}, []
+        computes = {}
+        for fname in SNAPSHOT_KPI_FIELDS:
+            computes.setdefault(dashboard._fields[fname].compute, []).append(fname)
+        for compute, fnames in computes.items():
+            with QueryProfiler(compute, 'kpi') as profiler:
+                for fname in fnames:
+                    value = dashboard[fname]
+                    values[fname] = value.id if isinstance(value, models.BaseModel) else value
+            measurements.append(profiler.to_dict())
+        return values, measurements
+
+    @api.model
+    def _compute_data_version(self, values):
+        """Hash the snapshot content, ignoring its timestamp"""
+        content = {key: value for key, value in values.items() if key != 'refreshed_at'}
+        digest = hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode())
+        return digest.hexdigest()[:16]
+
+    @api.model
+    def _refresh(self, companies=None):
+        """Rebuild the snapshot of the given companies (current company by default).
+
+        Snapshots are written as superuser since users only read them; every
+        figure is computed for its own company.
+        """
+        companies = companies or self.env.company
+        self.env['custom.library.loan.daily.stats']._fold_deltas()
+        Snapshot = self.sudo()
+        snapshots = Snapshot.browse()
+        for company in companies:
+            values = self._prepare_snapshot_values(company)
+            snapshot = Snapshot.search([('company_id', '=', company.id)], limit=1)
+            old_data = snapshot.get_graph_data() if snapshot else {}
+            if snapshot:
+                changed = snapshot.data_version != values['data_version']
+                snapshot.write(values)
+            else:
+                changed = True
+                snapshot = Snapshot.create(dict(values, company_id=company.id))
+            if changed:
+                snapshot._notify_update(old_data)
+            snapshots |= snapshot
+        return snapshots.sudo(self.env.su)
+
+    def _notify_update(self, old_data):
+        """Push the sections changed since `old_data` to the dashboards open on the company.
+
+        Every open tab receives the same bus message, so a rebuild is shared
+        by all of them. Sections too large for the bus are left for the
+        clients to fetch.
+        """
+        self.ensure_one()
+        sections = {name: section for name, section in self.get_graph_data().items() if old_data.get(name) != section}
+        if len(json.dumps(sections)) > PUSH_MAX_SIZE:
+            sections = None
+        self.env['bus.bus']._sendone(BUS_CHANNEL_PREFIX + str(self.company_id.id), 'library_dashboard/updated', {
+            'company_id': self.company_id.id,
+            'version': self.data_version,
+            'refreshed_at': fields.Datetime.to_string(self.refreshed_at),
+            'sections': sections,
+        })
+
+    @api.model
+    def _mark_dirty(self, company_ids=None):
+        """Record that the data of the given companies (all by default) changed.
+
+        The companies are collected over the transaction and written just
+        before the commit as append-only rows of the change log, so desks
+        changing loans at the same time never wait on a shared row, and the
+        refresh cron is scheduled once per transaction.
+        """
+        if company_ids is not None and not company_ids:
+            return
+        precommit = self.env.cr.precommit
+        changed = precommit.data.get(CHANGED_COMPANIES_KEY)
+        if changed is None:
+            changed = precommit.data[CHANGED_COMPANIES_KEY] = set()
+            precommit.add(self._log_changes)
+        changed.update(company_ids if company_ids is not None else [None])
+
+    def _log_changes(self):
+        changed = self.env.cr.precommit.data.pop(CHANGED_COMPANIES_KEY, None)
+        if changed:
+            self.env['custom.library.dashboard.change']._log(changed)
+            self._trigger_refresh(self._get_push_delay())
+
+    @api.model
+    def _get_latest(self, company=None):
+        """Return the latest snapshot of a company, building it only when none exists.
+
+        A stale snapshot is served as-is while the refresh cron is triggered
+        in the background.
+        """
+        company = company or self.env.company
+        snapshot = self.search([('company_id', '=', company.id)], limit=1)
+        if not snapshot:
+            return self._refresh(company)
+        if snapshot._is_stale():
+            self._trigger_refresh()
+        return snapshot
+
+    @api.model
+    def _trigger_refresh(self, delay=0):
+        """Ask the scheduler to rebuild the snapshots in `delay` seconds (as soon as possible by default)"""
+        cron = self.env.ref('individual_mod.ir_cron_refresh_dashboard_snapshots', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger(at=fields.Datetime.now() + timedelta(seconds=delay) if delay else None)
+
+    @api.model
+    def _cron_refresh_snapshots(self):
+        """Scheduled job rebuilding the stale and changed dashboard snapshots.
+
+        Each company is refreshed and committed on its own, so a slow or
+        failing branch neither delays nor rolls back the others, and fresh
+        snapshots are left untouched. A failed rebuild is rolled back and its
+        company logged as changed again, so the next run retries it; after a
+        concurrent update that run is triggered right away. The rebuild runs
+        outside savepoints (but in tests, which cannot commit), since the
+        parallel section builders do not support them.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        # Consumed before the rebuild, so that changes made meanwhile are logged again
+        changed = self.env['custom.library.dashboard.change']._consume()
+        # Committed with the consumed changes, for the parallel section builders to see them
+        self.env['custom.library.loan.daily.stats']._fold_deltas()
+        if auto_commit:
+            self.env.cr.commit()
+        # Snapshots going stale before the next run are rebuilt now, so that
+        # the staleness bounds their age instead of adding one cron interval
+        interval = self._get_cron_interval()
+        fresh = self.sudo().search([]).filtered(
+            lambda snapshot: not snapshot._is_stale(interval)
+            and None not in changed and snapshot.company_id.id not in changed
+        ).company_id
+        companies = self.env['res.company'].search([('id', 'not in', fresh.ids)])
+        for company in companies:
+            try:
+                if auto_commit:
+                    self._refresh(company)
+                else:
+                    with self.env.cr.savepoint():
+                        self._refresh(company)
+            except Exception as e:
+                if auto_commit:
+                    self.env.cr.rollback()
+                if isinstance(e, (SerializationFailure, LockNotAvailable)):
+                    _logger.warning("Concurrent update while refreshing the dashboard snapshot of company %s, "
+                                    "retrying: %s", company.id, str(e))
+                    self._trigger_refresh(self._get_push_delay())
+                else:
+                    _logger.error("Error refreshing the dashboard snapshot of company %s: %s", company.id, str(e))
+                self.env['custom.library.dashboard.change']._log([company.id])
+            if auto_commit:
+                self.env.cr.commit()
+        self.env['custom.library.dashboard.profile']._prune()
+        _logger.info("Refreshed library dashboard snapshots for %s companies", len(companies))
+
+    @api.model
+    def _get_section(self, name, company=None):
+        """Return one dashboard section from the snapshot, building it only when missing.
+
+        Like _get_latest(), a stale snapshot is served as-is while the
+        refresh cron is triggered in the background.
+        """
+        company = company or self.env.company
+        snapshot = self.search([('company_id', '=', company.id)], limit=1)
+        if snapshot:
+            if snapshot._is_stale():
+                self._trigger_refresh()
+            data = snapshot.get_graph_data()
+            if name in data:
+                return data[name]
+        self._trigger_refresh()
+        # Build only the requested section instead of the whole snapshot
+        return self.env['custom.library.dashboard'].with_company(company).with_context(
+            dashboard_live=True,
+        )._get_section_data(name)
+
+    def get_graph_data(self):
+        self.ensure_one()
+        return json.loads(self.graph_data) if self.graph_data else {}
+
+    def _get_payload(self, version=None, message='Data loaded successfully'):
+        """Build the dashboard data response, omitting the data when the client already has this version"""
+        self.ensure_one()
+        if version and version == self.data_version:
+            return {
+                'success': True,
+                'not_modified': True,
+                'version': self.data_version,
+                'refreshed_at': fields.Datetime.to_string(self.refreshed_at),
+                'message': 'Data not modified'
+            }
+        return {
+            'success': True,
+            'data': self.get_graph_data(),
+            'version': self.data_version,
+            'refreshed_at': fields.Datetime.to_string(self.refreshed_at),
+            'message': message
+        }
+
+
+class LibraryDashboardChange(models.Model):
+    """Append-only log of the companies whose library data changed.
+
+    Written with one INSERT per transaction and emptied by the snapshot
+    refresh cron; a row without company stands for every company.
+    """
+    _name = 'custom.library.dashboard.change'
+    _description = 'Library Dashboard Change'
+    _log_access = False
+
+    company_id = fields.Many2one('res.company', readonly=True, ondelete='cascade')
+    changed_at = fields.Datetime('Changed At', readonly=True)
+
+    @api.model
+    def _log(self, company_ids):
+        self.env.cr.execute("""
+            INSERT INTO custom_library_dashboard_change (company_id, changed_at)
+            SELECT unnest(%s::int[]), NOW() AT TIME ZONE 'UTC'
+        """, [list(company_ids)])
+
+    @api.model
+    def _get_last_change(self):
+        """Return a number increasing with every logged change, consumed ones included"""
+        self.env.cr.execute("SELECT last_value FROM custom_library_dashboard_change_id_seq")
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _consume(self):
+        """Delete the logged changes and return their company ids (None for every company)"""
+        self.env.cr.execute("DELETE FROM custom_library_dashboard_change RETURNING company_id")
+        return {company_id for company_id, in self.env.cr.fetchall()}
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+import logging
+import re
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Generated records are recognisable by these name prefixes so they can be purged
+FACTORY_PREFIX = 'Bench'
+FACTORY_LOAN_PREFIX = 'BENCH/'
+FACTORY_MEMBER_PREFIX = 'BENCH-M'
+
+# Loans generated per book, member and author
+LOANS_PER_BOOK = 10
+LOANS_PER_MEMBER = 20
+LOANS_PER_AUTHOR = 50
+GENRE_COUNT = 20
+
+# Rows inserted per statement (and per commit outside of tests)
+FACTORY_CHUNK_SIZE = 100000
+
+
+class LibraryDataFactory(models.AbstractModel):
+    _name = 'custom.library.data.factory'
+    _description = 'Library Synthetic Data Factory'
+
+    @api.model
+    def _next_number(self, table, column, prefix):
+        """Return the number following the highest one generated in a table.
+
+        Based on the numeric suffixes rather than a count, so that records
+        deleted in between do not make the next numbers collide.
+        """
+        self.env.cr.execute(
+            "SELECT MAX(substring({column} FROM %s)::bigint) FROM {table} WHERE {column} LIKE %s".format(
+                table=table, column=column),
+            ['^%s([0-9]+)$' % re.escape(prefix), prefix + '%'],
+        )
+        return (self.env.cr.fetchone()[0] or 0) + 1
+
+    @api.model
+    def _insert_chunks(self, label, count, insert):
+        """Call `insert(start, stop)` over consecutive ranges of at most FACTORY_CHUNK_SIZE numbers"""
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        start = time.monotonic()
+        for offset in range(0, count, FACTORY_CHUNK_SIZE):
+            insert(offset, min(offset + FACTORY_CHUNK_SIZE, count) - 1)
+            if auto_commit:
+                self.env.cr.commit()
+        elapsed = time.monotonic() - start
+        _logger.info(
+            "Data factory: %s %s in %.2fs (%.0f rows/s)",
+            count, label, elapsed, count / elapsed if elapsed else 0,
+        )
+
+    @api.model
+    def _generate(self, loans=10000, history_days=730, seed=0.42):
+        """Bulk-load synthetic authors, genres, books, members and loans.
+
+        Volumes are derived from the number of loans. Every table is filled
+        with set-based INSERT ... SELECT statements over generate_series, so
+        10M loans load in minutes; mail tracking and ORM hooks are skipped and
+        the stored counters and daily statistics are rebuilt at the end.
+        Loan dates lean towards the recent past and states follow the age of
+        the loan (recent loans are open, older ones mostly returned).
+        """
+        if loans <= 0:
+            return {}
+        cr = self.env.cr
+        self.env.flush_all()
+        cr.execute("SELECT setseed(%s)", [seed])
+        params = {
+            'uid': self.env.uid,
+            'company_id': self.env.company.id,
+            'currency_id': self.env.company.currency_id.id,
+            'today': fields.Date.context_today(self),
+            'history_days': history_days,
+            'prefix': FACTORY_PREFIX,
+        }
+        counts = {
+            'authors': max(loans // LOANS_PER_AUTHOR, 1),
+            'books': max(loans // LOANS_PER_BOOK, 1),
+            'members': max(loans // LOANS_PER_MEMBER, 1),
+            'loans': loans,
+        }
+
+        cr.execute("SELECT COUNT(*) FROM custom_book_genre WHERE active = TRUE")
+        counts['genres'] = max(GENRE_COUNT - cr.fetchone()[0], 0)
+        first = self._next_number('custom_book_genre', 'name', FACTORY_PREFIX + ' Genre ')
+        cr.execute("""
+            INSERT INTO custom_book_genre
+                (name, active, sequence, color, book_count, create_uid, create_date, write_uid, write_date)
+            SELECT %(prefix)s || ' Genre ' || g, TRUE, 10, g %% 12, 0,
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+            FROM generate_series(%(first)s, %(last)s) g
+        """, dict(params, first=first, last=first + counts['genres'] - 1))
+
+        first = self._next_number('custom_author', 'name', FACTORY_PREFIX + ' Author ')
+        cr.execute("""
+            INSERT INTO custom_author
+                (name, birth_date, active, book_count, create_uid, create_date, write_uid, write_date)
+            SELECT %(prefix)s || ' Author ' || g,
+                   DATE '1930-01-01' + floor(random() * 25000)::int, TRUE, 0,
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+            FROM generate_series(%(first)s, %(last)s) g
+        """, dict(params, first=first, last=first + counts['authors'] - 1))
+
+        first = self._next_number('custom_book', 'name', FACTORY_PREFIX + ' Book ')
+
+        def insert_books(start, stop):
+            cr.execute("""
+                WITH authors AS (
+                    SELECT ARRAY(SELECT id FROM custom_author WHERE active = TRUE ORDER BY id) AS ids
+                ), genres AS (
+                    SELECT ARRAY(SELECT id FROM custom_book_genre WHERE active = TRUE ORDER BY id) AS ids
+                )
+                INSERT INTO custom_book
+                    (name, isbn, isbn_normalized, active, date_published, author_id, genre_id, pages, publisher,
+                     currency_id, company_id, price, state, acquisition_date, condition, loan_count,
+                     create_uid, create_date, write_uid, write_date)
+                SELECT %(prefix)s || ' Book ' || g,
+                       '978' || lpad(g::text, 10, '0'),
+                       '978' || lpad(g::text, 10, '0'),
+                       random() > 0.02,
+                       DATE '1950-01-01' + floor(random() * 27000)::int,
+                       authors.ids[1 + floor(random() * array_length(authors.ids, 1))::int],
+                       genres.ids[1 + floor(random() * array_length(genres.ids, 1))::int],
+                       80 + floor(random() * 900)::int,
+                       %(prefix)s || ' Press ' || (g %% 50),
+                       %(currency_id)s,
+                       %(company_id)s,
+                       round((5 + random() * 60)::numeric, 2),
+                       'available',
+                       %(today)s::date - floor(power(random(), 2) * 1825)::int,
+                       (ARRAY['new', 'good', 'good', 'good', 'fair', 'fair', 'poor', 'damaged'])[1 + floor(random() * 8)::int],
+                       0,
+                       %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+                FROM generate_series(%(start)s, %(stop)s) g, authors, genres
+            """, dict(params, start=first + start, stop=first + stop))
+
+        self._insert_chunks('books', counts['books'], insert_books)
+
+        first = self._next_number('custom_library_member', 'member_number', FACTORY_MEMBER_PREFIX)
+
+        def insert_members(start, stop):
+            cr.execute("""
+                WITH partners AS (
+                    INSERT INTO res_partner
+                        (name, complete_name, active, type, is_company, email,
+                         create_uid, create_date, write_uid, write_date)
+                    SELECT %(prefix)s || ' Member ' || g, %(prefix)s || ' Member ' || g, TRUE, 'contact', FALSE,
+                           'bench.member' || g || '@example.com',
+                           %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+                    FROM generate_series(%(start)s, %(stop)s) g
+                    RETURNING id, name
+                ), drawn AS (
+                    SELECT id, name, random() AS r,
+                           %(today)s::date - floor(random() * 1460)::int AS membership_date
+                    FROM partners
+                ), members AS (
+                    SELECT id, name, membership_date,
+                           CASE WHEN r < 0.55 THEN 'standard'
+                                WHEN r < 0.75 THEN 'student'
+                                WHEN r < 0.90 THEN 'premium'
+                                ELSE 'senior' END AS membership_type
+                    FROM drawn
+                )
+                INSERT INTO custom_library_member
+                    (partner_id, name, member_number, membership_date, expiry_date, active,
+                     membership_type, stored_loan_count, stored_overdue_count, company_id,
+                     create_uid, create_date, write_uid, write_date)
+                SELECT id, name,
+                       %(member_prefix)s || lpad((%(start)s + row_number() OVER (ORDER BY id) - 1)::text, 8, '0'),
+                       membership_date,
+                       membership_date + CASE membership_type
+                           WHEN 'premium' THEN 730 WHEN 'student' THEN 180 ELSE 365 END,
+                       TRUE, membership_type, 0, 0, %(company_id)s,
+                       %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+                FROM members
+            """, dict(params, start=first + start, stop=first + stop, member_prefix=FACTORY_MEMBER_PREFIX))
+            cr.execute("""
+                UPDATE res_partner SET commercial_partner_id = id
+                WHERE commercial_partner_id IS NULL AND name LIKE %s
+            """, [FACTORY_PREFIX + ' Member %'])
+
+        self._insert_chunks('members', counts['members'], insert_members)
+
+        # Archived loans keep their reference
+        first = max(self._next_number(table, 'name', FACTORY_LOAN_PREFIX)
+                    for table in ('custom_book_loan', 'custom_book_loan_archive'))
+
+        def insert_loans(start, stop):
+            cr.execute("""
+                WITH books AS (
+                    SELECT ARRAY(SELECT id FROM custom_book WHERE active = TRUE ORDER BY id) AS ids
+                ), partners AS (
+                    SELECT ARRAY(SELECT partner_id FROM custom_library_member WHERE active = TRUE ORDER BY id) AS ids
+                ), base AS (
+                    SELECT g,
+                           %(today)s::date - floor(power(random(), 1.5) * %(history_days)s)::int AS loan_date,
+                           (ARRAY[7, 14, 14, 14, 21, 28])[1 + floor(random() * 6)::int] AS duration,
+                           random() AS r_state,
+                           random() AS r_return,
+                           books.ids[1 + floor(random() * array_length(books.ids, 1))::int] AS book_id,
+                           partners.ids[1 + floor(random() * array_length(partners.ids, 1))::int] AS member_id
+                    FROM generate_series(%(start)s, %(stop)s) g, books, partners
+                ), dated AS (
+                    SELECT base.*, loan_date + duration AS return_date,
+                           CASE WHEN loan_date + duration >= %(today)s::date THEN
+                                    CASE WHEN r_state < 0.1 THEN 'draft' ELSE 'confirmed' END
+                                WHEN r_state < 0.85 THEN 'returned'
+                                WHEN r_state < 0.88 THEN 'lost'
+                                ELSE 'overdue' END AS state
+                    FROM base
+                ), returned AS (
+                    SELECT dated.*,
+                           CASE WHEN state = 'returned' THEN
+                               LEAST(loan_date + 1 + floor(r_return * duration * 1.4)::int, %(today)s::date)
+                           END AS actual_return_date
+                    FROM dated
+                )
+                INSERT INTO custom_book_loan
+                    (name, book_id, member_id, loan_date, return_date, actual_return_date, state,
+                     loan_duration, fine_amount, company_id,
+                     create_uid, create_date, write_uid, write_date)
+                SELECT %(loan_prefix)s || lpad(g::text, 8, '0'), book_id, member_id,
+                       loan_date, return_date, actual_return_date, state, duration,
+                       CASE WHEN state = 'returned' AND actual_return_date > return_date
+                                THEN (actual_return_date - return_date) * 1.5
+                            WHEN state = 'overdue' THEN GREATEST(%(today)s::date - return_date, 0) * 1.5
+                            ELSE 0 END,
+                       %(company_id)s,
+                       %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+                FROM returned
+            """, dict(params, start=first + start, stop=first + stop, loan_prefix=FACTORY_LOAN_PREFIX))
+
+        self._insert_chunks('loans', loans, insert_loans)
+
+        self._refresh_derived_data()
+        _logger.info("Data factory: generated %s", counts)
+        return counts
+
+    @api.model
+    def _refresh_derived_data(self):
+        """Recompute the stored counters, book states and daily statistics after raw inserts"""
+        cr = self.env.cr
+        cr.execute("""
+            UPDATE custom_book b
+            SET state = CASE WHEN l.lost THEN 'lost' WHEN l.open THEN 'borrowed' ELSE 'available' END,
+                loan_count = COALESCE(l.total, 0)
+            FROM custom_book b2
+            LEFT JOIN (
+                SELECT book_id,
+                       COUNT(*) AS total,
+                       bool_or(state IN ('confirmed', 'overdue')) AS open,
+                       bool_or(state = 'lost') AS lost
+                FROM custom_book_loan_history
+                GROUP BY book_id
+            ) l ON l.book_id = b2.id
+            WHERE b.id = b2.id
+        """)
+        for table, column in (('custom_author', 'author_id'), ('custom_book_genre', 'genre_id')):
+            cr.execute("""
+                UPDATE {table} t SET book_count = COALESCE(c.total, 0)
+                FROM {table} t2
+                LEFT JOIN (
+                    SELECT {column} AS key, COUNT(*) AS total FROM custom_book
+                    WHERE active = TRUE GROUP BY {column}
+                ) c ON c.key = t2.id
+                WHERE t.id = t2.id
+            """.format(table=table, column=column))
+        self.env.invalidate_all()
+        self.env['custom.library.member']._refresh_loan_counters()
+        self.env['custom.library.loan.daily.stats']._rebuild()
+        for table in ('custom_book_loan', 'custom_book', 'custom_library_member',
+                      'custom_author', 'custom_book_genre', 'custom_library_loan_daily_stats'):
+            cr.execute("ANALYZE {table}".format(table=table))
+
+    @api.model
+    def _purge(self):
+        """Delete every record created by the data factory"""
+        cr = self.env.cr
+        self.env.flush_all()
+        cr.execute("DELETE FROM custom_book_loan WHERE name LIKE %s", [FACTORY_LOAN_PREFIX + '%'])
+        _logger.info("Data factory: purged %s loans", cr.rowcount)
+        cr.execute("DELETE FROM custom_book_loan_archive WHERE name LIKE %s", [FACTORY_LOAN_PREFIX + '%'])
+        cr.execute("""
+            DELETE FROM custom_library_member WHERE member_number LIKE %s RETURNING partner_id
+        """, [FACTORY_MEMBER_PREFIX + '%'])
+        partner_ids = tuple(row[0] for row in cr.fetchall())
+        if partner_ids:
+            cr.execute("DELETE FROM res_partner WHERE id IN %s", [partner_ids])
+        for table in ('custom_book', 'custom_author', 'custom_book_genre'):
+            cr.execute("DELETE FROM {table} WHERE name LIKE %s".format(table=table), [FACTORY_PREFIX + ' %'])
+        self._refresh_derived_data()
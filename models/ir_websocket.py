@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+from .dashboard_snapshot import BUS_CHANNEL_PREFIX
+
+
+class IrWebsocket(models.AbstractModel):
+    _inherit = 'ir.websocket'
+
+    def _build_bus_channel_list(self, channels):
+        # Dashboard channels are only granted for the companies of the user
+        allowed = {BUS_CHANNEL_PREFIX + str(company_id) for company_id in self.env.user.company_ids.ids}
+        channels = [
+            channel for channel in channels
+            if not (isinstance(channel, str) and channel.startswith(BUS_CHANNEL_PREFIX)) or channel in allowed
+        ]
+        return super(IrWebsocket, self)._build_bus_channel_list(channels)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools.misc import hmac
+import base64
+import binascii
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 80
+MAX_PAGE_SIZE = 1000
+
+# Resources of the read API: model, sort keys (each ending with the id to be
+# unique, and backed by an index) and fields returned by default
+KEYSET_RESOURCES = {
+    'loans': {
+        'model': 'custom.book.loan',
+        'sorts': {
+            'loan_date': [('loan_date', 'desc'), ('id', 'desc')],
+            'id': [('id', 'asc')],
+        },
+        'default_sort': 'loan_date',
+        'fields': ['name', 'book_id', 'member_id', 'loan_date', 'return_date', 'actual_return_date',
+                   'state', 'fine_amount'],
+    },
+    'books': {
+        'model': 'custom.book',
+        'sorts': {
+            'name': [('name', 'asc'), ('id', 'asc')],
+            'id': [('id', 'asc')],
+        },
+        'default_sort': 'name',
+        'fields': ['name', 'isbn', 'author_id', 'genre_id', 'state', 'loan_count'],
+    },
+    'members': {
+        'model': 'custom.library.member',
+        'sorts': {
+            'member_number': [('member_number', 'asc'), ('id', 'asc')],
+            'id': [('id', 'asc')],
+        },
+        'default_sort': 'member_number',
+        'fields': ['name', 'member_number', 'membership_type', 'membership_date', 'expiry_date',
+                   'stored_loan_count', 'stored_overdue_count'],
+    },
+}
+
+
+class LibraryKeysetApi(models.AbstractModel):
+    """Read API over loans, books and members with keyset pagination.
+
+    A page continues after the sort key of the last record of the previous
+    page (``WHERE (loan_date, id) < (last loan_date, last id)``) instead of
+    skipping an offset, so every page is an index range scan and deep pages
+    cost the same as the first. The position is returned as an opaque,
+    signed continuation token.
+    """
+    _name = 'custom.library.keyset.api'
+    _description = 'Library Keyset Pagination API'
+
+    @api.model
+    def _encode_token(self, resource, sort, values):
+        payload = json.dumps([resource, sort, values], separators=(',', ':'), default=str)
+        signature = hmac(self.env(su=True), 'individual_mod.keyset_api', payload)
+        return base64.urlsafe_b64encode(json.dumps([payload, signature]).encode()).decode()
+
+    @api.model
+    def _decode_token(self, token, resource, sort):
+        """Return the sort key values stored in a continuation token"""
+        try:
+            payload, signature = json.loads(base64.urlsafe_b64decode(token.encode()))
+            token_resource, token_sort, values = json.loads(payload)
+        except (TypeError, ValueError, binascii.Error):
+            raise UserError(_("Invalid continuation token"))
+        if signature != hmac(self.env(su=True), 'individual_mod.keyset_api', payload):
+            raise UserError(_("Invalid continuation token"))
+        if (token_resource, token_sort) != (resource, sort):
+            raise UserError(_("The continuation token belongs to another resource or sort order"))
+        return values
+
+    @api.model
+    def _get_after_domain(self, keys, values):
+        """Domain of the records sorted after `values` on `keys`.
+
+        For keys (a desc, id desc) and values (x, y) this is
+        ``a <= x AND (a < x OR (a = x AND id < y))``, the first condition
+        letting the index scan start at the position instead of skipping to it.
+        """
+        domain = []
+        for index, (fname, direction) in enumerate(keys):
+            operator = '<' if direction == 'desc' else '>'
+            branch = [(key, '=', value) for (key, key_direction), value in zip(keys[:index], values)]
+            branch.append((fname, operator, values[index]))
+            branch = ['&'] * (len(branch) - 1) + branch
+            domain = ['|'] + domain + branch if domain else branch
+        if len(keys) > 1:
+            fname, direction = keys[0]
+            domain = ['&', (fname, '<=' if direction == 'desc' else '>=', values[0])] + domain
+        return domain
+
+    @api.model
+    def _get_page(self, resource, field_names=None, limit=DEFAULT_PAGE_SIZE, token=None, sort=None):
+        """Return one page of records of a resource and the token of the next page"""
+        if resource not in KEYSET_RESOURCES:
+            raise UserError(_("Unknown resource: %s", resource))
+        config = KEYSET_RESOURCES[resource]
+        Model = self.env[config['model']]
+        sort = sort or config['default_sort']
+        if sort not in config['sorts']:
+            raise UserError(_("Unsupported sort for %s: %s", resource, sort))
+        try:
+            limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            raise UserError(_("Invalid page size: %s", limit))
+        field_names = list(field_names or config['fields'])
+        unknown = [fname for fname in field_names if fname not in Model._fields]
+        if unknown:
+            raise UserError(_("Unknown fields for %s: %s", resource, ', '.join(unknown)))
+
+        keys = config['sorts'][sort]
+        domain = []
+        if token:
+            domain = self._get_after_domain(keys, self._decode_token(token, resource, sort))
+        order = ', '.join('%s %s' % key for key in keys)
+        key_names = [fname for fname, direction in keys]
+        # One record more than the page tells whether there is a next page
+        records = Model.search_read(domain, list(dict.fromkeys(field_names + key_names)),
+                                    limit=limit + 1, order=order)
+        next_token = None
+        if len(records) > limit:
+            records = records[:limit]
+            last = records[-1]
+            next_token = self._encode_token(resource, sort, [
+                fields.Date.to_string(last[fname]) if Model._fields[fname].type == 'date' else last[fname]
+                for fname in key_names
+            ])
+        return {
+            'records': [{fname: record[fname] for fname in ['id'] + field_names} for record in records],
+            'next_token': next_token,
+        }
@@ -1,15 +1,29 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from datetime import datetime, timedelta
+import logging
+import re
+
+_logger = logging.getLogger(__name__)
+
+# Member sequence of data/ir_sequence_data.xml, created early when renumbering members on upgrade
+MEMBER_SEQUENCE_VALUES = {
+    'name': 'Library Member',
+    'code': 'custom.library.member',
+    'prefix': 'MEM',
+    'padding': 5,
+    'number_next': 100,
+    'company_id': False,
+}
 
 class LibraryMember(models.Model):
     _name = 'custom.library.member'
     _description = 'Library Member'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['mail.thread', 'mail.activity.mixin', 'custom.library.dashboard.notify']
     
     name = fields.Char(related='partner_id.name', store=True)
     partner_id = fields.Many2one('res.partner', string='Contact', required=True, 
-                                tracking=True, ondelete='restrict')
+                                tracking=True, ondelete='restrict', index=True)
     member_number = fields.Char('Member Number', required=True, copy=False, 
                                 readonly=True, default=lambda self: _('New'))
     membership_date = fields.Date('Membership Date', default=fields.Date.today, required=True)
@@ -25,6 +39,9 @@ class LibraryMember(models.Model):
     
     loan_count = fields.Integer('Loan Count', compute='_compute_loan_count')
     overdue_count = fields.Integer('Overdue Count', compute='_compute_loan_count')
+    # Stored copies kept current by the loan hooks, used to sort and filter members
+    stored_loan_count = fields.Integer('Total Loans', readonly=True, index=True, copy=False)
+    stored_overdue_count = fields.Integer('Total Overdue', readonly=True, index=True, copy=False)
     
     notes = fields.Text('Notes')
     phone = fields.Char(related='partner_id.phone', readonly=False)
@@ -32,13 +49,66 @@ class LibraryMember(models.Model):
     
     max_loan_limit = fields.Integer('Max Books Allowed', compute='_compute_loan_limit')
     currency_id = fields.Many2one('res.currency', related='company_id.currency_id')
-    company_id = fields.Many2one('res.company', default=lambda self: self.env.company)
+    company_id = fields.Many2one('res.company', default=lambda self: self.env.company, index=True)
     
-    @api.model
-    def create(self, vals):
-        if vals.get('member_number', _('New')) == _('New'):
-            vals['member_number'] = self.env['ir.sequence'].next_by_code('custom.library.member') or _('New')
-        return super(LibraryMember, self).create(vals)
+    _sql_constraints = [
+        ('member_number_company_uniq', 'unique (member_number, company_id)',
+         'The member number must be unique per company')
+    ]
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        # Reserve the member numbers of the whole batch in one sequence call
+        new_vals = [vals for vals in vals_list if vals.get('member_number', _('New')) == _('New')]
+        numbers = self.env['ir.sequence']._next_by_code_block('custom.library.member', len(new_vals))
+        for vals, number in zip(new_vals, numbers):
+            vals['member_number'] = number or _('New')
+        partner_ids = [vals['partner_id'] for vals in vals_list if vals.get('partner_id')]
+        # The loans of the partners in every company move to the new membership type
+        Loan = self.env['custom.book.loan'].sudo()
+        ArchivedLoan = self.env['custom.book.loan.archive'].sudo()
+        loans = Loan.search([('member_id', 'in', partner_ids)]) if partner_ids else Loan
+        archived_loans = ArchivedLoan.search([('member_id', 'in', partner_ids)]) if partner_ids else ArchivedLoan
+        DailyStats = self.env['custom.library.loan.daily.stats']
+        DailyStats._apply_loan_delta(loans.ids, -1)
+        DailyStats._apply_loan_delta(archived_loans.ids, -1, table='custom_book_loan_archive')
+        members = super(LibraryMember, self).create(vals_list)
+        DailyStats._apply_loan_delta(loans.ids, 1)
+        DailyStats._apply_loan_delta(archived_loans.ids, 1, table='custom_book_loan_archive')
+        self._refresh_loan_counters(members.partner_id.ids)
+        return members
+    
+    def write(self, vals):
+        # Loans are counted under the membership type of their member in the daily
+        # statistics, whichever company they belong to
+        loans = self.env['custom.book.loan'].sudo()
+        archived_loans = self.env['custom.book.loan.archive'].sudo()
+        if 'membership_type' in vals or 'partner_id' in vals:
+            partners = self.partner_id
+            if vals.get('partner_id'):
+                partners |= self.env['res.partner'].browse(vals['partner_id'])
+            loans = loans.search([('member_id', 'in', partners.ids)])
+            archived_loans = archived_loans.search([('member_id', 'in', partners.ids)])
+        DailyStats = self.env['custom.library.loan.daily.stats']
+        DailyStats._apply_loan_delta(loans.ids, -1)
+        DailyStats._apply_loan_delta(archived_loans.ids, -1, table='custom_book_loan_archive')
+        res = super(LibraryMember, self).write(vals)
+        DailyStats._apply_loan_delta(loans.ids, 1)
+        DailyStats._apply_loan_delta(archived_loans.ids, 1, table='custom_book_loan_archive')
+        if 'partner_id' in vals:
+            self._refresh_loan_counters(self.partner_id.ids)
+        return res
+    
+    def unlink(self):
+        loans = self.env['custom.book.loan'].sudo().search([('member_id', 'in', self.partner_id.ids)])
+        archived_loans = self.env['custom.book.loan.archive'].sudo().search([('member_id', 'in', self.partner_id.ids)])
+        DailyStats = self.env['custom.library.loan.daily.stats']
+        DailyStats._apply_loan_delta(loans.ids, -1)
+        DailyStats._apply_loan_delta(archived_loans.ids, -1, table='custom_book_loan_archive')
+        res = super(LibraryMember, self).unlink()
+        DailyStats._apply_loan_delta(loans.ids, 1)
+        DailyStats._apply_loan_delta(archived_loans.ids, 1, table='custom_book_loan_archive')
+        return res
     
     @api.depends('membership_date', 'membership_type')
     def _compute_expiry_date(self):
@@ -57,13 +127,123 @@ class LibraryMember(models.Model):
             else:
                 member.expiry_date = False
     
+    def _auto_init(self):
+        cr = self.env.cr
+        # Members created before the member sequence are all numbered 'New':
+        # renumber them before the unique constraint is added
+        if tools.table_exists(cr, self._table) and not tools.constraint_definition(
+                cr, self._table, '%s_member_number_company_uniq' % self._table):
+            self._renumber_duplicate_members()
+        # Fill the stored counters of existing members once, when their columns
+        # are created (after every model is set up); the loan hooks keep them current
+        if tools.table_exists(cr, self._table) and not tools.column_exists(cr, self._table, 'stored_loan_count'):
+            self.pool.post_init(self._refresh_loan_counters)
+        return super(LibraryMember, self)._auto_init()
+    
+    def init(self):
+        # Keyset pagination of the read API by member number
+        tools.create_index(self.env.cr, 'custom_library_member_member_number_id_idx', self._table,
+                           ['member_number', 'id'])
+        # Number new members after the existing ones
+        sequence = self.env.ref('individual_mod.seq_custom_library_member', raise_if_not_found=False)
+        if sequence:
+            self._sync_member_sequence(sequence)
+    
+    @api.model
+    def _sync_member_sequence(self, sequence):
+        """Move the member sequence past the highest number already given"""
+        self.env.cr.execute(
+            "SELECT MAX(substring(member_number FROM %s)::bigint) FROM custom_library_member",
+            ['^%s([0-9]+)$' % re.escape(sequence.prefix or '')],
+        )
+        last = self.env.cr.fetchone()[0] or 0
+        if last >= sequence.number_next_actual:
+            sequence.sudo().write({'number_next': last + 1})
+    
+    @api.model
+    def _renumber_duplicate_members(self):
+        """Give a new sequence number to the members numbered 'New' or sharing their number.
+
+        The first member of each number keeps it. On an upgrade the member
+        sequence is not loaded yet: it is created here, with the values and
+        xmlid of data/ir_sequence_data.xml (noupdate, so the data file keeps it).
+        """
+        cr = self.env.cr
+        cr.execute("""
+            SELECT id FROM (
+                SELECT id, member_number,
+                       ROW_NUMBER() OVER (PARTITION BY member_number, company_id ORDER BY id) AS rank
+                FROM custom_library_member
+            ) m
+            WHERE member_number IS NULL OR member_number = 'New' OR rank > 1
+            ORDER BY id
+        """)
+        member_ids = [row[0] for row in cr.fetchall()]
+        if not member_ids:
+            return
+        sequence = self.env.ref('individual_mod.seq_custom_library_member', raise_if_not_found=False)
+        if not sequence:
+            sequence = self.env['ir.sequence'].sudo().create(MEMBER_SEQUENCE_VALUES)
+            self.env['ir.model.data']._update_xmlids([{
+                'xml_id': 'individual_mod.seq_custom_library_member',
+                'record': sequence,
+                'noupdate': True,
+            }])
+        self._sync_member_sequence(sequence)
+        numbers = sequence.sudo()._next_block(len(member_ids))
+        cr.execute("""
+            UPDATE custom_library_member m SET member_number = v.number
+            FROM unnest(%s::int[], %s::varchar[]) AS v(id, number)
+            WHERE m.id = v.id
+        """, [member_ids, numbers])
+        _logger.info("Renumbered %s library members", len(member_ids))
+    
     def _compute_loan_count(self):
+        # Count loans and overdue loans of the whole recordset in one grouped query
+        counts = {}
+        if self.partner_id:
+            # Archived loans are returned or lost, they only add to the totals
+            for partner, count in self.env['custom.book.loan.archive']._read_group(
+                    [('member_id', 'in', self.partner_id.ids)], groupby=['member_id'], aggregates=['__count']):
+                counts[partner.id] = (count, 0)
+            groups = self.env['custom.book.loan']._read_group(
+                [('member_id', 'in', self.partner_id.ids)],
+                groupby=['member_id', 'state'],
+                aggregates=['__count'],
+            )
+            for partner, state, count in groups:
+                total, overdue = counts.get(partner.id, (0, 0))
+                counts[partner.id] = (total + count, overdue + (count if state == 'overdue' else 0))
         for member in self:
-            loan_domain = [('member_id', '=', member.partner_id.id)]
-            member.loan_count = self.env['custom.book.loan'].search_count(loan_domain)
-            
-            overdue_domain = loan_domain + [('state', '=', 'overdue')]
-            member.overdue_count = self.env['custom.book.loan'].search_count(overdue_domain)
+            member.loan_count, member.overdue_count = counts.get(member.partner_id.id, (0, 0))
+    
+    @api.model
+    def _refresh_loan_counters(self, partner_ids=None):
+        """Update the stored loan counters of the members of the given partners (all by default)"""
+        if partner_ids is not None and not partner_ids:
+            return
+        self.env['custom.book.loan'].flush_model(['member_id', 'state'])
+        self.flush_model(['partner_id'])
+        loan_filter = partner_filter = ''
+        if partner_ids is not None:
+            loan_filter = 'WHERE member_id IN %(partner_ids)s'
+            partner_filter = 'AND m2.partner_id IN %(partner_ids)s'
+        self.env.cr.execute("""
+            UPDATE custom_library_member m
+            SET stored_loan_count = COALESCE(c.total, 0),
+                stored_overdue_count = COALESCE(c.overdue, 0)
+            FROM custom_library_member m2
+            LEFT JOIN (
+                SELECT member_id,
+                       COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE state = 'overdue') AS overdue
+                FROM custom_book_loan_history
+                {loan_filter}
+                GROUP BY member_id
+            ) c ON c.member_id = m2.partner_id
+            WHERE m.id = m2.id {partner_filter}
+        """.format(loan_filter=loan_filter, partner_filter=partner_filter), {'partner_ids': tuple(partner_ids or ())})
+        self.invalidate_model(['stored_loan_count', 'stored_overdue_count'])
     
     @api.depends('membership_type')
     def _compute_loan_limit(self):
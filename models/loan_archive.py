@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools, _
+from datetime import timedelta
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Age (in days since the return) after which returned and lost loans are archived, 0 disables
+ARCHIVE_DAYS_PARAM = 'individual_mod.loan_archive_days'
+DEFAULT_ARCHIVE_DAYS = 730
+ARCHIVE_BATCH_SIZE = 10000
+
+# Loan columns copied to the archive, in the same order
+ARCHIVE_COLUMNS = [
+    'id', 'name', 'book_id', 'member_id', 'loan_date', 'return_date', 'actual_return_date',
+    'state', 'loan_duration', 'fine_amount', 'company_id', 'notes',
+    'create_uid', 'create_date', 'write_uid', 'write_date',
+]
+
+LOAN_STATES = [
+    ('draft', 'Draft'),
+    ('confirmed', 'Confirmed'),
+    ('returned', 'Returned'),
+    ('overdue', 'Overdue'),
+    ('lost', 'Lost'),
+]
+
+
+class BookLoanArchive(models.Model):
+    """Returned and lost loans moved out of custom_book_loan.
+
+    Archived loans keep the id they had as loans, and their chatter, so they
+    can still be traced; they are only written by the archival cron.
+    """
+    _name = 'custom.book.loan.archive'
+    _description = 'Archived Book Loan'
+    _inherit = ['mail.thread']
+    _order = 'loan_date desc, id desc'
+
+    name = fields.Char('Reference', readonly=True)
+    book_id = fields.Many2one('custom.book', string='Book', readonly=True, index=True, ondelete='restrict')
+    member_id = fields.Many2one('res.partner', string='Member', readonly=True, index=True, ondelete='restrict')
+    loan_date = fields.Date('Loan Date', readonly=True)
+    return_date = fields.Date('Return Date', readonly=True)
+    actual_return_date = fields.Date('Actual Return Date', readonly=True)
+    state = fields.Selection(LOAN_STATES, string='Status', readonly=True)
+    loan_duration = fields.Integer('Loan Duration (days)', readonly=True)
+    fine_amount = fields.Monetary('Fine Amount', readonly=True)
+    currency_id = fields.Many2one('res.currency', related='company_id.currency_id')
+    company_id = fields.Many2one('res.company', readonly=True, index=True)
+    notes = fields.Text('Notes', readonly=True)
+    archive_date = fields.Date('Archived On', readonly=True)
+
+    def init(self):
+        cr = self.env.cr
+        # Yearly fine revenue (_compute_revenue reads the loan history)
+        tools.create_index(cr, 'custom_book_loan_archive_state_actual_return_date_idx', self._table,
+                           ['state', 'actual_return_date'], where='fine_amount > 0')
+        tools.create_index(cr, 'custom_book_loan_archive_loan_date_id_idx', self._table,
+                           ['loan_date DESC', 'id DESC'])
+
+    @api.model
+    def _get_archive_cutoff(self):
+        """Return the date before which finished loans are archived, or None when disabled"""
+        value = self.env['ir.config_parameter'].sudo().get_param(ARCHIVE_DAYS_PARAM, DEFAULT_ARCHIVE_DAYS)
+        try:
+            days = int(value)
+        except (TypeError, ValueError):
+            days = DEFAULT_ARCHIVE_DAYS
+        if days <= 0:
+            return None
+        return fields.Date.context_today(self) - timedelta(days=days)
+
+    @api.model
+    def _archive_batch(self, cutoff, batch_size):
+        """Move one batch of finished loans older than `cutoff` to the archive, return the moved ids"""
+        cr = self.env.cr
+        columns = ', '.join(ARCHIVE_COLUMNS)
+        cr.execute("""
+            WITH moved AS (
+                DELETE FROM custom_book_loan
+                WHERE id IN (
+                    SELECT id FROM custom_book_loan
+                    WHERE state IN ('returned', 'lost')
+                      AND COALESCE(actual_return_date, return_date, loan_date) < %(cutoff)s
+                    ORDER BY id
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {columns}
+            )
+            INSERT INTO custom_book_loan_archive ({columns}, archive_date)
+            SELECT {columns}, %(today)s FROM moved
+            RETURNING id
+        """.format(columns=columns), {
+            'cutoff': cutoff,
+            'limit': batch_size,
+            'today': fields.Date.context_today(self),
+        })
+        ids = tuple(row[0] for row in cr.fetchall())
+        if ids:
+            # The chatter follows the loans, followers and activities are dropped
+            cr.execute("""
+                UPDATE mail_message SET model = %s
+                WHERE model = 'custom.book.loan' AND res_id IN %s
+            """, [self._name, ids])
+            cr.execute("DELETE FROM mail_followers WHERE res_model = 'custom.book.loan' AND res_id IN %s", [ids])
+            cr.execute("DELETE FROM mail_activity WHERE res_model = 'custom.book.loan' AND res_id IN %s", [ids])
+        return ids
+
+    @api.model
+    def _cron_archive_loans(self, batch_size=ARCHIVE_BATCH_SIZE):
+        """Scheduled job moving old returned and lost loans to the archive.
+
+        Batches are committed one at a time. The daily statistics, book and
+        member loan counters include archived loans, so they are unchanged.
+        """
+        cutoff = self._get_archive_cutoff()
+        if not cutoff:
+            return
+        self.env.flush_all()
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        start = time.monotonic()
+        archived = 0
+        while True:
+            ids = self._archive_batch(cutoff, batch_size)
+            if not ids:
+                break
+            archived += len(ids)
+            if auto_commit:
+                self.env.cr.commit()
+        self.env.invalidate_all()
+        if archived:
+            for table in ('custom_book_loan', 'custom_book_loan_archive'):
+                self.env.cr.execute("ANALYZE {table}".format(table=table))
+        elapsed = time.monotonic() - start
+        _logger.info(
+            "Loan archival: %s loans returned before %s archived in %.2fs (%.0f rows/s)",
+            archived, cutoff, elapsed, archived / elapsed if elapsed else 0,
+        )
+
+
+class BookLoanHistory(models.Model):
+    """Live and archived loans together, for reporting over the whole history"""
+    _name = 'custom.book.loan.history'
+    _description = 'Book Loan History'
+    _auto = False
+    _order = 'loan_date desc, id desc'
+
+    name = fields.Char('Reference', readonly=True)
+    book_id = fields.Many2one('custom.book', string='Book', readonly=True)
+    member_id = fields.Many2one('res.partner', string='Member', readonly=True)
+    loan_date = fields.Date('Loan Date', readonly=True)
+    return_date = fields.Date('Return Date', readonly=True)
+    actual_return_date = fields.Date('Actual Return Date', readonly=True)
+    state = fields.Selection(LOAN_STATES, string='Status', readonly=True)
+    loan_duration = fields.Integer('Loan Duration (days)', readonly=True)
+    fine_amount = fields.Monetary('Fine Amount', readonly=True)
+    currency_id = fields.Many2one('res.currency', related='company_id.currency_id')
+    company_id = fields.Many2one('res.company', readonly=True)
+    archived = fields.Boolean('Archived', readonly=True)
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        columns = 'id, name, book_id, member_id, loan_date, return_date, actual_return_date, ' \
+                  'state, loan_duration, fine_amount, company_id'
+        self.env.cr.execute("""
+            CREATE VIEW {table} AS (
+                SELECT {columns}, FALSE AS archived FROM custom_book_loan
+                UNION ALL
+                SELECT {columns}, TRUE AS archived FROM custom_book_loan_archive
+            )
+        """.format(table=self._table, columns=columns))
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools, _
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Loan fields that change the rollup row a loan is counted in
+DAILY_STATS_FIELDS = {
+    'loan_date', 'company_id', 'state', 'book_id', 'member_id',
+    'actual_return_date', 'loan_duration', 'fine_amount',
+}
+
+# Transaction advisory lock serializing the writers of the rollup table
+ROLLUP_LOCK_KEY = 7215430
+
+# Measure columns of the rollup and of its pending deltas
+ROLLUP_MEASURES = ['loan_count', 'returned_count', 'duration_days', 'fine_amount']
+
+
+class LoanDailyStatsDelta(models.Model):
+    """Changes to the daily loan statistics not yet folded into the rollup.
+
+    Declared before the rollup, whose init() empties this table on the first rebuild.
+    """
+    _name = 'custom.library.loan.daily.stats.delta'
+    _description = 'Daily Loan Statistics Delta'
+
+    day = fields.Date('Day', readonly=True)
+    company_id = fields.Many2one('res.company', readonly=True)
+    state = fields.Char('Status', readonly=True)
+    genre_id = fields.Many2one('custom.book.genre', string='Genre', readonly=True)
+    membership_type = fields.Char('Membership Type', readonly=True)
+
+    loan_count = fields.Integer('Loans', readonly=True)
+    returned_count = fields.Integer('Returned Loans', readonly=True)
+    duration_days = fields.Integer('Total Loan Duration (days)', readonly=True)
+    fine_amount = fields.Float('Fine Amount', readonly=True)
+
+
+class LoanDailyStats(models.Model):
+    _name = 'custom.library.loan.daily.stats'
+    _description = 'Daily Loan Statistics'
+    _order = 'day desc'
+
+    day = fields.Date('Day', required=True, index=True, readonly=True)
+    company_id = fields.Many2one('res.company', readonly=True)
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('confirmed', 'Confirmed'),
+        ('returned', 'Returned'),
+        ('overdue', 'Overdue'),
+        ('lost', 'Lost'),
+    ], string='Status', readonly=True)
+    genre_id = fields.Many2one('custom.book.genre', string='Genre', readonly=True)
+    membership_type = fields.Selection([
+        ('standard', 'Standard'),
+        ('premium', 'Premium'),
+        ('student', 'Student'),
+        ('senior', 'Senior')
+    ], string='Membership Type', readonly=True)
+
+    loan_count = fields.Integer('Loans', readonly=True)
+    returned_count = fields.Integer('Returned Loans', readonly=True)
+    duration_days = fields.Integer('Total Loan Duration (days)', readonly=True)
+    fine_amount = fields.Float('Fine Amount', readonly=True)
+
+    def init(self):
+        # Unique key used by the ON CONFLICT upserts of _apply_loan_delta
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS custom_library_loan_daily_stats_key_uniq
+            ON custom_library_loan_daily_stats (
+                day, COALESCE(company_id, 0), COALESCE(state, ''),
+                COALESCE(genre_id, 0), COALESCE(membership_type, '')
+            )
+        """)
+        # Rollup plus the deltas not folded yet, read by the dashboard (every reader sums the measures)
+        columns = 'day, company_id, state, genre_id, membership_type, ' + ', '.join(ROLLUP_MEASURES)
+        tools.drop_view_if_exists(self.env.cr, 'custom_library_loan_daily_stats_current')
+        self.env.cr.execute("""
+            CREATE VIEW custom_library_loan_daily_stats_current AS (
+                SELECT {columns} FROM custom_library_loan_daily_stats
+                UNION ALL
+                SELECT {columns} FROM custom_library_loan_daily_stats_delta
+            )
+        """.format(columns=columns))
+        self.env.cr.execute("SELECT 1 FROM custom_library_loan_daily_stats LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._rebuild()
+
+    @api.model
+    def _flush_sources(self):
+        """Write pending ORM changes of the tables read by the rollup queries"""
+        self.env['custom.book.loan'].flush_model(list(DAILY_STATS_FIELDS))
+        self.env['custom.book'].flush_model(['genre_id'])
+        self.env['custom.library.member'].flush_model(['partner_id', 'membership_type'])
+
+    @api.model
+    def _aggregate_loans_query(self, where, table='custom_book_loan'):
+        """SELECT grouping loans of `table` by rollup key, multiplied by %(sign)s"""
+        return """
+            SELECT l.loan_date, l.company_id, l.state, b.genre_id, m.membership_type,
+                   %(sign)s * COUNT(*),
+                   %(sign)s * COUNT(*) FILTER (WHERE l.state = 'returned' AND l.actual_return_date IS NOT NULL),
+                   %(sign)s * COALESCE(SUM(l.actual_return_date - l.loan_date)
+                                       FILTER (WHERE l.state = 'returned' AND l.actual_return_date IS NOT NULL), 0),
+                   %(sign)s * COALESCE(SUM(l.fine_amount), 0),
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+            FROM {table} l
+            LEFT JOIN custom_book b ON b.id = l.book_id
+            LEFT JOIN LATERAL (
+                SELECT membership_type FROM custom_library_member
+                WHERE partner_id = l.member_id
+                ORDER BY id
+                LIMIT 1
+            ) m ON TRUE
+            WHERE l.loan_date IS NOT NULL AND {where}
+            GROUP BY 1, 2, 3, 4, 5
+        """.format(where=where, table=table)
+
+    @api.model
+    def _apply_loan_delta(self, loan_ids, sign, table='custom_book_loan'):
+        """Add (sign=1) or remove (sign=-1) the given loans of `table` from the rollup.
+
+        The change is appended to the pending deltas rather than upserted
+        into the shared rollup rows, so desks changing loans of the same day
+        never wait on each other; _fold_deltas() adds them to the rollup, and
+        the dashboard reads both through custom_library_loan_daily_stats_current.
+        """
+        if not loan_ids:
+            return
+        self._flush_sources()
+        self.env.cr.execute("""
+            INSERT INTO custom_library_loan_daily_stats_delta
+                (day, company_id, state, genre_id, membership_type,
+                 loan_count, returned_count, duration_days, fine_amount,
+                 create_uid, create_date, write_uid, write_date)
+            {select}
+        """.format(select=self._aggregate_loans_query('l.id IN %(ids)s', table)), {
+            'sign': sign,
+            'uid': self.env.uid,
+            'ids': tuple(loan_ids),
+        })
+
+    @api.model
+    def _fold_deltas(self):
+        """Move the pending deltas into the rollup, one upsert per rollup row.
+
+        Called before the dashboard snapshots are built. Only one transaction
+        folds at a time; the others skip, the deltas being folded already.
+        """
+        self.env.cr.execute("SELECT pg_try_advisory_xact_lock(%s)", [ROLLUP_LOCK_KEY])
+        if not self.env.cr.fetchone()[0]:
+            return
+        self.env.cr.execute("""
+            WITH folded AS (
+                DELETE FROM custom_library_loan_daily_stats_delta
+                RETURNING day, company_id, state, genre_id, membership_type, {measures}
+            )
+            INSERT INTO custom_library_loan_daily_stats
+                (day, company_id, state, genre_id, membership_type, {measures},
+                 create_uid, create_date, write_uid, write_date)
+            SELECT day, company_id, state, genre_id, membership_type, {sums},
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+            FROM folded
+            GROUP BY day, company_id, state, genre_id, membership_type
+            ON CONFLICT (day, COALESCE(company_id, 0), COALESCE(state, ''),
+                         COALESCE(genre_id, 0), COALESCE(membership_type, ''))
+            DO UPDATE SET {updates},
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """.format(
+            measures=', '.join(ROLLUP_MEASURES),
+            sums=', '.join('SUM(%s)' % measure for measure in ROLLUP_MEASURES),
+            updates=', '.join('{0} = custom_library_loan_daily_stats.{0} + EXCLUDED.{0}'.format(measure)
+                              for measure in ROLLUP_MEASURES),
+        ), {'uid': self.env.uid})
+        if self.env.cr.rowcount:
+            self.invalidate_model()
+
+    @api.model
+    def _merge_into_empty_key(self, field_name, ids):
+        """Count the rollup and delta rows of the given genres or companies under no genre or company.
+
+        Called before deleting them: their column would otherwise be set to
+        NULL in place and collide with the existing NULL rows of the unique
+        rollup key. The rollup rows move to the deltas, folded as usual.
+        """
+        if not ids:
+            return
+        assert field_name in ('genre_id', 'company_id')
+        self.env.cr.execute("SELECT pg_advisory_xact_lock(%s)", [ROLLUP_LOCK_KEY])
+        self.flush_model()
+        self.env['custom.library.loan.daily.stats.delta'].flush_model()
+        columns = ['day', 'company_id', 'state', 'genre_id', 'membership_type'] + ROLLUP_MEASURES
+        self.env.cr.execute("""
+            UPDATE custom_library_loan_daily_stats_delta SET {field} = NULL WHERE {field} IN %(ids)s
+        """.format(field=field_name), {'ids': tuple(ids)})
+        self.env.cr.execute("""
+            WITH moved AS (
+                DELETE FROM custom_library_loan_daily_stats
+                WHERE {field} IN %(ids)s
+                RETURNING {columns}
+            )
+            INSERT INTO custom_library_loan_daily_stats_delta
+                ({columns}, create_uid, create_date, write_uid, write_date)
+            SELECT {moved}, %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+            FROM moved
+        """.format(
+            field=field_name,
+            columns=', '.join(columns),
+            moved=', '.join('NULL' if column == field_name else column for column in columns),
+        ), {'ids': tuple(ids), 'uid': self.env.uid})
+        self.invalidate_model()
+        self.env['custom.library.loan.daily.stats.delta'].invalidate_model()
+
+    @api.model
+    def _rebuild(self):
+        """Recompute the whole rollup from the live and archived loans"""
+        self._flush_sources()
+        self.env.cr.execute("SELECT pg_advisory_xact_lock(%s)", [ROLLUP_LOCK_KEY])
+        self.env.cr.execute("DELETE FROM custom_library_loan_daily_stats_delta")
+        self.env.cr.execute("DELETE FROM custom_library_loan_daily_stats")
+        self.env.cr.execute("""
+            INSERT INTO custom_library_loan_daily_stats
+                (day, company_id, state, genre_id, membership_type,
+                 loan_count, returned_count, duration_days, fine_amount,
+                 create_uid, create_date, write_uid, write_date)
+            {select}
+        """.format(select=self._aggregate_loans_query('TRUE', 'custom_book_loan_history')), {
+            'sign': 1,
+            'uid': self.env.uid,
+        })
+        _logger.info("Rebuilt daily loan statistics: %s rows", self.env.cr.rowcount)
+        self.invalidate_model()
+
+    @api.model
+    def action_rebuild(self):
+        """Full rebuild command, e.g. after bulk SQL changes to loans"""
+        self._rebuild()
+        return True
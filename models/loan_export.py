@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import csv
+import io
+import logging
+import tempfile
+import time
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# Rows fetched from the server-side cursor (and written) per round trip
+EXPORT_CHUNK_SIZE = 10000
+# Bytes of the XLSX file sent per response chunk
+XLSX_READ_SIZE = 1024 * 1024
+# Rows of an XLSX worksheet (the header included) before starting a new one
+XLSX_MAX_ROWS = 1048576
+
+EXPORT_COLUMNS = [
+    ('reference', 'Reference'),
+    ('book', 'Book'),
+    ('isbn', 'ISBN'),
+    ('member', 'Member'),
+    ('member_number', 'Member Number'),
+    ('loan_date', 'Loan Date'),
+    ('return_date', 'Due Date'),
+    ('actual_return_date', 'Return Date'),
+    ('state', 'Status'),
+    ('loan_duration', 'Loan Duration (days)'),
+    ('fine_amount', 'Fine Amount'),
+    ('company', 'Company'),
+]
+DATE_COLUMNS = {'loan_date', 'return_date', 'actual_return_date'}
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+
+class LibraryLoanExport(models.AbstractModel):
+    """Streaming export of the loan and fine history.
+
+    Rows are read from a named (server-side) cursor by chunks and written to
+    the response as they come, so memory stays flat whatever the number of
+    loans. The stream runs after the request cursor is closed, hence on a
+    cursor of its own.
+    """
+    _name = 'custom.library.loan.export'
+    _description = 'Library Loan Export'
+
+    @api.model
+    def _normalize_filters(self, date_from=None, date_to=None, states=None):
+        """Validate the export parameters and return them as a dict of filters"""
+        try:
+            date_from = fields.Date.to_date(date_from) if date_from else None
+            date_to = fields.Date.to_date(date_to) if date_to else None
+        except (TypeError, ValueError) as e:
+            raise UserError(_("Invalid export parameter: %s", e))
+        if date_from and date_to and date_from > date_to:
+            raise UserError(_("The start date must be before the end date"))
+        if isinstance(states, str):
+            states = [state.strip() for state in states.split(',') if state.strip()]
+        allowed = dict(self.env['custom.book.loan']._fields['state'].selection)
+        unknown = [state for state in states or [] if state not in allowed]
+        if unknown:
+            raise UserError(_("Unknown loan status: %s", ', '.join(unknown)))
+        return {
+            'date_from': date_from,
+            'date_to': date_to,
+            'states': tuple(states or ()),
+        }
+
+    @api.model
+    def _get_query(self, filters):
+        """Return the export query and its parameters, restricted to the allowed companies"""
+        clauses = ["(l.company_id IS NULL OR l.company_id IN %(company_ids)s)"]
+        params = {'company_ids': tuple(self.env.companies.ids)}
+        if filters.get('date_from'):
+            clauses.append("l.loan_date >= %(date_from)s")
+            params['date_from'] = filters['date_from']
+        if filters.get('date_to'):
+            clauses.append("l.loan_date <= %(date_to)s")
+            params['date_to'] = filters['date_to']
+        if filters.get('states'):
+            clauses.append("l.state IN %(states)s")
+            params['states'] = filters['states']
+        query = """
+            SELECT l.name, b.name, b.isbn, p.name, m.member_number,
+                   l.loan_date, l.return_date, l.actual_return_date, l.state,
+                   l.loan_duration, l.fine_amount, c.name
+            FROM custom_book_loan_history l
+            LEFT JOIN custom_book b ON b.id = l.book_id
+            LEFT JOIN res_partner p ON p.id = l.member_id
+            LEFT JOIN res_company c ON c.id = l.company_id
+            LEFT JOIN LATERAL (
+                SELECT member_number FROM custom_library_member
+                WHERE partner_id = l.member_id
+                ORDER BY id
+                LIMIT 1
+            ) m ON TRUE
+            WHERE {where}
+            ORDER BY l.loan_date, l.id
+        """.format(where=' AND '.join(clauses))
+        return query, params
+
+    @api.model
+    def _iter_chunks(self, filters, chunk_size=EXPORT_CHUNK_SIZE):
+        """Yield lists of export rows read from a server-side cursor"""
+        self.env['custom.book.loan'].check_access_rights('read')
+        query, params = self._get_query(filters)
+        states = dict(self.env['custom.book.loan']._fields['state'].selection)
+        cursor = self.env.cr._cnx.cursor('library_loan_export')
+        try:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [row[:8] + (states.get(row[8], row[8]),) + row[9:] for row in rows]
+        finally:
+            cursor.close()
+
+    @api.model
+    def _iter_csv(self, filters):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([label for key, label in EXPORT_COLUMNS])
+        for rows in self._iter_chunks(filters):
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+    @api.model
+    def _iter_xlsx(self, filters):
+        """Write the rows in constant memory mode to a temporary file, then stream the file"""
+        if xlsxwriter is None:
+            raise UserError(_("The xlsxwriter library is required to export XLSX files"))
+        with tempfile.TemporaryFile() as output:
+            workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+            header = workbook.add_format({'bold': True})
+            date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+            formats = [date_format if key in DATE_COLUMNS else None for key, label in EXPORT_COLUMNS]
+            worksheet, row_index = None, XLSX_MAX_ROWS
+            for rows in self._iter_chunks(filters):
+                for row in rows:
+                    if row_index >= XLSX_MAX_ROWS:
+                        worksheet = workbook.add_worksheet()
+                        worksheet.write_row(0, 0, [label for key, label in EXPORT_COLUMNS], header)
+                        row_index = 1
+                    for column, value in enumerate(row):
+                        if value is not None:
+                            worksheet.write(row_index, column, value, formats[column])
+                    row_index += 1
+            if worksheet is None:
+                workbook.add_worksheet().write_row(0, 0, [label for key, label in EXPORT_COLUMNS], header)
+            workbook.close()
+            output.seek(0)
+            while True:
+                data = output.read(XLSX_READ_SIZE)
+                if not data:
+                    break
+                yield data
+
+    @api.model
+    def _stream(self, file_format, filters):
+        """Return a generator of the export file content, running on its own cursor"""
+        if file_format not in EXPORT_FORMATS:
+            raise UserError(_("Unsupported export format: %s", file_format))
+        if file_format == 'xlsx' and xlsxwriter is None:
+            raise UserError(_("The xlsxwriter library is required to export XLSX files"))
+        self.env['custom.book.loan'].check_access_rights('read')
+        registry, uid, context = self.pool, self.env.uid, dict(self.env.context)
+        allowed_company_ids = self.env.companies.ids
+
+        def stream():
+            start = time.monotonic()
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, dict(context, allowed_company_ids=allowed_company_ids))
+                yield from getattr(env[self._name], '_iter_%s' % file_format)(filters)
+            _logger.info("Loan export (%s) streamed in %.2fs", file_format, time.monotonic() - start)
+        return stream()
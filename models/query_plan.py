@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from .bookloan import OVERDUE_BATCH_SIZE
+from .dashboard_profile import QueryProfiler
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Page size of the list views
+LIST_LIMIT = 80
+
+# Statements explained (reads, and updates, which EXPLAIN does not run)
+EXPLAINED_STATEMENTS = ('SELECT', 'WITH', 'UPDATE')
+
+# Operations of the dashboard, the lists and the crons, with the indexes
+# expected in the plans of the queries they run (every one of them, e.g. one
+# per branch of the loan history); see _get_checked_operations()
+CHECKED_OPERATIONS = {
+    'revenue': ('custom_book_loan_state_actual_return_date_idx', 'custom_book_loan_archive_state_actual_return_date_idx'),
+    'revenue_series': ('custom_book_loan_state_actual_return_date_idx', 'custom_book_loan_archive_state_actual_return_date_idx'),
+    'loan_trend': ('custom_library_loan_daily_stats__day_index',),
+    'reading_times': ('custom_library_loan_daily_stats__day_index',),
+    'acquisitions': ('custom_book_acquisition_date_active_idx',),
+    'overdue_mark': ('custom_book_loan_state_return_date_idx',),
+    'overdue_fine': ('custom_book_loan_overdue_id_idx',),
+    'loan_list': ('custom_book_loan_loan_date_id_idx',),
+    'loan_history_list': ('custom_book_loan_loan_date_id_idx', 'custom_book_loan_archive_loan_date_id_idx'),
+    'member_counters': ('custom_book_loan__member_id_index', 'custom_book_loan_archive__member_id_index'),
+}
+
+class LibraryQueryPlan(models.AbstractModel):
+    _name = 'custom.library.query.plan'
+    _description = 'Library Query Plan Check'
+
+    @api.model
+    def _collect_indexes(self, plan):
+        """Return the names of the indexes used anywhere in an EXPLAIN JSON plan"""
+        indexes = set()
+        if plan.get('Index Name'):
+            indexes.add(plan['Index Name'])
+        for child in plan.get('Plans', []):
+            indexes |= self._collect_indexes(child)
+        return indexes
+
+    @api.model
+    def _get_checked_operations(self):
+        """Return {name: function} running the code of each checked operation"""
+        Dashboard = self.env['custom.library.dashboard'].with_context(dashboard_live=True)
+        # The cron runs as superuser, the lists as the current user
+        Loan = self.env['custom.book.loan']
+        domains = Loan._get_overdue_domains(fields.Date.today())
+        Member = self.env['custom.library.member']
+
+        def revenue():
+            Dashboard.new({'name': 'Library Dashboard', 'company_id': self.env.company.id}).total_revenue_ytd
+
+        return {
+            'revenue': revenue,
+            'revenue_series': lambda: Dashboard._get_section_data('revenue'),
+            'loan_trend': lambda: Dashboard._get_section_data('loan_trend'),
+            'reading_times': lambda: Dashboard._get_section_data('reading_times'),
+            'acquisitions': lambda: Dashboard._get_section_data('book_acquisitions'),
+            'overdue_mark': lambda: Loan.sudo()._search_overdue_batch(domains['mark'], 0, OVERDUE_BATCH_SIZE),
+            'overdue_fine': lambda: Loan.sudo()._search_overdue_batch(domains['fine'], 0, OVERDUE_BATCH_SIZE),
+            'loan_list': lambda: Loan.search([], limit=LIST_LIMIT),
+            'loan_history_list': lambda: self.env['custom.book.loan.history'].search([], limit=LIST_LIMIT),
+            'member_counters': lambda: Member._refresh_loan_counters(
+                Member.search([], limit=LIST_LIMIT).partner_id.ids),
+        }
+
+    @api.model
+    def _check_query_plans(self, force_index=True):
+        """Run the dashboard, list and cron operations and EXPLAIN the queries they executed.
+
+        The statements are captured with the query hooks of QueryProfiler, so
+        the check follows the code instead of copies of its SQL; the
+        operations are rolled back. On small tables PostgreSQL rightly prefers
+        sequential scans, so by default sequential scans are disabled for the
+        check to confirm that the expected index is usable. Returns
+        ``{name: {'expected', 'used', 'queries', 'ok'}}``, `ok` being None
+        when the operation ran no query to explain (e.g. without members).
+        """
+        cr = self.env.cr
+        operations = self._get_checked_operations()
+        result = {}
+        with cr.savepoint() as savepoint:
+            statements = {}
+            for name, operation in operations.items():
+                self.env.flush_all()
+                self.env.invalidate_all()
+                with QueryProfiler(name, 'plan', record_statements=True) as profiler:
+                    operation()
+                    self.env.flush_all()
+                statements[name] = [
+                    (query, params) for query, params in profiler.statements
+                    if query.lstrip().upper().startswith(EXPLAINED_STATEMENTS)
+                ]
+            if force_index:
+                cr.execute("SET LOCAL enable_seqscan = off")
+            for name, queries in statements.items():
+                expected = CHECKED_OPERATIONS[name]
+                used = set()
+                for query, params in queries:
+                    cr.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                    plan = cr.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    used |= self._collect_indexes(plan[0]['Plan'])
+                missing = [index for index in expected if index not in used]
+                result[name] = {
+                    'expected': list(expected),
+                    'used': sorted(used),
+                    'queries': len(queries),
+                    'ok': not missing if queries else None,
+                }
+                if queries and missing:
+                    _logger.warning("Operation %s does not use index %s (uses: %s)",
+                                    name, ', '.join(missing), ', '.join(sorted(used)) or 'none')
+            # Undo the operations, and the SET LOCAL a released savepoint would keep
+            savepoint.rollback()
+        self.env.invalidate_all()
+        return result
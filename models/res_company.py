@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    def unlink(self):
+        # Loans of the deleted companies are counted under no company in the daily statistics
+        self.env['custom.library.loan.daily.stats']._merge_into_empty_key('company_id', self.ids)
+        return super(ResCompany, self).unlink()
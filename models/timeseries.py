@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+import logging
+from dateutil.relativedelta import relativedelta
+
+_logger = logging.getLogger(__name__)
+
+# Number of months shown by the dashboard time series charts
+WINDOW_PARAM = 'individual_mod.dashboard_months'
+DEFAULT_WINDOW = 6
+ALLOWED_WINDOWS = (6, 12, 24, 36)
+
+GRANULARITIES = ('day', 'week', 'month')
+
+
+class LibraryTimeSeries(models.AbstractModel):
+    _name = 'custom.library.timeseries'
+    _description = 'Library Time Series Engine'
+
+    @api.model
+    def _get_window_months(self):
+        """Return the configured chart window in months"""
+        value = self.env['ir.config_parameter'].sudo().get_param(WINDOW_PARAM, DEFAULT_WINDOW)
+        try:
+            months = int(value)
+        except (TypeError, ValueError):
+            months = DEFAULT_WINDOW
+        if months not in ALLOWED_WINDOWS:
+            _logger.warning("Unsupported dashboard window %s, using %s months", value, DEFAULT_WINDOW)
+            months = DEFAULT_WINDOW
+        return months
+
+    @api.model
+    def _truncate(self, date, granularity):
+        """Python equivalent of PostgreSQL date_trunc for dates"""
+        if granularity == 'month':
+            return date.replace(day=1)
+        if granularity == 'week':
+            return date - relativedelta(days=date.weekday())
+        return date
+
+    @api.model
+    def _count_periods(self, date_from, date_to, granularity='month'):
+        """Number of buckets needed to cover the dates from `date_from` to `date_to`"""
+        start, end = self._truncate(date_from, granularity), self._truncate(date_to, granularity)
+        if granularity == 'month':
+            return (end.year - start.year) * 12 + end.month - start.month + 1
+        if granularity == 'week':
+            return (end - start).days // 7 + 1
+        return (end - start).days + 1
+
+    @api.model
+    def _get_buckets(self, granularity='month', periods=DEFAULT_WINDOW, date_to=None):
+        """Return the start date of the last `periods` buckets, oldest first"""
+        if granularity not in GRANULARITIES:
+            raise ValueError("Unsupported granularity: %s" % granularity)
+        step = relativedelta(**{granularity + 's': 1})
+        current = self._truncate(date_to or fields.Date.today(), granularity)
+        return [current - step * i for i in range(periods - 1, -1, -1)]
+
+    @api.model
+    def _format_bucket(self, bucket, granularity, periods):
+        if granularity == 'month':
+            # Add the year once the window spans more than a year
+            return bucket.strftime('%b %Y' if periods > 12 else '%b')
+        if granularity == 'week':
+            return bucket.strftime('W%V %G')
+        return bucket.strftime('%d %b')
+
+    @api.model
+    def _get_series(self, table, date_column, measures, granularity='month', periods=DEFAULT_WINDOW,
+                    date_to=None, where=None, params=None):
+        """Aggregate `table` into date buckets with a single GROUP BY query.
+
+        `measures` maps a series name to a SQL aggregate expression, e.g.
+        ``{'count': 'COUNT(*)', 'fines': 'SUM(fine_amount)'}``. Table, column
+        and expressions are trusted internal identifiers; filter values must be
+        passed through `params`. Buckets without rows are filled with zeros.
+        """
+        buckets = self._get_buckets(granularity, periods, date_to)
+        step = relativedelta(**{granularity + 's': 1})
+        names = list(measures)
+
+        query = """
+            SELECT date_trunc(%s, {date_column})::date AS bucket, {aggregates}
+            FROM {table}
+            WHERE {date_column} >= %s AND {date_column} < %s {where}
+            GROUP BY bucket
+        """.format(
+            date_column=date_column,
+            aggregates=', '.join('COALESCE(%s, 0)' % measures[name] for name in names),
+            table=table,
+            where='AND (%s)' % where if where else '',
+        )
+        self.env.cr.execute(query, [granularity, buckets[0], buckets[-1] + step] + list(params or []))
+        rows = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+
+        series = {name: [] for name in names}
+        for bucket in buckets:
+            values = rows.get(bucket, [0] * len(names))
+            for name, value in zip(names, values):
+                series[name].append(value)
+
+        return {
+            'labels': [self._format_bucket(bucket, granularity, periods) for bucket in buckets],
+            'buckets': buckets,
+            'series': series,
+        }
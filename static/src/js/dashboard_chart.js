@@ -1,6 +1,7 @@
 /** @odoo-module **/
 
 import { waitForChartJs } from './chart_setup';
+import { session } from "@web/session";
 
 /**
  * Library Dashboard Charts
@@ -11,6 +12,9 @@ import { waitForChartJs } from './chart_setup';
 class LibraryDashboardController {
     constructor() {
         this.chartData = null;
+        // Version of the loaded data, sent back so the server can answer "not modified"
+        this.dataVersion = null;
+        this.dataEtag = null;
         this.chartInstances = {};
         this.error = null;
         this.initialized = false;
@@ -81,6 +85,9 @@ class LibraryDashboardController {
             // Load chart data
             await this.loadChartData();
             
+            // Receive the sections rebuilt after data changes instead of polling
+            this.listenLiveUpdates();
+            
             this.initialized = true;
             this._initAttempts = 0; // Reset counter after successful initialization
         } catch (error) {
@@ -246,45 +253,63 @@ class LibraryDashboardController {
                 </div>
                 <div class="charts_container" style="width:100%; display:flex; flex-direction:column;">
                     <div class="chart_row" style="width:100%; display:flex; justify-content:space-between; margin-bottom:15px;">
-                        <div class="chart_section" style="width:calc(50% - 8px); flex:1;">
+                        <div class="chart_section" data-widget="loan_trend" style="width:calc(50% - 8px); flex:1;">
                             <h3><i class="fa fa-line-chart mr-2"></i>Loan Trends</h3>
                             <canvas id="loanChart" style="height:250px;"></canvas>
                         </div>
-                        <div class="chart_section" style="width:calc(50% - 8px); flex:1;">
+                        <div class="chart_section" data-widget="book_categories" style="width:calc(50% - 8px); flex:1;">
                             <h3><i class="fa fa-pie-chart mr-2"></i>Book Categories</h3>
                             <canvas id="categoryChart" style="height:250px;"></canvas>
                         </div>
                     </div>
                     <div class="chart_row" style="width:100%; display:flex; justify-content:space-between; margin-bottom:15px;">
-                        <div class="chart_section" style="width:calc(50% - 8px); flex:1;">
+                        <div class="chart_section" data-widget="book_acquisitions" style="width:calc(50% - 8px); flex:1;">
                             <h3><i class="fa fa-bar-chart mr-2"></i>Book Acquisitions</h3>
                             <canvas id="acquisitionsChart" style="height:250px;"></canvas>
                         </div>
-                        <div class="chart_section" style="width:calc(50% - 8px); flex:1;">
+                        <div class="chart_section" data-widget="loan_status" style="width:calc(50% - 8px); flex:1;">
                             <h3><i class="fa fa-pie-chart mr-2"></i>Loan Status</h3>
                             <canvas id="loanStatusChart" style="height:250px;"></canvas>
                         </div>
                     </div>
                     <div class="chart_row" style="width:100%; display:flex; justify-content:space-between; margin-bottom:15px;">
-                        <div class="chart_section" style="width:calc(50% - 8px); flex:1;">
+                        <div class="chart_section" data-widget="member_activities" style="width:calc(50% - 8px); flex:1;">
                             <h3><i class="fa fa-users mr-2"></i>Member Activities</h3>
                             <canvas id="memberActivitiesChart" style="height:250px;"></canvas>
                         </div>
-                        <div class="chart_section" style="width:calc(50% - 8px); flex:1;">
+                        <div class="chart_section" data-widget="book_condition" style="width:calc(50% - 8px); flex:1;">
                             <h3><i class="fa fa-circle-o-notch mr-2"></i>Book Condition</h3>
                             <canvas id="bookConditionChart" style="height:250px;"></canvas>
                         </div>
                     </div>
                     <div class="chart_row" style="width:100%; display:flex; justify-content:space-between; margin-bottom:15px;">
-                        <div class="chart_section" style="width:calc(50% - 8px); flex:1;">
+                        <div class="chart_section" data-widget="revenue" style="width:calc(50% - 8px); flex:1;">
                             <h3><i class="fa fa-money mr-2"></i>Revenue by Month</h3>
                             <canvas id="revenueChart" style="height:250px;"></canvas>
                         </div>
-                        <div class="chart_section" style="width:calc(50% - 8px); flex:1;">
+                        <div class="chart_section" data-widget="reading_times" style="width:calc(50% - 8px); flex:1;">
                             <h3><i class="fa fa-clock-o mr-2"></i>Popular Reading Times</h3>
                             <canvas id="readingTimesChart" style="height:250px;"></canvas>
                         </div>
                     </div>
+                    <div class="chart_row" style="width:100%; display:flex; justify-content:space-between; margin-bottom:15px;">
+                        <div class="chart_section" data-widget="reading_heatmap" style="width:100%; flex:1;">
+                            <h3><i class="fa fa-th mr-2"></i>Borrowing Activity by Weekday</h3>
+                            <div id="readingHeatmap" style="overflow-x:auto;"></div>
+                        </div>
+                    </div>
+                    <div class="chart_row" style="width:100%; display:flex; justify-content:space-between; margin-bottom:15px;">
+                        <div class="chart_section" data-widget="loan_durations" style="width:100%; flex:1;">
+                            <h3>
+                                <i class="fa fa-hourglass-half mr-2"></i>Loan Durations
+                                <select id="loanDurationsBreakdown" class="o_input float-end" style="width:auto; font-size:12px;">
+                                    <option value="membership">By membership type</option>
+                                    <option value="genre">By genre</option>
+                                </select>
+                            </h3>
+                            <canvas id="loanDurationsChart" style="height:250px;"></canvas>
+                        </div>
+                    </div>
                 </div>
             </div>
         `;
@@ -310,6 +335,13 @@ class LibraryDashboardController {
                     return;
                 }
                 
+                // Load each chart separately as it scrolls into view when supported
+                if (this.setupLazyWidgets()) {
+                    this._loadAttempts = 0;
+                    resolve();
+                    return;
+                }
+                
                 // Try to fetch from the server - ALWAYS use server data
                 try {
                     await this.fetchDataFromServer();
@@ -562,79 +594,24 @@ class LibraryDashboardController {
             try {
                 const fetchData = async () => {
                     try {
-                        // Check if we're inside Odoo's environment
-                        let result;
+                        // Plain GET, so the data comes gzipped and is only sent again when its version changed
+                        let result = await this._fetchJson('/library/dashboard/data.json', {}, this.chartData ? this.dataEtag : null);
                         
-                        if (typeof odoo !== 'undefined' && odoo.define) {
-                            // Attempt to use Odoo's RPC mechanism
-                            try {
-                                if (typeof this._rpc !== 'undefined') {
-                                    result = await this._rpc({
-                                        route: '/library/dashboard/data',
-                                        params: {}
-                                    });
-                                } else if (typeof window._rpc !== 'undefined') {
-                                    result = await window._rpc({
-                                        route: '/library/dashboard/data',
-                                        params: {}
-                                    });
-                                } else if (typeof window.rpc !== 'undefined') {
-                                    result = await window.rpc(
-                                        '/library/dashboard/data', 
-                                        {}
-                                    );
-                                } else {
-                                    // Fallback to jQuery AJAX if Odoo's RPC not available
-                                    result = await $.ajax({
-                                        url: '/library/dashboard/data',
-                                        type: 'POST',
-                                        data: JSON.stringify({
-                                            jsonrpc: "2.0",
-                                            method: "call",
-                                            params: {},
-                                            id: new Date().getTime()
-                                        }),
-                                        contentType: 'application/json',
-                                        dataType: 'json'
-                                    });
-                                }
-                            } catch (rpcError) {
-                                reject(rpcError);
-                                return;
-                            }
-                        } else {
-                            // Fallback to regular fetch API
-                            const response = await fetch('/library/dashboard/data', {
-                                method: 'POST',
-                                headers: {
-                                    'Content-Type': 'application/json',
-                                },
-                                body: JSON.stringify({
-                                    jsonrpc: "2.0", 
-                                    method: "call",
-                                    params: {},
-                                    id: new Date().getTime()
-                                }),
-                            });
-                            
-                            if (!response.ok) {
-                                throw new Error(`Server responded with status: ${response.status}`);
-                            }
-                            
-                            result = await response.json();
+                        if (result === null) {
+                            result = { success: true, not_modified: true, version: this.dataVersion };
                         }
                         
-                        // Handle Odoo JSONRPC response format
-                        // The response comes as {jsonrpc: '2.0', id: null, result: {our_actual_data}}
-                        if (result && result.jsonrpc === '2.0' && result.result) {
-                            // This is an Odoo jsonrpc response, extract actual result
-                            result = result.result;
+                        // Data unchanged since the last load: keep the rendered charts
+                        if (result && result.not_modified && this.chartData) {
+                            resolve(result);
+                            return;
                         }
                         
                         // Check if the result is valid - with improved validation 
                         if (result && result.success === true && result.data) {
                             // Parse and store the data
                             this.chartData = result.data;
+                            this.dataVersion = result.version || null;
                             
                             // Update the UI immediately
                             this.renderCharts();
@@ -644,6 +621,7 @@ class LibraryDashboardController {
                             // Alternative valid format - some Odoo versions might not set the success flag
                             // But at least we have data
                             this.chartData = result.data;
+                            this.dataVersion = result.version || null;
                             this.renderCharts();
                             resolve(result);
                         } else {
@@ -661,6 +639,151 @@ class LibraryDashboardController {
         });
     }
     
+    // Observe the chart sections and load each widget when it becomes visible
+    setupLazyWidgets() {
+        if (typeof IntersectionObserver === 'undefined') {
+            return false;
+        }
+        
+        const sections = document.querySelectorAll('.chart_section[data-widget]');
+        if (!sections.length) {
+            return false;
+        }
+        
+        if (this._widgetObserver) {
+            this._widgetObserver.disconnect();
+        }
+        this.chartData = this.chartData || {};
+        
+        this._widgetObserver = new IntersectionObserver((entries, observer) => {
+            entries.forEach(entry => {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    this.loadWidget(entry.target.dataset.widget);
+                }
+            });
+        }, { rootMargin: '200px' });
+        
+        sections.forEach(section => this._widgetObserver.observe(section));
+        return true;
+    }
+    
+    // Fetch and render a single dashboard section
+    async loadWidget(name) {
+        try {
+            const result = await this._fetchJson('/library/dashboard/data.json', { section: name });
+            
+            if (!result || result.success !== true || !result.data) {
+                throw new Error((result && result.message) || "Server returned an error or invalid data");
+            }
+            
+            this.chartData[name] = result.data;
+            if (result.version) {
+                this.dataVersion = result.version;
+            }
+            this.renderWidget(name);
+        } catch (error) {
+            this.displayChartError(name, error);
+        }
+    }
+    
+    // Render the chart of a single section from this.chartData
+    renderWidget(name) {
+        const renderers = {
+            'loan_trend': data => this.renderLoanTrendsChart(data),
+            'book_categories': data => this.renderCategoriesChart(data),
+            'book_acquisitions': data => this.renderAcquisitionsChart(data),
+            'loan_status': data => this.renderLoanStatusChart(data),
+            'member_activities': data => this.renderMemberActivitiesChart(data),
+            'book_condition': data => this.renderBookConditionChart(data),
+            'revenue': data => this.renderRevenueChart(data),
+            'reading_times': data => this.renderReadingTimesChart(data),
+            'reading_heatmap': data => this.renderReadingHeatmap(data),
+            'loan_durations': data => this.renderLoanDurationsChart(data)
+        };
+        
+        const data = this.chartData && this.chartData[name];
+        if (!renderers[name] || !data) {
+            return;
+        }
+        
+        try {
+            renderers[name](data);
+            this.handleResize();
+        } catch (error) {
+            this.displayChartError(name, error);
+        }
+    }
+    
+    // Current company of the company switcher (cids cookie), null when unknown
+    getCompanyId() {
+        const match = document.cookie.match(/(?:^|;\s*)cids=([^;]*)/);
+        if (!match) {
+            return null;
+        }
+        const companyId = parseInt(decodeURIComponent(match[1]).split(/[-,]/)[0], 10);
+        return isNaN(companyId) ? null : companyId;
+    }
+    
+    // Subscribe to the bus notifications sent when the company snapshot is rebuilt
+    listenLiveUpdates() {
+        const live = window.libraryDashboardLive;
+        const companyId = this.getCompanyId() ||
+            (session.user_companies && session.user_companies.current_company);
+        if (!live || !companyId) {
+            return;
+        }
+        live.listen(companyId, payload => this.applyLiveUpdate(payload));
+    }
+    
+    // Redraw the sections pushed by the server, or reload the data when they were not included
+    async applyLiveUpdate(payload) {
+        if (!payload.version || payload.version === this.dataVersion) {
+            return;
+        }
+        if (!payload.sections || !this.chartData) {
+            try {
+                await this.fetchDataFromServer();
+            } catch (error) {
+            }
+            return;
+        }
+        this.chartData = {...this.chartData, ...payload.sections};
+        this.dataVersion = payload.version;
+        Object.keys(payload.sections).forEach(name => this.renderWidget(name));
+    }
+    
+    // GET a dashboard JSON route for the current company, null when the server answers
+    // that `etag` is still current
+    async _fetchJson(route, params, etag) {
+        const query = new URLSearchParams(params);
+        const companyId = this.getCompanyId();
+        if (companyId) {
+            query.set('company_id', companyId);
+        }
+        const headers = { 'Accept': 'application/json' };
+        if (etag) {
+            headers['If-None-Match'] = etag;
+        }
+        
+        const response = await fetch(`${route}?${query}`, {
+            method: 'GET',
+            headers: headers,
+            credentials: 'same-origin',
+        });
+        
+        if (response.status === 304) {
+            return null;
+        }
+        if (!response.ok) {
+            throw new Error(`Server responded with status: ${response.status}`);
+        }
+        if (!params.section) {
+            this.dataEtag = response.headers.get('ETag');
+        }
+        return response.json();
+    }
+    
     renderCharts() {
         return new Promise(async (resolve, reject) => {
             try {
@@ -716,7 +839,9 @@ class LibraryDashboardController {
                     this.renderChartWithFallback('memberActivities', () => this.renderMemberActivitiesChart(this.chartData.memberActivities || this.chartData.member_activities)),
                     this.renderChartWithFallback('bookCondition', () => this.renderBookConditionChart(this.chartData.bookCondition || this.chartData.book_condition)),
                     this.renderChartWithFallback('revenue', () => this.renderRevenueChart(this.chartData.revenue)),
-                    this.renderChartWithFallback('readingTimes', () => this.renderReadingTimesChart(this.chartData.readingTimes || this.chartData.reading_times))
+                    this.renderChartWithFallback('readingTimes', () => this.renderReadingTimesChart(this.chartData.readingTimes || this.chartData.reading_times)),
+                    this.renderChartWithFallback('reading_heatmap', () => this.renderReadingHeatmap(this.chartData.reading_heatmap)),
+                    this.renderChartWithFallback('loan_durations', () => this.renderLoanDurationsChart(this.chartData.loan_durations))
                 ]);
                 
                 this.handleResize();
@@ -803,7 +928,9 @@ class LibraryDashboardController {
             'member_activities': 'memberActivitiesChart',
             'book_condition': 'bookConditionChart',
             'revenue': 'revenueChart',
-            'reading_times': 'readingTimesChart'
+            'reading_times': 'readingTimesChart',
+            'reading_heatmap': 'readingHeatmap',
+            'loan_durations': 'loanDurationsChart'
         };
         return mapping[chartKey];
     }
@@ -971,6 +1098,85 @@ class LibraryDashboardController {
         this.chartInstances.revenueChart = this.safelyCreateChart('revenueChart', 'bar', data, options);
     }
     
+    // Render the loan duration histogram, stacked by membership type or by genre
+    renderLoanDurationsChart(data) {
+        if (!data || !data.labels) {
+            return;
+        }
+        
+        const select = document.getElementById('loanDurationsBreakdown');
+        const byGenre = select && select.value === 'genre';
+        const chartData = {
+            labels: data.labels,
+            datasets: (byGenre ? data.genre_datasets : data.datasets) || []
+        };
+        const options = {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                legend: {
+                    position: 'top',
+                    labels: {
+                        boxWidth: 12,
+                        font: {
+                            size: 11
+                        }
+                    }
+                }
+            },
+            scales: {
+                x: {
+                    stacked: true,
+                    grid: {
+                        display: false
+                    }
+                },
+                y: {
+                    stacked: true,
+                    beginAtZero: true,
+                    ticks: {
+                        precision: 0
+                    }
+                }
+            }
+        };
+        
+        this.chartInstances.loanDurationsChart = this.safelyCreateChart('loanDurationsChart', 'bar', chartData, options);
+        
+        if (select && !select.dataset.bound) {
+            select.dataset.bound = '1';
+            select.addEventListener('change', () => this.renderLoanDurationsChart(this.chartData.loan_durations || data));
+        }
+    }
+    
+    // Render the weekday x month heatmap as a table shaded by loan count
+    renderReadingHeatmap(data) {
+        const container = document.getElementById('readingHeatmap');
+        if (!container || !data || !data.rows) {
+            return;
+        }
+        
+        const max = data.max || 1;
+        const cellStyle = 'padding:4px 6px; text-align:center; font-size:11px;';
+        let html = `<table style="width:100%; border-collapse:separate; border-spacing:2px;"><thead><tr><th></th>`;
+        data.labels.forEach(label => {
+            html += `<th style="${cellStyle} font-weight:normal;">${label}</th>`;
+        });
+        html += '</tr></thead><tbody>';
+        data.rows.forEach((day, rowIndex) => {
+            html += `<tr><th style="${cellStyle} text-align:right; font-weight:normal;">${day}</th>`;
+            data.data[rowIndex].forEach((count, columnIndex) => {
+                const alpha = count ? 0.15 + 0.85 * count / max : 0.04;
+                const color = alpha > 0.6 ? '#fff' : '#35495e';
+                html += `<td title="${day} ${data.labels[columnIndex]}: ${count}"
+                             style="${cellStyle} background-color:rgba(103, 58, 183, ${alpha.toFixed(2)}); color:${color};">${count}</td>`;
+            });
+            html += '</tr>';
+        });
+        html += '</tbody></table>';
+        container.innerHTML = html;
+    }
+    
     // Render Reading Times Chart
     renderReadingTimesChart(data) {
         const options = {
@@ -1530,17 +1736,17 @@ class LibraryDashboardController {
                         if (typeof this._rpc !== 'undefined') {
                             result = await this._rpc({
                                 route: '/library/dashboard/data',
-                                params: { refresh: true }
+                                params: { refresh: true, version: this.dataVersion, company_id: this.getCompanyId() }
                             });
                         } else if (typeof window._rpc !== 'undefined') {
                             result = await window._rpc({
                                 route: '/library/dashboard/data',
-                                params: { refresh: true }
+                                params: { refresh: true, version: this.dataVersion, company_id: this.getCompanyId() }
                             });
                         } else if (typeof window.rpc !== 'undefined') {
                             result = await window.rpc(
                                 '/library/dashboard/data', 
-                                { refresh: true }
+                                { refresh: true, version: this.dataVersion, company_id: this.getCompanyId() }
                             );
                         } else {
                             // Fallback to jQuery AJAX if rpc not available
@@ -1550,7 +1756,7 @@ class LibraryDashboardController {
                                 data: JSON.stringify({ 
                                     jsonrpc: "2.0",
                                     method: "call",
-                                    params: { refresh: true },
+                                    params: { refresh: true, version: this.dataVersion, company_id: this.getCompanyId() },
                                     id: new Date().getTime()
                                 }),
                                 contentType: 'application/json',
@@ -1564,10 +1770,17 @@ class LibraryDashboardController {
                             result = result.result;
                         }
                         
+                        // Rebuilt data is identical: redraw the charts we already have
+                        if (result && result.not_modified && this.chartData) {
+                            await this.renderCharts();
+                            return result;
+                        }
+                        
                         // Improved validation of server response
                         if (result && result.success === true && result.data) {
                             // Store the new data
                             this.chartData = result.data;
+                            this.dataVersion = result.version || null;
                             
                             // Re-render all charts with new data
                             await this.renderCharts();
@@ -1576,6 +1789,7 @@ class LibraryDashboardController {
                         } else if (result && result.data) {
                             // Alternative valid format
                             this.chartData = result.data;
+                            this.dataVersion = result.version || null;
                             await this.renderCharts();
                             return result;
                         } else {
@@ -1689,7 +1903,8 @@ class LibraryDashboardController {
                 'memberActivitiesChart',
                 'bookConditionChart',
                 'revenueChart',
-                'readingTimesChart'
+                'readingTimesChart',
+                'loanDurationsChart'
             ];
             
             // Replace all canvas elements to ensure clean state
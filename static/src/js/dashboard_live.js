@@ -0,0 +1,55 @@
+/** @odoo-module **/
+
+import { registry } from "@web/core/registry";
+
+/**
+ * Library Dashboard Live Updates
+ * Listens on the bus channel of the current company and hands the sections
+ * pushed after each snapshot rebuild to the open dashboard
+ */
+
+const CHANNEL_PREFIX = 'library_dashboard_';
+
+export const libraryDashboardLiveService = {
+    dependencies: ["bus_service"],
+
+    start(env, { bus_service }) {
+        let channel = null;
+        let listener = null;
+
+        bus_service.subscribe('library_dashboard/updated', payload => {
+            if (listener && payload) {
+                listener(payload);
+            }
+        });
+
+        const service = {
+            // Receive the updates of a company, replacing the previous listener
+            listen(companyId, callback) {
+                const name = CHANNEL_PREFIX + companyId;
+                if (channel !== name) {
+                    if (channel) {
+                        bus_service.deleteChannel(channel);
+                    }
+                    bus_service.addChannel(name);
+                    channel = name;
+                }
+                listener = callback;
+            },
+
+            stop() {
+                if (channel) {
+                    bus_service.deleteChannel(channel);
+                }
+                channel = null;
+                listener = null;
+            },
+        };
+
+        // The dashboard controller is not a component, it reaches the service from here
+        window.libraryDashboardLive = service;
+        return service;
+    },
+};
+
+registry.category("services").add("library_dashboard_live", libraryDashboardLiveService);